@@ -0,0 +1,144 @@
+'''
+Ledger benchmark suite.
+
+Usage:
+    python -m benchmarks                                   # SQLite + local Postgres, 10k/100k/1M transactions
+    python -m benchmarks --sizes 10000 --backend sqlite    # quick run
+    python -m benchmarks --baseline old.json               # flag regressions against a previous run
+
+Each backend runs in a separate process (see benchmarks/ledger.py). Results of all backends are merged
+into one JSON report. With --baseline, every benchmark whose median got slower by more than --threshold
+is reported as a regression and the exit code is 1.
+'''
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+# Import of the project plus create_app() in a fresh interpreter (what every gunicorn worker pays on boot)
+STARTUP_TARGET_S = 0.5
+STARTUP_SNIPPET = "import time; start = time.perf_counter(); from project import create_app; create_app(); print(time.perf_counter() - start)"
+DEFAULT_DATABASE_URLS = {
+    "sqlite": "sqlite:///benchmark.db",
+    "postgres": "postgresql://localhost/flask_banking_benchmark",
+}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_backend(backend, database_url, args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output = os.path.join(tmp_dir, f"{backend}.json")
+        command = [sys.executable, "-m", "benchmarks.ledger",
+                   "--backend", backend,
+                   "--database-url", database_url,
+                   "--sizes", *[str(size) for size in args.sizes],
+                   "--repeat", str(args.repeat),
+                   "--writes", str(args.writes),
+                   "--seed", str(args.seed),
+                   "--output", output]
+        # App output (print statements) is discarded, progress is reported on stderr
+        completed = subprocess.run(command, stdout=subprocess.DEVNULL)
+        if completed.returncode != 0:
+            return {"backend": backend, "database_url": database_url, "results": [],
+                    "skipped": f"Benchmark process exited with code {completed.returncode}"}
+        with open(output) as f:
+            return json.load(f)
+
+def measure_startup(repeat):
+    timings = []
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, "-c", STARTUP_SNIPPET], capture_output=True, text=True, check=True,
+                                   env={**os.environ, "SECRET_KEY_LOCAL": os.getenv("SECRET_KEY_LOCAL", "benchmark")})
+        timings.append(float(completed.stdout.strip().splitlines()[-1]))
+    median = statistics.median(timings)
+    return {"name": "startup", "backend": None, "size": None, "repeat": repeat,
+            "min_s": min(timings), "median_s": median, "mean_s": statistics.mean(timings), "max_s": max(timings),
+            "target_s": STARTUP_TARGET_S, "within_target": median <= STARTUP_TARGET_S}
+
+def result_key(result):
+    '''Identifies a benchmark across runs: backend, size, name and labels (e.g. read_all filters).'''
+    labels = {key: value for key, value in result.items() if not key.endswith("_s") and key not in ("repeat", "within_target")}
+    return json.dumps(labels, sort_keys=True)
+
+def find_regressions(baseline, report, threshold):
+    baseline_medians = {result_key(result): result["median_s"] for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        previous = baseline_medians.get(result_key(result))
+        if previous and result["median_s"] > previous * (1 + threshold):
+            regressions.append({**json.loads(result_key(result)),
+                                "baseline_median_s": previous,
+                                "median_s": result["median_s"],
+                                "slowdown": result["median_s"] / previous})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", action="append", choices=DEFAULT_DATABASE_URLS.keys(),
+                        help="Backend(s) to run (default: all)")
+    parser.add_argument("--sqlite-url", default=DEFAULT_DATABASE_URLS["sqlite"])
+    parser.add_argument("--postgres-url", default=os.getenv("BENCHMARK_POSTGRES_URL", DEFAULT_DATABASE_URLS["postgres"]))
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=3, help="Samples per read benchmark")
+    parser.add_argument("--writes", type=int, default=20, help="Samples per write benchmark")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="Previous results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed relative slowdown of the median")
+    args = parser.parse_args(argv)
+
+    database_urls = {"sqlite": args.sqlite_url, "postgres": args.postgres_url}
+    backends = args.backend or list(database_urls.keys())
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": args.sizes,
+            "seed": args.seed,
+        },
+        "skipped": {},
+        "results": [],
+    }
+
+    startup = measure_startup(max(args.repeat, 5))
+    if not startup["within_target"]:
+        print(f"Startup took {startup['median_s']:.3f}s, target is {STARTUP_TARGET_S}s", file=sys.stderr)
+    report["results"].append(startup)
+
+    for backend in backends:
+        backend_report = run_backend(backend, database_urls[backend], args)
+        if backend_report.get("skipped"):
+            print(f"[{backend}] skipped: {backend_report['skipped']}", file=sys.stderr)
+            report["skipped"][backend] = backend_report["skipped"]
+        report["results"].extend(backend_report["results"])
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["regressions"] = find_regressions(baseline, report, args.threshold)
+        for regression in report["regressions"]:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        exit_code = 1 if report["regressions"] else 0
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(report['results'])} results to {args.output}", file=sys.stderr)
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+'''
+Runs the ledger benchmarks against a single database.
+
+The engine in project/db.py is bound once per process, so every database is measured in its own
+process (see benchmarks/__main__.py). Results are written as JSON to --output.
+'''
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+SEARCH_TYPES = [None, "Matches", "Includes"]
+DATE_FILTERS = ["none", "start", "end", "start_end"]
+
+HISTORY_MONTHS = 36
+INGEST_TRANSACTIONS = 400
+INGEST_THREADS = 8
+
+
+## Setup
+def create_benchmark_app(database_url):
+    # Config reads the database url from the environment at import time
+    os.environ["DATABASE_URL_LOCAL"] = database_url
+    os.environ.setdefault("SECRET_KEY_LOCAL", "benchmark")
+
+    from project import create_app
+    from project.db import init_db
+    app = create_app(test_setup=True)
+    init_db()
+
+    from project.models import Account, Transaction
+    from project.db import db_session
+    return app, Account, Transaction, db_session
+
+def reset_database(Account, Transaction, db_session):
+    Transaction.query.delete()
+    Account.query.delete()
+    db_session.commit()
+
+def seed_transactions(Account, Transaction, db_session, size, seed):
+    '''Seeds `size` transactions across two accounts and returns (main_account_id, descriptions).'''
+    from project.db import get_engine
+    from project.seed import seed_database
+
+    account_ids = seed_database(get_engine(), num_accounts=2, num_transactions=size, seed=seed, months=HISTORY_MONTHS)
+    descriptions = sorted(row[0] for row in db_session.query(Transaction.description).filter(Transaction.account_id == account_ids[0]).distinct().all())
+    return account_ids[0], descriptions
+
+## Measurements
+def measure(name, func, repeat, **labels):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "name": name,
+        **labels,
+        "repeat": repeat,
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "mean_s": statistics.mean(timings),
+        "max_s": max(timings),
+    }
+
+def read_all_kwargs(date_filter, category, search_type, descriptions):
+    today = datetime.utcnow().date()
+    kwargs = {}
+    if date_filter in ("start", "start_end"):
+        kwargs["start_date"] = today - timedelta(days=90)
+    if date_filter in ("end", "start_end"):
+        kwargs["end_date"] = today - timedelta(days=30)
+    if category is not None:
+        kwargs["category"] = category
+    if search_type == "Matches":
+        kwargs["search_type"] = "Matches"
+        kwargs["transaction_description"] = descriptions[0]
+    elif search_type == "Includes":
+        kwargs["search_type"] = "Includes"
+        kwargs["transaction_description"] = descriptions[0][:4]
+    return kwargs
+
+def ingest(account_id, total, threads, queued):
+    '''Creates `total` transactions from `threads` concurrent threads (like parallel API requests).'''
+    from project.db import db_session
+    from project.models import Account
+    from project.transactions.transactions import create_transaction
+    from project.transactions.write_queue import write_queue
+
+    def worker():
+        account = Account.query.get(account_id)
+        for _ in range(total // threads):
+            if queued:
+                write_queue.submit(account_id, "Benchmark ingest", -1.5, "Groceries").result()
+            else:
+                status, message, _ = create_transaction(account=account, description="Benchmark ingest", amount=-1.5, category="Groceries")
+                assert status == "success", message
+        db_session.remove()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+def run_size(app, Account, Transaction, db_session, size, repeat, writes, seed):
+    from project.transactions.transactions import create_transaction
+
+    seeded = {}
+    def seed_all():
+        seeded["account_id"], seeded["descriptions"] = seed_transactions(Account, Transaction, db_session, size, seed)
+    results = [measure("seed", seed_all, 1)]
+    account_id, descriptions = seeded["account_id"], seeded["descriptions"]
+
+    # Writes
+    def create_one():
+        status, message, _ = create_transaction(account=Account.query.get(account_id), description="Benchmark write", amount=-12.5, category="Groceries")
+        assert status == "success", message
+    results.append(measure("create_transaction", create_one, writes))
+
+    # Sustained ingestion from concurrent requests, one commit per transaction vs group commit
+    from project.transactions.write_queue import write_queue
+    for queued in (False, True):
+        results.append(measure("ingest", lambda: ingest(account_id, INGEST_TRANSACTIONS, INGEST_THREADS, queued), 1,
+                               write_queue=queued, transactions=INGEST_TRANSACTIONS, threads=INGEST_THREADS))
+    write_queue.stop()
+
+    rng = random.Random(seed)
+    transaction_ids = [row[0] for row in db_session.query(Transaction.id).filter(Transaction.account_id == account_id).limit(1000).all()]
+    results.append(measure("calculate_saldo", lambda: Transaction.query.get(rng.choice(transaction_ids)).calculate_saldo(), writes))
+    db_session.remove()
+
+    # Reads
+    for date_filter, category, search_type in itertools.product(DATE_FILTERS, [None, "Groceries"], SEARCH_TYPES):
+        kwargs = read_all_kwargs(date_filter, category, search_type, descriptions)
+        results.append(measure("read_all", lambda: Transaction.read_all(account_id=account_id, **kwargs), repeat,
+                               date_filter=date_filter, category=category, search_type=search_type))
+        db_session.remove()
+
+    transactions = Transaction.read_all(account_id=account_id)
+    results.append(measure("group_by_month", lambda: Transaction.group_by_month(transactions), repeat))
+    del transactions
+    db_session.remove()
+
+    # Routes
+    client = app.test_client()
+    results.append(measure("accounts.show", lambda: client.get(f"/accounts/{account_id}"), repeat, transactions_filter="default_30_days"))
+    results.append(measure("accounts.show", lambda: client.get(f"/accounts/{account_id}?transactions_filter=cleared"), repeat, transactions_filter="cleared"))
+    db_session.remove()
+
+    csv_form = {"account_id": account_id, "start_date": "None", "end_date": "None", "transaction_description": "None", "search_type": "None"}
+    results.append(measure("download_csv", lambda: client.post("/download_csv", data=csv_form).data, repeat))
+    db_session.remove()
+
+    for result in results:
+        result["size"] = size
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--backend", required=True)
+    parser.add_argument("--sizes", type=int, nargs="+", required=True)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--writes", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args(argv)
+
+    report = {"backend": args.backend, "database_url": args.database_url, "results": []}
+    try:
+        app, Account, Transaction, db_session = create_benchmark_app(args.database_url)
+    except Exception as e:  # e.g. no local Postgres running
+        report["skipped"] = f"Could not set up database: {e}"
+    else:
+        for size in args.sizes:
+            print(f"[{args.backend}] {size} transactions", file=sys.stderr)
+            for result in run_size(app, Account, Transaction, db_session, size, args.repeat, args.writes, args.seed):
+                result["backend"] = args.backend
+                report["results"].append(result)
+        reset_database(Account, Transaction, db_session)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
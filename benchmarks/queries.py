@@ -0,0 +1,94 @@
+'''
+Per-query Python overhead of the statements in project/queries.py.
+
+Usage:
+    python -m benchmarks.queries                  # in-memory SQLite
+    python -m benchmarks.queries --calls 20000
+
+Every query runs against a tiny in-memory SQLite database, so the database work is negligible and the
+timings are dominated by what happens in Python: building the statement, looking up (or compiling) its
+SQL and processing the result. Each query is measured as it was built before (a new ORM Query per call)
+and through project/queries.py.
+'''
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+SEED_TRANSACTIONS = 20
+
+
+## Setup
+def create_benchmark_app():
+    os.environ["DATABASE_URL_LOCAL"] = "sqlite://"
+    os.environ.setdefault("SECRET_KEY_LOCAL", "benchmark")
+
+    from project import create_app
+    from project.db import init_db, get_engine, db_session
+    from project.models import Account
+    from project.seed import seed_database
+    app = create_app(test_setup=True)
+    init_db()
+
+    account_id = seed_database(get_engine(), num_accounts=1, num_transactions=SEED_TRANSACTIONS, months=1)[0]
+    return app, db_session.get(Account, account_id).iban, account_id
+
+## Queries
+def query_pairs(iban, account_id):
+    '''name -> (query as built before, query through project/queries.py)'''
+    from sqlalchemy import desc, func
+    from project import queries
+    from project.db import db_session
+    from project.models import Account, Transaction
+
+    booked = datetime.utcnow() - timedelta(days=10)
+    booked_from = datetime.utcnow() - timedelta(days=20)
+    return {
+        "iban_exists": (
+            lambda: db_session.query(Account).filter_by(iban=iban).first() is not None,
+            lambda: queries.iban_exists(iban)),
+        "saldo_before": (
+            lambda: db_session.query(func.sum(Transaction.amount)).filter(
+                Transaction.utc_datetime_booked < booked, Transaction.account_id == account_id).scalar(),
+            lambda: queries.saldo_before(account_id, booked)),
+        "account_transactions": (
+            lambda: db_session.query(Transaction).filter(Transaction.account_id == account_id, Transaction.utc_datetime_booked >= booked_from,
+                                                         Transaction.description.ilike("%a%")).order_by(desc(Transaction.utc_datetime_booked)).all(),
+            lambda: queries.account_transactions(Transaction, account_id, booked_from=booked_from, description="a")),
+    }
+
+## Measurements
+def measure(func, calls, repeat):
+    '''Median time per call (in microseconds) over `repeat` runs of `calls` calls.'''
+    func() # Warm up (fills the compiled cache)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        timings.append((time.perf_counter() - start) / calls * 1e6)
+    return statistics.median(timings)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=5000, help="Calls per run")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per query")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    _, iban, account_id = create_benchmark_app()
+    results = []
+    for name, (before, after) in query_pairs(iban, account_id).items():
+        before_us, after_us = measure(before, args.calls, args.repeat), measure(after, args.calls, args.repeat)
+        results.append({"name": name, "before_us": before_us, "after_us": after_us, "speedup": before_us / after_us})
+        print(f"{name:<22} before {before_us:8.1f} us   after {after_us:8.1f} us   {before_us / after_us:.2f}x", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
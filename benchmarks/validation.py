@@ -0,0 +1,87 @@
+'''
+Per-request overhead of the API request validation (API_VALIDATION, see project/validation.py).
+
+Usage:
+    python -m benchmarks.validation
+    python -m benchmarks.validation --calls 20000 --output validation.json
+
+For every mode ("full", "compiled" and "development" as it runs in production, i.e. compiled)
+two things are measured for POST /api/accounts/<id>/transactions:
+- validation: connexion's body and parameter validation of the request, around an endpoint doing nothing
+- request: the whole request through the API app, against an in-memory SQLite database
+The difference of the request timings to "full" is the saving of compiled validation in a request.
+'''
+import argparse
+import json
+import os
+import sys
+
+from benchmarks.queries import create_benchmark_app, measure
+
+BODY = {"description": "Tesco groceries", "amount": -25.5, "category": "Groceries"}
+MODES = [("full", False), ("compiled", False), ("development", True)]
+
+
+## Validation only
+def create_transaction_validation(mode, is_production):
+    '''Function validating one create transaction request, with the validators of the mode.'''
+    from connexion.decorators.validation import ParameterValidator, RequestBodyValidator
+    from connexion.json_schema import resolve_refs
+    from connexion.lifecycle import ConnexionRequest
+    from project import load_spec
+    from project.validation import validator_map
+
+    spec = resolve_refs(load_spec())
+    operation = spec["paths"]["/accounts/{account_id}/transactions"]["post"]
+    schema = operation["requestBody"]["content"]["application/json"]["schema"]
+    validators = validator_map(mode, is_production) or {"body": RequestBodyValidator, "parameter": ParameterValidator}
+
+    endpoint = lambda request: None
+    endpoint = validators["body"](schema, ["application/json"], None)(endpoint)
+    endpoint = validators["parameter"](operation["parameters"], None)(endpoint)
+
+    request = ConnexionRequest("/api/accounts/1/transactions", "post", path_params={"account_id": 1},
+                               query={"fields": ["transaction_id", "saldo"]}, headers={"Idempotency-Key": "benchmark"},
+                               body=json.dumps(BODY).encode(), json_getter=lambda: BODY)
+    return lambda: endpoint(request)
+
+## Whole requests
+def create_transaction_request(app, account_id, mode, is_production):
+    '''Function posting one transaction to an API app built with the validators of the mode.'''
+    from project import create_api_app
+    app.config.update({"API_VALIDATION": mode, "IS_PROD": "True" if is_production else None})
+    client = create_api_app(app).test_client()
+
+    def post():
+        response = client.post(f"/api/accounts/{account_id}/transactions", json=BODY)
+        assert response.status_code == 201, response.json
+    return post
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000, help="Calls per run")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    app, _, account_id = create_benchmark_app()
+    results = []
+    with open(os.devnull, "w") as devnull:
+        for mode, is_production in MODES:
+            name = f"{mode} (production)" if is_production else mode
+            validation_us = measure(create_transaction_validation(mode, is_production), args.calls, args.repeat)
+            stdout, sys.stdout = sys.stdout, devnull # Log output of the app
+            try:
+                request_us = measure(create_transaction_request(app, account_id, mode, is_production), args.calls, args.repeat)
+            finally:
+                sys.stdout = stdout
+            results.append({"name": name, "validation_us": validation_us, "request_us": request_us})
+            print(f"{name:<26} validation {validation_us:8.1f} us   request {request_us:8.1f} us", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
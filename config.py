@@ -8,14 +8,68 @@ class Config:
 
     IS_PROD = os.environ.get('IS_HEROKU', None)
 
+    # Idempotency-Key header of API writes (see project/idempotency.py)
+    IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", 24 * 60 * 60))
+    IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 1024))
+    # Reservations of keys whose request did not finish within this time can be taken over by a retry
+    IDEMPOTENCY_RESERVATION_SECONDS = int(os.getenv("IDEMPOTENCY_RESERVATION_SECONDS", 60))
+
+    # Requests of a client stay on the primary database for this long after it wrote something (see project/db.py)
+    REPLICA_STICKINESS_SECONDS = float(os.getenv("REPLICA_STICKINESS_SECONDS", 5))
+
+    # Maximum number of accounts, 0 for no limit
+    ACCOUNT_LIMIT = int(os.getenv("ACCOUNT_LIMIT", 5))
+
+    # Workers check the version of their cached account list at most this often (see project/accounts/cache.py)
+    ACCOUNT_CACHE_CHECK_SECONDS = float(os.getenv("ACCOUNT_CACHE_CHECK_SECONDS", 1))
+
+    # Transactions of a deleted account are deleted in chunks of this many rows (see project/accounts/purge.py)
+    ACCOUNT_PURGE_CHUNK_SIZE = int(os.getenv("ACCOUNT_PURGE_CHUNK_SIZE", 1000))
+
+    # Group-commit writer for API transactions (see project/transactions/write_queue.py)
+    TRANSACTION_WRITE_QUEUE = os.getenv("TRANSACTION_WRITE_QUEUE", "False") == "True"
+    WRITE_QUEUE_MAX_BATCH = int(os.getenv("WRITE_QUEUE_MAX_BATCH", 500))
+    WRITE_QUEUE_MAX_DELAY_MS = float(os.getenv("WRITE_QUEUE_MAX_DELAY_MS", 5))
+
+    # Time partitioning of the transactions table, "monthly" or unset (see project/partitioning.py)
+    TRANSACTION_PARTITIONING = os.getenv("TRANSACTION_PARTITIONING") or None
+    PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))
+
+    # Logging (see project/log.py): level of all loggers, levels of single loggers ("project.transactions=WARNING,...")
+    # and the share of high-volume success messages (e.g. created transactions) that is written
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+    LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1))
+
+    # Request validation of the API: "full", "compiled" or "development" (compiled in production), see project/validation.py
+    API_VALIDATION = os.getenv("API_VALIDATION", "full")
+
+    # Request tracing (see project/tracing.py): share of requests traced (0 = off) and where their spans are
+    # exported to, a JSONL file and/or an OTLP/HTTP collector (e.g. http://localhost:4318/v1/traces)
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0))
+    TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE", "")
+    TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+
+    # Storage of amounts and saldos: "decimal" (NUMERIC) or "cents" (BIGINT), convert with `flask convert-amounts` (see project/money.py)
+    AMOUNT_STORAGE = os.getenv("AMOUNT_STORAGE", "decimal")
+
+    # Transactions older than this many days are moved to the archive by `flask archive-transactions` (see project/archive.py)
+    TRANSACTION_ARCHIVE_AFTER_DAYS = int(os.environ["TRANSACTION_ARCHIVE_AFTER_DAYS"]) if os.getenv("TRANSACTION_ARCHIVE_AFTER_DAYS") else None
+    # Seconds a worker caches the boundary of the archived transactions (see project/archive.py)
+    ARCHIVE_BOUNDARY_CHECK_SECONDS = float(os.getenv("ARCHIVE_BOUNDARY_CHECK_SECONDS", 60))
+
     ## PRODUCTION config
     if IS_PROD == "True" or IS_PROD is True:
         DATABASE_URL=os.environ.get("DATABASE_URL_HEROKU")
+        DATABASE_REPLICA_URL=os.environ.get("DATABASE_REPLICA_URL_HEROKU")
+        TRANSACTION_SHARD_URLS=[url for url in os.environ.get("TRANSACTION_SHARD_URLS_HEROKU", "").split(",") if url]
         SECRET_KEY=os.environ.get("SECRET_KEY_HEROKU"),
 
     ## DEVELOPMENT config
     else:
 
-        DATABASE_URL="sqlite:///project.db"
+        DATABASE_URL=os.getenv("DATABASE_URL_LOCAL", "sqlite:///project.db")
+        DATABASE_REPLICA_URL=os.getenv("DATABASE_REPLICA_URL_LOCAL")
+        TRANSACTION_SHARD_URLS=[url for url in os.getenv("TRANSACTION_SHARD_URLS_LOCAL", "").split(",") if url]
         SECRET_KEY=os.getenv("SECRET_KEY_LOCAL")
         SQLALCHEMY_TRACK_MODIFICATIONS = False
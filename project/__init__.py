@@ -1,32 +1,54 @@
-import connexion
-from pprint import pprint
-from flask import jsonify
+import copy
+import logging
+import threading
+from functools import lru_cache
+from pathlib import Path
 
-app = None
+import yaml
+from flask import Flask
+
+SPECIFICATION_PATH = Path(__file__).parent / "swagger.yml"
+API_PREFIX = "/api"
+
+logger = logging.getLogger(__name__)
 
 def create_app(test_setup=False):
     # print("[__init__.py] Creating app")
 
-    from swagger_ui_bundle import swagger_ui_3_path
-    options = {'swagger_path': swagger_ui_3_path}
+    # No database access and no API setup happens here (see init-db / seed commands and LazyApiMiddleware)
+    app = Flask(__name__)
+    app.config.from_object('config.Config')
+    from project.json_provider import FastJSONProvider
+    app.json = FastJSONProvider(app)
 
-    global app
-    app = connexion.App(__name__, specification_dir="./", options=options)
-    app.app.config.from_object('config.Config')
+    # Structured logging through a background thread (see project/log.py)
+    from project.log import configure_logging
+    configure_logging(app.config)
 
-    app.add_api("swagger.yml")
-    app = app.app
+    # Sampled request tracing with spans exported in the background (see project/tracing.py)
+    from project.tracing import configure_tracing, register_request_tracing
+    configure_tracing(app.config)
 
-    from project.db import init_db
     if test_setup is False:
-        print("__________[APP] NORMAL SETUP__________")
+        logger.info("__________[APP] NORMAL SETUP__________")
     else:
-        print("__________[APP] TEST SETUP__________")
+        logger.info("__________[APP] TEST SETUP__________")
         app.config.update({
             "TESTING": True,
             'WTF_CSRF_ENABLED': False
         })
-    init_db()
+
+    from project.db import configure_engine, init_db_command, register_replica_routing
+    configure_engine(app.config["DATABASE_URL"], app.config.get("DATABASE_REPLICA_URL"), app.config.get("TRANSACTION_SHARD_URLS"),
+                     app.config.get("TRANSACTION_PARTITIONING"), app.config.get("AMOUNT_STORAGE"))
+    if app.config.get("DATABASE_REPLICA_URL"):
+        register_replica_routing(app)
+
+    from project.accounts.registry import register_account_registry
+    register_account_registry(app)
+    register_request_tracing(app)
+
+    app.wsgi_app = LazyApiMiddleware(app, app.wsgi_app)
 
     from project.accounts.accounts import accounts_bp
     app.register_blueprint(accounts_bp, url_prefix='/')
@@ -37,4 +59,90 @@ def create_app(test_setup=False):
     from project.main.main import main_bp
     app.register_blueprint(main_bp, url_prefix='/')
 
+    app.cli.add_command(init_db_command)
+
+    from project.seed import seed_command
+    app.cli.add_command(seed_command)
+
+    from project.idempotency import purge_idempotency_keys_command
+    app.cli.add_command(purge_idempotency_keys_command)
+
+    from project.accounts.purge import purge_deleted_accounts_command
+    app.cli.add_command(purge_deleted_accounts_command)
+
+    from project.archive import archive_transactions_command
+    app.cli.add_command(archive_transactions_command)
+
+    from project.money import convert_amounts_command
+    app.cli.add_command(convert_amounts_command)
+
+    if app.config.get("TRANSACTION_SHARD_URLS"):
+        from project.sharding import deliver_transfers_command, shard_info_command
+        app.cli.add_command(deliver_transfers_command)
+        app.cli.add_command(shard_info_command)
+
+    if app.config.get("TRANSACTION_PARTITIONING"):
+        from project.partitioning import create_partitions_command
+        app.cli.add_command(create_partitions_command)
+
     return app
+
+
+## REST API
+@lru_cache(maxsize=None)
+def load_spec():
+    '''Parses swagger.yml once per process (with the libyaml parser when available).'''
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(SPECIFICATION_PATH, encoding="utf-8") as spec_file:
+        return yaml.load(spec_file, Loader=loader)
+
+def create_api_app(app):
+    '''Builds the connexion app serving swagger.yml (operations, request validation (see project/validation.py) and Swagger UI).'''
+    import connexion
+    from swagger_ui_bundle import swagger_ui_3_path
+    from project.json_provider import FastJSONProvider
+
+    api = connexion.App(__name__, specification_dir="./", options={'swagger_path': swagger_ui_3_path})
+    api.app.config = app.config # Same secret key, testing flags etc. as the web app
+    api.app.json = FastJSONProvider(api.app) # Instead of connexion's json_encoder
+    from project.validation import validator_map, traced_validators, DEFAULT_MODE
+    from project.tracing import is_tracing, register_request_tracing
+    is_production = app.config.get("IS_PROD") in ("True", True)
+    validators = validator_map(app.config.get("API_VALIDATION", DEFAULT_MODE), is_production)
+    if is_tracing():
+        validators = traced_validators(validators)
+    api.add_api(copy.deepcopy(load_spec()), validator_map=validators)
+    if app.config.get("DATABASE_REPLICA_URL"):
+        from project.db import register_replica_routing
+        register_replica_routing(api.app)
+    from project.accounts.registry import register_account_registry
+    register_account_registry(api.app)
+    register_request_tracing(api.app)
+    return api.app
+
+class LazyApiMiddleware:
+    '''
+    Dispatches requests below /api to the connexion app, which is only created on the first API request.
+    Importing connexion, loading and validating the spec and setting up the Swagger UI is thereby kept
+    out of worker startup.
+    '''
+
+    def __init__(self, app, wsgi_app, prefix=API_PREFIX):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.prefix = prefix
+        self.api_app = None
+        self._lock = threading.Lock()
+
+    def get_api_app(self):
+        if self.api_app is None:
+            with self._lock:
+                if self.api_app is None:
+                    self.api_app = create_api_app(self.app)
+        return self.api_app
+
+    def __call__(self, environ, start_response):
+        path = "/" + environ.get("PATH_INFO", "").lstrip("/")
+        if path == self.prefix or path.startswith(self.prefix + "/"):
+            return self.get_api_app()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
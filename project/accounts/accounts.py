@@ -1,7 +1,8 @@
 ## Imports
 from flask import (
-    Blueprint, redirect, render_template, request, url_for, flash
+    Blueprint, redirect, render_template, request, url_for, flash, current_app, has_app_context
 )
+import logging
 from datetime import datetime, timedelta
 
 # Basics
@@ -14,11 +15,22 @@ from wtforms.validators import DataRequired, Length, AnyOf
 
 
 # Models
-from project.models import Account, Transaction, AccountLimitException, IBANAlreadyExistsError
-from project.db import db_session
+from project.models import Account, Transaction, AccountLimitException, IBANAlreadyExistsError, OPENING_BALANCE_CATEGORY, TRANSFER_CATEGORY
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+from project.db import db_session, read_only
+from project.accounts.registry import account_registry
+from project.accounts.cache import AccountInfo
+from project.accounts.ibans import allocate_iban
+from project.accounts.purge import delete_account
+from project.tracing import span
+from project.archive import archived_before
+from project.queries import account_count
+
+logger = logging.getLogger(__name__)
 
 # Forms
-from project.transactions.transactions import TransactionForm, SubaccountTransferForm
+from project.transactions.transactions import TransactionForm, SubaccountTransferForm, EditTransactionForm, DeleteTransactionForm
 
 ## Custom exceptions
 class AccountNotFoundError(Exception):
@@ -62,17 +74,19 @@ accounts_bp = Blueprint('accounts', __name__,
 
 @accounts_bp.route("/accounts", methods=["GET"])
 def index():
-    return redirect(url_for("accounts.show", account_id=Account.query.all()[0].id))
+    return redirect(url_for("accounts.show", account_id=account_registry().all()[0].id))
 
 @accounts_bp.route("/accounts/<int:account_id>", methods=["GET", "POST"])
+@read_only
 def show(account_id, transactions_filter=None):
 
-    account = Account.query.get(account_id)
-    all_accounts = Account.query.all()
+    accounts = account_registry()
+    all_accounts = accounts.all() # Process-wide cache (project/accounts/cache.py)
     transactions_filter = request.args.get('transactions_filter')
 
     # Transactions filter
-    filter_form = FilterForm()
+    with span("build_forms", forms="FilterForm"):
+        filter_form = FilterForm()
     if request.method == 'POST' and filter_form.clear.data:
         # print("Redirecting to accounts.show with default transactions filter cleared")
         return redirect(url_for("accounts.show", account_id=account_id, transactions_filter="cleared"))
@@ -83,47 +97,56 @@ def show(account_id, transactions_filter=None):
                                             end_date=filter_form.end_date.data,
                                             category=category,
                                             search_type=filter_form.search_type.data,
-                                            transaction_description=filter_form.transaction_description.data)
+                                            transaction_description=filter_form.transaction_description.data,
+                                            as_rows=True)
     else:
         if transactions_filter=="cleared":
             # print("Displaying ALL transactions")
-            transactions = Transaction.read_all(account_id=account_id)
+            transactions = Transaction.read_all(account_id=account_id, as_rows=True)
         else:
             transactions_filter="default_30_days"
             # print("Displaying default filter: Last 30 days")
             date_30_days_ago = (datetime.today() - timedelta(days=30)).date()
             filter_form.start_date.data = date_30_days_ago
-            transactions = Transaction.read_all(start_date=date_30_days_ago, account_id=account_id)
+            transactions = Transaction.read_all(start_date=date_30_days_ago, account_id=account_id, as_rows=True)
 
 
     # Extract data for transaction statistics
     transaction_statistics = {}
-    transaction_statistics['income'] = sum([transaction.amount for transaction in transactions if transaction.amount > 0])
-    transaction_statistics['expenses'] = sum([transaction.amount for transaction in transactions if transaction.amount < 0])
+    booked_transactions = [transaction for transaction in transactions if transaction.category != OPENING_BALANCE_CATEGORY]
+    transaction_statistics['income'] = sum([transaction.amount for transaction in booked_transactions if transaction.amount > 0])
+    transaction_statistics['expenses'] = sum([transaction.amount for transaction in booked_transactions if transaction.amount < 0])
     transaction_statistics['num_transactions'] = len(transactions)
 
     # Extract unique transaction descriptions for display in autocomplete field
     autocomplete_descriptions = list(set([transaction.description for transaction in transactions]))
 
     # Extract saldos for accounts
-    account_saldos = {}
-    for account in all_accounts:
-        account_saldos[account.id] = account.transactions.order_by(Transaction.utc_datetime_booked.desc()).first().saldo if account.transactions.count() > 0 else 0
+    with span("account_saldos", accounts=len(all_accounts)):
+        latest_saldos = Transaction.latest_saldos()
+        account_saldos = {}
+        for account in all_accounts:
+            account_saldos[account.id] = latest_saldos.get(account.id, 0)
 
     # Calculate sum to be displayed in last table row
     transactions_table_sum = sum([transaction.amount for transaction in transactions])
 
-    # New transaction form
-    transaction_form = TransactionForm()
+    with span("build_forms", forms="TransactionForm,SubaccountTransferForm,EditTransactionForm,DeleteTransactionForm"):
+        # New transaction form
+        transaction_form = TransactionForm()
 
-    # Subaccount transfer form
-    from project.transactions.transactions import update_transfer_form
-    subaccount_transfer_form = SubaccountTransferForm()
+        # Subaccount transfer form
+        from project.transactions.transactions import update_transfer_form
+        subaccount_transfer_form = SubaccountTransferForm()
 
-    message, status = update_transfer_form(subaccount_transfer_form, account_id)
-    if status == "error":
-        flash(message, status)
-        return redirect(url_for("accounts.index"))
+        message, status = update_transfer_form(subaccount_transfer_form, account_id)
+        if status == "error":
+            flash(message, status)
+            return redirect(url_for("accounts.index"))
+
+        # Edit / delete transaction forms (filled in by transaction_actions.js)
+        edit_transaction_form = EditTransactionForm()
+        delete_transaction_form = DeleteTransactionForm()
 
 
     # Currency value formatting function to get format: 123.123,00
@@ -155,9 +178,10 @@ def show(account_id, transactions_filter=None):
 
 
     # Create new account / edit account details form
-    account_form = AccountForm()
-    edit_account_form = EditAccountForm(obj=Account.query.get(account_id))
-    delete_account_form = DeleteAccountForm()
+    with span("build_forms", forms="AccountForm,EditAccountForm,DeleteAccountForm"):
+        account_form = AccountForm()
+        edit_account_form = EditAccountForm(obj=accounts.info(account_id))
+        delete_account_form = DeleteAccountForm()
 
     return render_template('accounts/show.html',
                         active_account_id=account_id,
@@ -169,6 +193,11 @@ def show(account_id, transactions_filter=None):
                         account_saldos=account_saldos,
                         transaction_form=transaction_form,
                         subaccount_transfer_form=subaccount_transfer_form,
+                        edit_transaction_form=edit_transaction_form,
+                        delete_transaction_form=delete_transaction_form,
+                        opening_balance_category=OPENING_BALANCE_CATEGORY,
+                        transfer_category=TRANSFER_CATEGORY,
+                        archive_boundary=archived_before(account_id), # Archived transactions cannot be edited
                         format_currency=format_currency,
                         account_form=account_form,
                         edit_account_form=edit_account_form,
@@ -185,13 +214,13 @@ def create():
         message = 'Form data is not valid.'
         status = "error"
     else:
-        new_iban = generate_unique_iban()
-        status, message = create_account(new_iban, account_form.title.data) # Validates title doesnt't start with digit
+        new_iban = allocate_iban()
+        status, message, created = create_account(new_iban, account_form.title.data, as_row=True) # Validates title doesnt't start with digit
 
     flash(message, status)
 
     if status == "success":
-        return redirect(url_for("accounts.show", account_id=Account.query.filter_by(iban=new_iban).first().id))
+        return redirect(url_for("accounts.show", account_id=created.id))
     else:
         return redirect(url_for("accounts.index"))
 
@@ -204,7 +233,7 @@ def update(account_id):
         flash('Form data is not valid.', "error")
         return redirect(url_for("accounts.show", account_id=account_id))
 
-    account = Account.query.get(account_id)
+    account = account_registry().get(account_id)
     if not account:  # Edge case: Account does not exist.
         flash('Account not found.', "error")
         return redirect(url_for("accounts.index"))
@@ -220,12 +249,13 @@ def update(account_id):
         # Update Account
         account.title = account_title
         db_session.add(account)
-        db_session.commit()
+        db_session.commit() # Invalidates the account cache of all workers (project/accounts/cache.py)
+        account_registry().forget()
         flash('Successfully updated account info.', "success")
 
-    except Exception as e:
+    except Exception:
         db_session.rollback()
-        print(f"Something went wrong while updating account info: {e}")
+        logger.exception("Something went wrong while updating account info")
         flash('Something went wrong while updating account info. Please try again.', "error")
 
     return redirect(url_for("accounts.show", account_id=account_id))
@@ -238,79 +268,77 @@ def delete(account_id):
         flash("Form data is not valid.", "error")
         return redirect(url_for("accounts.index"))
 
-    account_to_delete = Account.query.get(account_id)
+    account_to_delete = account_registry().get(account_id)
     if not account_to_delete:
         flash("Could not find account.", "error")
         return redirect(url_for("accounts.index"))
 
-    if Account.query.limit(2).count() <= 1:
+    if len(account_registry().all()) <= 1: # Accounts being deleted are not counted
         flash("Cannot delete the last account.", "error")
         return redirect(url_for("accounts.show", account_id=account_id))
 
     try:
-        db_session.delete(account_to_delete)
-        db_session.commit()
+        delete_account(account_to_delete)
+        account_registry().forget()
 
-        next_account_id = Account.query.first().id
+        next_account_id = account_registry().all()[0].id
         flash('Successfully deleted account.', "success")
         return redirect(url_for("accounts.show", account_id=next_account_id))
 
-    except Exception as e:
+    except Exception:
         db_session.rollback()
-        print(f"Error occurred while deleting account: {e}")
+        logger.exception("Error occurred while deleting account %s", account_id)
         flash('Something went wrong while deleting account', "error")
         return redirect(url_for("accounts.show", account_id=account_id))
 
 
 ## Subfunctions
-def generate_unique_iban():
-    # Create new iban
-    iban = "GB29000060161331920000"
-    if Account.query.count() > 0:
-        all_ibans = [account.iban for account in Account.query.all()]
-        iban_invalid = True
-        increment = 1
-        while iban_invalid:
-            last_four = iban[-4:]
-            incremented_value = int(last_four) + increment
-            if incremented_value == 10000:
-                incremented_value = 0
-            new_last_four = "{:04}".format(incremented_value)
-            new_iban = iban[:-4] + new_last_four
-            if new_iban not in all_ibans:
-                iban_invalid = False
-            else:
-                increment += 1
-    else:
-        new_iban = iban
-    return new_iban
+def account_limit():
+    '''Maximum number of accounts (ACCOUNT_LIMIT), 0 for no limit.'''
+    from config import Config
+    return current_app.config.get("ACCOUNT_LIMIT", Config.ACCOUNT_LIMIT) if has_app_context() else Config.ACCOUNT_LIMIT
 
-def create_account(iban, title):
+def create_account(iban, title, as_row=False):
+    '''(status, message); with as_row also the AccountInfo of the new account (None on errors).'''
     try:
         new_account = Account(iban=iban, title=title)
+        # Counted in the transaction of the insert: the account cache (project/accounts/cache.py) of this process may be stale
+        limit = account_limit()
+        if limit and account_count() >= limit:
+            raise AccountLimitException(f"Cannot add more than {limit} accounts.")
         db_session.add(new_account)
-        db_session.commit()
-        print(f"Successfully created new account: {new_account}")
-        return "success", 'Successfully created new account.'
+        try:
+            db_session.commit()
+        except IntegrityError:
+            # The unique index on iban
+            raise IBANAlreadyExistsError("The IBAN is already taken by another account.")
+        account_registry().forget()
+        # Id from the identity key: reading new_account.id would reload the expired instance
+        row = AccountInfo(inspect(new_account).identity[0], title, iban)
+        logger.info("Created account %s", row.id, extra={"account_id": row.id, "iban": row.iban})
+        return account_result("success", 'Successfully created new account.', row, as_row)
     except ValueError as ve: # This will capture all ValueErrors raised in __init__
         db_session.rollback()
-        print(f"Error: {ve}") # Display the actual error message from __init__
-        return "error", f"{ve}"
+        logger.info("Account rejected: %s", ve) # The actual error message from __init__
+        return account_result("error", f"{ve}", None, as_row)
     except IBANAlreadyExistsError as ib:
         db_session.rollback()
-        print(f"Error: {ib}") # Display the actual error message from __init__
-        return "error", f"{ib}"
+        logger.info("Account rejected: %s", ib)
+        return account_result("error", f"{ib}", None, as_row)
     except AccountLimitException as ale:
         db_session.rollback()
-        print(f"Error: {ale}") # Display the actual error message from __init__
-        return "error", f"{ale}"
-    except Exception as e:
+        logger.info("Account rejected: %s", ale)
+        return account_result("error", f"{ale}", None, as_row)
+    except Exception:
         db_session.rollback()
-        print(f"Error occurred while creating new account: {e}")
-        return "error", 'Error occurred while creating the account.'
+        logger.exception("Error occurred while creating new account")
+        return account_result("error", 'Error occurred while creating the account.', None, as_row)
+
+def account_result(status, message, row, as_row):
+    return (status, message, row) if as_row else (status, message)
 
 def validate_account(account_id):
-    account = Account.query.get(account_id)
+    account = account_registry().get(account_id)
     if not account:
         raise AccountNotFoundError(account_id)
     return account
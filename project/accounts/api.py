@@ -1,65 +1,83 @@
+import logging
+
 # Flask
 from flask import jsonify
 
 # Models
 from project.models import Account
-from project.accounts.accounts import create_account, generate_unique_iban
+from project.accounts.accounts import create_account
+from project.accounts.ibans import allocate_iban
+from project.accounts.purge import delete_account
 from project.db import db_session
+from project.queries import search_accounts
+from project.accounts.registry import account_registry
+from project.accounts.cache import AccountInfo
+from project.json_provider import json_encoder
+from project.fields import shape_list, select_fields
+
+ACCOUNT_FIELDS = ("id", "title", "iban")
 
+logger = logging.getLogger(__name__)
 
-def accounts_to_json(accounts_list):
-    json_accounts = []
-    for account in accounts_list:
-        account_dict = {
-            "id": str(account.id),
-            "title": str(account.title),
-            "iban": str(account.iban),
-        }
-        json_accounts.append(account_dict)
-    return json_accounts
+@json_encoder(Account, AccountInfo)
+def account_to_json(account):
+    return {
+        "id": str(account.id), # A string in the API spec
+        "title": account.title,
+        "iban": account.iban,
+    }
 
-def api_get_one_account(account_id):
+def accounts_to_json(accounts_list, fields=None, compact=False):
+    '''
+    Accounts for a response, each one is converted by account_to_json while the response is serialised.
+    With fields or compact, see project/fields.py.
+    '''
+    return shape_list(accounts_list, account_to_json, ACCOUNT_FIELDS, fields, compact)
+
+def api_get_one_account(account_id, fields=None, compact=False):
 
     if not account_id:
         return jsonify({"status": "error", "detail": "This was unexpected. Swagger should have handled this..."}), 400
 
-    account = Account.query.get(account_id)
+    account = account_registry().get(account_id)
     if not account:
         return jsonify({
             "detail": "Account not found.",
             "status": "error"}), 404
     else:
-        return accounts_to_json([account])
+        return accounts_to_json([account], fields, compact)
 
-def api_get_all_accounts():
+def api_get_all_accounts(fields=None, compact=False):
 
-    accounts = Account.query.all()
+    accounts = account_registry().all()
     if len(accounts) == 0 or not accounts:
         return jsonify({
             "detail": "No accounts found.",
             "status": "error"}), 404
     else:
-        return accounts_to_json(accounts)
+        return accounts_to_json(accounts, fields, compact)
+
+def api_search_accounts(q, limit=10, fields=None, compact=False):
+    '''Accounts whose title or IBAN starts with q, e.g. for the recipient field of the transfer form.'''
+    return accounts_to_json([AccountInfo._make(row) for row in search_accounts(q, limit)], fields, compact)
 
-def api_create_account(account):
+def api_create_account(account, fields=None):
 
     # Title validation (existence, length, type) and error messages are automatically generated by swagger!
     title = account.get('title')
     if not title:
         return jsonify({"status": "error", "detail": "This was unexpected. Swagger should have handled this..."}), 400
 
-    new_iban = generate_unique_iban()
+    new_iban = allocate_iban()
 
-    status, message = create_account(new_iban, title) # Validates request data internally (given it is not None)
+    # Validates request data internally (given it is not None), returns the new account, so it is not queried again
+    status, message, created = create_account(new_iban, title, as_row=True)
 
     if status == "success":
-        account = Account.query.filter(Account.iban == new_iban).first()
         return jsonify({
                 "status": "success",
                 "detail": message,
-                "iban": account.iban,
-                "title": account.title,
-                "id": account.id
+                **select_fields(created._asdict(), fields)
             }), 201
     else:
         return jsonify({"status": "error", "detail": message}), 400
@@ -69,24 +87,24 @@ def api_delete_account(account_id):
     if not account_id:
         return jsonify({"status": "error", "detail": "This was unexpected. Swagger should have handled this..."}), 400
 
-    account_to_delete = Account.query.get(account_id)
+    account_to_delete = account_registry().get(account_id)
     if not account_to_delete:
         return jsonify({"detail": "Account not found.", "status": "error"}), 404
 
-    if Account.query.limit(2).count() <= 1:
+    if len(account_registry().all()) <= 1: # Accounts being deleted are not counted
         return jsonify({"detail": "Cannot delete the last account.", "status": "error"}), 400
 
     try:
-        db_session.delete(account_to_delete)
-        db_session.commit()
+        delete_account(account_to_delete)
+        account_registry().forget()
 
-        next_account_id = Account.query.first().id
+        next_account_id = account_registry().all()[0].id
         return jsonify({
             "detail": "Successfully deleted account.",
             "status": "success"
         }), 200
 
-    except Exception as e:  # Keep this for unexpected exceptions
+    except Exception:  # Keep this for unexpected exceptions
         db_session.rollback()
-        print(f"Error occurred while deleting account: {e}")
+        logger.exception("Error occurred while deleting account %s", account_id)
         return jsonify({"detail": "Something went wrong while deleting account.", "status": "error"}), 500
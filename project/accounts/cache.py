@@ -0,0 +1,113 @@
+'''
+Process-wide cache of account metadata (id, title, IBAN).
+
+Accounts change rarely, but the account list is needed on every page view (account selector, transfer
+recipients) and by GET /api/accounts. Each worker process keeps it in memory together with the version
+stamp of the accounts in the database (row "accounts" of cache_versions):
+
+- Every write to accounts (including marking an account as deleted) bumps the version in the same database transaction. Flushes and bulk
+  UPDATE/DELETE statements of a session do so automatically (see the session events below), writers that
+  bypass the session (e.g. project/seed.py) call bump_accounts_version().
+- The process that committed the write drops its cache right away.
+- Other processes compare their version with the database at most every ACCOUNT_CACHE_CHECK_SECONDS and
+  reload the accounts when it changed, so they see the write after that delay at the latest.
+'''
+import threading
+import time
+from collections import namedtuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.orm import Session
+
+from project.db import db_session
+from project.models import Account, AccountDeletion, CacheVersion
+
+DEFAULT_CHECK_SECONDS = 1
+VERSION_NAME = "accounts"
+CHANGED_KEY = "accounts_changed" # In Session.info while the session's transaction wrote accounts
+
+# Cached view of an account row, see cached_accounts()
+AccountInfo = namedtuple("AccountInfo", ["id", "title", "iban"])
+
+ACCOUNTS_VERSION = select(CacheVersion.version).where(CacheVersion.name == VERSION_NAME)
+# Accounts being deleted (see project/accounts/purge.py) are left out
+ACCOUNT_INFOS = select(Account.id, Account.title, Account.iban).where(Account.id.not_in(select(AccountDeletion.account_id))).order_by(Account.id)
+
+_lock = threading.Lock()
+_caches = {} # database url -> (version, monotonic time of the last version check, AccountInfos)
+_generation = 0 # Incremented by invalidate_account_cache(), so loads that raced with it are not stored
+
+
+## Reading
+def check_seconds():
+    if has_app_context():
+        return current_app.config.get("ACCOUNT_CACHE_CHECK_SECONDS", DEFAULT_CHECK_SECONDS)
+    return DEFAULT_CHECK_SECONDS
+
+def cached_accounts():
+    '''AccountInfo of all accounts, ordered by id (a tuple shared by all callers).'''
+    # One cache per database, reads of a request may be served by the replica (see project/db.py)
+    url = str(db_session.get_bind(mapper=Account.__mapper__).engine.url) # Engine, or the connection of an atomic batch
+    now = time.monotonic()
+    cached = _caches.get(url)
+    if cached is not None and now - cached[1] < check_seconds():
+        return cached[2]
+
+    generation = _generation
+    version = db_session.execute(ACCOUNTS_VERSION).scalar() or 0
+    if cached is not None and cached[0] == version:
+        accounts = cached[2]
+    else:
+        accounts = tuple(map(AccountInfo._make, db_session.execute(ACCOUNT_INFOS).tuples()))
+    with _lock:
+        if generation == _generation:
+            _caches[url] = (version, now, accounts)
+    return accounts
+
+def invalidate_account_cache():
+    '''Drops the cached accounts of this process, the next cached_accounts() loads them again.'''
+    global _generation
+    with _lock:
+        _caches.clear()
+        _generation += 1
+
+
+## Writing
+def bump_accounts_version(connection):
+    '''Bumps the accounts version within the transaction of connection (for writes outside of a session).'''
+    versions = CacheVersion.__table__
+    bumped = connection.execute(update(versions).where(versions.c.name == VERSION_NAME).values(version=versions.c.version + 1))
+    if bumped.rowcount == 0:
+        connection.execute(insert(versions).values(name=VERSION_NAME, version=1))
+
+def accounts_written(session, connection):
+    if not session.info.get(CHANGED_KEY):
+        bump_accounts_version(connection)
+        session.info[CHANGED_KEY] = True
+
+@event.listens_for(Session, "after_flush")
+def _accounts_flushed(session, flush_context):
+    # Dirty accounts only count with changed columns, appending to account.transactions marks them dirty as well
+    # New account deletions hide their account, so they count as account writes
+    if (any(isinstance(instance, (Account, AccountDeletion)) for instance in session.new)
+            or any(isinstance(instance, Account) for instance in session.deleted)
+            or any(isinstance(instance, Account) and session.is_modified(instance, include_collections=False) for instance in session.dirty)):
+        accounts_written(session, session.connection(bind_arguments={"mapper": CacheVersion.__mapper__}))
+
+@event.listens_for(Session, "do_orm_execute")
+def _accounts_bulk_written(orm_execute_state):
+    # e.g. Account.query.delete()
+    if orm_execute_state.is_select or orm_execute_state.bind_mapper is not Account.__mapper__:
+        return
+    session = orm_execute_state.session
+    accounts_written(session, session.connection(bind_arguments={"mapper": CacheVersion.__mapper__, "clause": orm_execute_state.statement}))
+
+@event.listens_for(Session, "after_commit")
+def _accounts_committed(session):
+    if session.info.pop(CHANGED_KEY, False):
+        invalidate_account_cache()
+
+@event.listens_for(Session, "after_rollback")
+def _accounts_rolled_back(session):
+    session.info.pop(CHANGED_KEY, None)
@@ -0,0 +1,53 @@
+'''
+IBANs of new accounts.
+
+An IBAN is the country code, two check digits (ISO 13616, mod 97) and the BBAN: the bank code followed by a
+10 digit account number, e.g. GB07 00006016 1331920001. Account numbers come from a counter row
+(project/ids.py), so allocating an IBAN does not look at the existing accounts; the unique index on
+accounts.iban still rejects duplicates. The IBANs of earlier versions (GB29 00006016 133192xxxx, with
+fixed check digits) have the same layout, numbering continues after the highest of them.
+'''
+from sqlalchemy import select, func
+
+from project.db import get_engine
+from project.ids import IdAllocator
+from project.models import Account
+
+COUNTRY_CODE = "GB"
+BANK_CODE = "00006016"
+ACCOUNT_NUMBER_DIGITS = 10
+FIRST_ACCOUNT_NUMBER = 1331920000 # As in the first IBAN of earlier versions, GB29000060161331920000
+ACCOUNT_NUMBER_BLOCK_SIZE = 100 # Account numbers reserved per process and database round trip
+ACCOUNT_NUMBER_START = len(COUNTRY_CODE) + 2 + len(BANK_CODE) # Index of the account number in an IBAN
+
+
+def check_digits(country_code, bban):
+    '''ISO 13616 check digits: 98 - (BBAN + country code + "00", letters as 10..35) mod 97.'''
+    digits = "".join(str(int(character, 36)) for character in bban + country_code + "00")
+    return f"{98 - int(digits) % 97:02}"
+
+def format_iban(account_number):
+    bban = f"{BANK_CODE}{account_number:0{ACCOUNT_NUMBER_DIGITS}}"
+    return f"{COUNTRY_CODE}{check_digits(COUNTRY_CODE, bban)}{bban}"
+
+def is_valid_iban(iban):
+    '''Whether the check digits of iban are correct.'''
+    iban = iban.replace(" ", "").upper()
+    return len(iban) > 4 and iban[:4].isalnum() and check_digits(iban[:2], iban[4:]) == iban[2:4]
+
+
+## Allocation
+def first_account_number():
+    '''Start of the account number counter: after the highest account number in use.'''
+    with get_engine().connect() as connection:
+        highest = connection.execute(
+            select(func.max(func.substr(Account.iban, ACCOUNT_NUMBER_START + 1)))
+            .where(Account.iban.like(f"{COUNTRY_CODE}__{BANK_CODE}%"))
+        ).scalar()
+    return int(highest) + 1 if highest and highest.isdigit() else FIRST_ACCOUNT_NUMBER
+
+account_numbers = IdAllocator("account_numbers", first_account_number, block_size=ACCOUNT_NUMBER_BLOCK_SIZE)
+
+def allocate_iban():
+    '''Check digit valid IBAN with a new account number.'''
+    return format_iban(account_numbers.next_id())
@@ -0,0 +1,148 @@
+'''
+Deletion of accounts.
+
+Deleting an account only marks it as deleted (a row of account_deletions) and answers right away: from then
+on the account is left out of the account list, the search and get_account(). A background thread of the
+process (AccountPurger) then purges its history and deletes the account row.
+
+The transactions of an account are deleted with set-based statements, without loading them into the
+session: the relationships of Account have passive_deletes, so deleting an account is one DELETE of its row.
+Before that, purge_account_history() deletes the account's transactions and archived transactions in chunks
+of ACCOUNT_PURGE_CHUNK_SIZE rows, each chunk in its own short database transaction, so deleting an account
+with a long history does not lock the transaction tables for long. The foreign keys of transactions have
+ON DELETE CASCADE for rows booked between the purge and the deletion of the account; the database can not
+cascade into other shards (project/sharding.py), into the month tables of partitioned SQLite databases
+(project/partitioning.py) or in databases created before the foreign keys had ON DELETE CASCADE.
+
+Deletions interrupted by a restart of the process are finished by `flask purge-deleted-accounts`.
+'''
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import with_appcontext
+from sqlalchemy import select, delete
+
+from project.db import db_session, get_engine, get_shard_engine, is_sharded
+from project.models import Account, AccountDeletion, Transaction, ArchivedTransaction
+
+DEFAULT_CHUNK_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def chunk_size():
+    if has_app_context():
+        return current_app.config.get("ACCOUNT_PURGE_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+    return DEFAULT_CHUNK_SIZE
+
+def history_engine(account_id):
+    '''Engine of the database holding the transactions of the account.'''
+    if is_sharded():
+        from project.sharding import shard_for_account
+        return get_shard_engine(shard_for_account(account_id))
+    return get_engine()
+
+def purge_account_history(account_id, size=None):
+    '''Deletes the transactions and archived transactions of the account in chunks. Returns the number of deleted rows.'''
+    size = size or chunk_size()
+    engine = history_engine(account_id)
+    deleted = 0
+    for table in [Transaction.__table__, ArchivedTransaction.__table__]:
+        while True:
+            with engine.begin() as connection:
+                # Ids first: the rowcount of DELETEs on the partitioned (view) transactions table of SQLite is always 0
+                ids = connection.execute(select(table.c.id).where(table.c.account_id == account_id).limit(size)).scalars().all()
+                if not ids:
+                    break
+                connection.execute(delete(table).where(table.c.id.in_(ids)))
+            deleted += len(ids)
+    return deleted
+
+def finish_deletion(account_id, size=None):
+    '''Purges the history of an account marked as deleted, then deletes its row. Returns the number of purged rows.'''
+    from project.accounts.cache import bump_accounts_version, invalidate_account_cache
+    purged = purge_account_history(account_id, size)
+    with get_engine().begin() as connection:
+        connection.execute(delete(AccountDeletion.__table__).where(AccountDeletion.__table__.c.account_id == account_id))
+        connection.execute(delete(Account.__table__).where(Account.__table__.c.id == account_id))
+        bump_accounts_version(connection)
+    invalidate_account_cache()
+    logger.info("Deleted account %s and %s transactions", account_id, purged, extra={"account_id": account_id, "purged": purged})
+    return purged
+
+def delete_account(account):
+    '''Marks the account as deleted (committed), its history is purged by the background thread.'''
+    account_id = account.id
+    account.deletion = AccountDeletion(utc_datetime_requested=datetime.utcnow())
+    db_session.commit()
+    db_session.expunge(account) # Its row is deleted by the purger, outside of this session
+    account_purger.submit(account_id, chunk_size())
+    logger.info("Marked account %s as deleted", account_id, extra={"account_id": account_id})
+
+
+## Background purge
+class AccountPurger:
+    '''Thread finishing the deletion of accounts marked as deleted, one account after another (one per process).'''
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, account_id, size=None):
+        self.start()
+        self._queue.put((account_id, size))
+
+    def start(self):
+        # Threads do not survive a fork (e.g. gunicorn workers), so the purger is started per process
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._thread = threading.Thread(target=self._run, name="account-purger", daemon=True)
+                    self._pid = os.getpid()
+                    self._thread.start()
+
+    def stop(self):
+        '''Finishes all submitted deletions and stops the thread.'''
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            account_id, size = item
+            try:
+                finish_deletion(account_id, size)
+            except Exception:
+                # The account stays marked as deleted, `flask purge-deleted-accounts` finishes it
+                logger.exception("Error occurred while purging deleted account %s", account_id)
+
+account_purger = AccountPurger()
+
+def purge_deleted_accounts(size=None):
+    '''Finishes the deletion of all accounts marked as deleted, e.g. after a restart. Returns their number.'''
+    with get_engine().connect() as connection:
+        account_ids = connection.execute(select(AccountDeletion.account_id).order_by(AccountDeletion.account_id)).scalars().all()
+    for account_id in account_ids:
+        finish_deletion(account_id, size)
+    return len(account_ids)
+
+
+## CLI
+@click.command("purge-deleted-accounts")
+@with_appcontext
+def purge_deleted_accounts_command():
+    '''Purge the history of deleted accounts whose background purge was interrupted, then delete them.'''
+    count = purge_deleted_accounts()
+    click.echo(f"Purged {count} deleted accounts.")
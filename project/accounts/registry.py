@@ -0,0 +1,78 @@
+'''
+Request-scoped account registry.
+
+One page view needs the same accounts several times (the shown account, the account list, the recipients
+of the transfer form, the edit form, ...). The registry of the current request loads each account at most
+once and takes the account list once from the process-wide cache (project/accounts/cache.py);
+validate_account, update_transfer_form, get_recipient_account and the views share it. Outside of a request
+every call gets a new, empty registry.
+'''
+from contextvars import ContextVar
+
+from sqlalchemy.exc import NoResultFound, MultipleResultsFound
+
+from project.queries import get_account
+from project.accounts.cache import cached_accounts
+
+_registry = ContextVar("account_registry", default=None)
+
+
+class AccountRegistry:
+    def __init__(self):
+        self._accounts = {} # id -> Account, None for ids that do not exist
+        self._infos = None # id -> AccountInfo of all accounts
+
+    def get(self, account_id):
+        '''Account by id (int or digit string), None if it does not exist.'''
+        try:
+            account_id = int(account_id)
+        except (TypeError, ValueError):
+            return None
+        if account_id not in self._accounts:
+            self._accounts[account_id] = get_account(account_id)
+        return self._accounts[account_id]
+
+    def all(self):
+        '''AccountInfo (id, title, iban) of all accounts, ordered by id.'''
+        if self._infos is None:
+            self._infos = {info.id: info for info in cached_accounts()}
+        return list(self._infos.values())
+
+    def info(self, account_id):
+        '''AccountInfo by id (int or digit string), None if it does not exist.'''
+        try:
+            account_id = int(account_id)
+        except (TypeError, ValueError):
+            return None
+        self.all()
+        return self._infos.get(account_id)
+
+    def find_recipient(self, title, fractional_iban):
+        '''The account with the title whose IBAN starts and ends like fractional_iban (e.g. "GB29...03").'''
+        matches = [account for account in self.all() if account.title == title
+                   and account.iban.startswith(fractional_iban[:4]) and account.iban.endswith(fractional_iban[-2:])]
+        if not matches:
+            raise NoResultFound("No row was found when one was required")
+        if len(matches) > 1:
+            raise MultipleResultsFound("Multiple rows were found when exactly one was required")
+        return self.get(matches[0].id)
+
+    def forget(self):
+        '''Drops the loaded accounts, e.g. after accounts were created, updated or deleted.'''
+        self._accounts = {}
+        self._infos = None
+
+
+def account_registry():
+    '''AccountRegistry of the current request.'''
+    registry = _registry.get()
+    return registry if registry is not None else AccountRegistry()
+
+def register_account_registry(app):
+    @app.before_request
+    def create_account_registry():
+        _registry.set(AccountRegistry())
+
+    @app.teardown_request
+    def drop_account_registry(exception=None):
+        _registry.set(None)
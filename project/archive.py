@@ -0,0 +1,165 @@
+'''
+Archival of old transactions (`flask archive-transactions`, enabled by TRANSACTION_ARCHIVE_AFTER_DAYS).
+
+Transactions booked before the archive horizon (midnight UTC, TRANSACTION_ARCHIVE_AFTER_DAYS days ago) are
+moved to the archived_transactions table, so account-scoped queries only scan recent history. Every account
+with archived transactions gets an opening balance transaction booked just before the horizon, whose amount
+is the sum of the archived amounts: saldos of later transactions, which sum up all older amounts, stay
+correct. An earlier opening balance is archived along with the transactions it follows.
+
+Each run records its horizon in archive_boundaries (one row per database, in the same database transaction),
+so readers do not depend on the current TRANSACTION_ARCHIVE_AFTER_DAYS:
+- Transaction.read_all (and thereby the CSV export) reads the archive as well when its date filter reaches
+  back before the recorded boundary. Workers cache the boundary for ARCHIVE_BOUNDARY_CHECK_SECONDS.
+- Transactions booked before the boundary are rejected: the archived amounts are only part of the saldos
+  of transactions booked after the opening balance.
+'''
+import time as clock
+from datetime import datetime, time, timedelta, timezone
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import with_appcontext
+from sqlalchemy import select, insert, update, delete, func
+
+from project.db import get_shard_engine, shard_ids, is_sharded, is_partitioned, PRIMARY_SHARD
+from project.models import Transaction, ArchivedTransaction, ArchiveBoundary, OPENING_BALANCE_CATEGORY, OPENING_BALANCE_DESCRIPTION
+
+DEFAULT_BOUNDARY_CHECK_SECONDS = 60
+BOUNDARY_NAME = "transactions"
+
+ARCHIVE_BOUNDARY = select(ArchiveBoundary.utc_datetime_before).where(ArchiveBoundary.name == BOUNDARY_NAME)
+# Databases archived before boundaries were recorded: the latest opening balance is booked just before it
+LATEST_OPENING_BALANCE = select(func.max(Transaction.utc_datetime_booked)).where(Transaction.category == OPENING_BALANCE_CATEGORY)
+
+_boundaries = {} # database url -> (boundary, monotonic time of the read)
+
+
+## Horizon
+def archive_horizon():
+    '''Transactions booked before this (naive UTC) datetime may be archived, None if archival is disabled.'''
+    if has_app_context():
+        days = current_app.config.get("TRANSACTION_ARCHIVE_AFTER_DAYS")
+    else:
+        from config import Config
+        days = getattr(Config, "TRANSACTION_ARCHIVE_AFTER_DAYS", None)
+    if days is None:
+        return None
+    return datetime.combine((datetime.utcnow() - timedelta(days=days)).date(), time.min)
+
+def account_engine(account_id):
+    if is_sharded():
+        from project.sharding import shard_for_account
+        return get_shard_engine(shard_for_account(account_id))
+    return get_shard_engine(PRIMARY_SHARD)
+
+def boundary_check_seconds():
+    if has_app_context():
+        return current_app.config.get("ARCHIVE_BOUNDARY_CHECK_SECONDS", DEFAULT_BOUNDARY_CHECK_SECONDS)
+    return DEFAULT_BOUNDARY_CHECK_SECONDS
+
+def archived_before(account_id, fresh=False):
+    '''
+    (Naive UTC) datetime before which the transactions of the account's database were archived, None if
+    nothing was archived. Cached for ARCHIVE_BOUNDARY_CHECK_SECONDS, unless fresh.
+    '''
+    engine = account_engine(account_id)
+    url = str(engine.url)
+    now = clock.monotonic()
+    cached = _boundaries.get(url)
+    if not fresh and cached is not None and now - cached[1] < boundary_check_seconds():
+        return cached[0]
+
+    with engine.connect() as connection:
+        boundary = connection.execute(ARCHIVE_BOUNDARY).scalar()
+        if boundary is None:
+            latest_opening_balance = connection.execute(LATEST_OPENING_BALANCE).scalar()
+            boundary = latest_opening_balance + timedelta(microseconds=1) if latest_opening_balance is not None else None
+    _boundaries[url] = (boundary, now)
+    return boundary
+
+def forget_archive_boundaries():
+    '''Drops the cached boundaries of this process.'''
+    _boundaries.clear()
+
+def check_booking_date(account_id, utc_datetime_booked):
+    '''Raises ValueError if utc_datetime_booked (aware or naive UTC) lies in an archived period of the account's database.'''
+    if utc_datetime_booked is None:
+        return
+    if utc_datetime_booked.tzinfo is not None:
+        utc_datetime_booked = utc_datetime_booked.astimezone(timezone.utc).replace(tzinfo=None)
+    boundary = archived_before(account_id, fresh=True) # Backdated bookings are rare, a stale boundary would let them through
+    if boundary is not None and utc_datetime_booked < boundary:
+        raise ValueError(f"Transactions cannot be booked before {boundary:%Y-%m-%d %H:%M} UTC, earlier transactions are archived.")
+
+def reaches_into_archive(account_id, start_date, end_date):
+    '''Whether a read_all date filter (start_date and end_date, both optional) covers archived periods of the account's database.'''
+    if start_date is None and end_date is None:
+        return False
+    boundary = archived_before(account_id)
+    return boundary is not None and (start_date is None or datetime.combine(start_date, time.min) < boundary)
+
+
+## Archival
+def archive_transactions(before):
+    '''
+    Moves all transactions booked before `before` (naive UTC datetime) to the archive and books the opening
+    balances, in one database transaction per shard. Returns the number of archived transactions.
+    '''
+    try:
+        return sum(archive_shard(get_shard_engine(shard_id), before) for shard_id in shard_ids())
+    finally:
+        forget_archive_boundaries() # Other processes see the new boundary after ARCHIVE_BOUNDARY_CHECK_SECONDS
+
+def archive_shard(engine, before):
+    transactions, archive = Transaction.__table__, ArchivedTransaction.__table__
+    is_old = transactions.c.utc_datetime_booked < before
+    booked = before - timedelta(microseconds=1)
+
+    with engine.begin() as connection:
+        record_boundary(connection, before)
+        totals = connection.execute(select(transactions.c.account_id, func.sum(transactions.c.amount), func.count())
+                                    .where(is_old).group_by(transactions.c.account_id)).all()
+        if not totals:
+            return 0
+
+        opening_balances = [{"description": OPENING_BALANCE_DESCRIPTION, "amount": total, "saldo": total, "category": OPENING_BALANCE_CATEGORY,
+                             "utc_datetime_booked": booked, "account_id": account_id} for account_id, total, _ in totals]
+        if is_sharded():
+            # Reserved before this transaction writes, the counter may be in the same (SQLite) database
+            from project.sharding import transaction_ids
+            for opening_balance in opening_balances:
+                opening_balance["id"] = transaction_ids.next_id()
+
+        columns = [column.name for column in transactions.columns]
+        connection.execute(insert(archive).from_select(columns, select(*[transactions.c[column] for column in columns]).where(is_old)))
+        connection.execute(delete(transactions).where(is_old))
+        if is_partitioned():
+            from project.partitioning import ensure_partitions
+            ensure_partitions(connection, [booked])
+        connection.execute(insert(transactions), opening_balances)
+        if is_partitioned():
+            from project.partitioning import drop_empty_partitions
+            drop_empty_partitions(connection, before)
+
+    return sum(count for _, _, count in totals)
+
+def record_boundary(connection, before):
+    '''Moves the recorded boundary of the database of connection forward to before (never back).'''
+    boundaries = ArchiveBoundary.__table__
+    recorded = connection.execute(ARCHIVE_BOUNDARY).scalar()
+    if recorded is None:
+        connection.execute(insert(boundaries).values(name=BOUNDARY_NAME, utc_datetime_before=before))
+    elif recorded < before:
+        connection.execute(update(boundaries).where(boundaries.c.name == BOUNDARY_NAME).values(utc_datetime_before=before))
+
+
+## CLI
+@click.command("archive-transactions")
+@with_appcontext
+def archive_transactions_command():
+    '''Move transactions older than TRANSACTION_ARCHIVE_AFTER_DAYS to the archive.'''
+    horizon = archive_horizon()
+    if horizon is None:
+        raise click.UsageError("Set TRANSACTION_ARCHIVE_AFTER_DAYS to archive transactions.")
+    click.echo(f"Archived {archive_transactions(horizon)} transactions booked before {horizon:%Y-%m-%d}.")
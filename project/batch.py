@@ -0,0 +1,145 @@
+'''
+POST /api/batch: several API operations in one round trip.
+
+Every operation names an operationId of swagger.yml, its path and query parameters and its JSON body. The
+operations are dispatched one after another through the API app in the same thread, so they are validated
+like single requests and share the thread's database session; each response is returned in order.
+
+With "atomic": true the operations run in one database transaction (the session is bound to one connection,
+commits of the operations do not end it): the batch is committed when every operation succeeded, otherwise
+it is rolled back and no operation is applied. Operations writing through other connections (account
+creation reserves account numbers, account deletion purges history in chunks) and sharded databases are
+not supported in atomic batches.
+'''
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+import re
+from urllib.parse import quote
+
+from flask import current_app, jsonify, request
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Response
+
+from project.db import db_session, get_engine, is_sharded, PRIMARY_ONLY_ENVIRON_KEY
+from project.idempotency import idempotent
+
+BATCH_OPERATION_ID = "project.batch.api_batch"
+NON_ATOMIC_OPERATIONS = {"project.accounts.api.api_create_account", "project.accounts.api.api_delete_account"}
+
+_atomic = ContextVar("atomic_batch", default=False)
+
+class BatchError(Exception):
+    pass
+
+
+## Operations of the spec
+@lru_cache(maxsize=None)
+def spec_operations():
+    '''{operationId: (method, path, {parameter name: location})} of all operations of swagger.yml except the batch itself.'''
+    from project import load_spec, API_PREFIX
+    spec = load_spec()
+    components = spec.get("components", {}).get("parameters", {})
+    resolve = lambda parameter: components[parameter["$ref"].split("/")[-1]] if "$ref" in parameter else parameter
+
+    operations = {}
+    for path, path_item in spec["paths"].items():
+        for method, operation in path_item.items():
+            if not isinstance(operation, dict) or "operationId" not in operation or operation["operationId"] == BATCH_OPERATION_ID:
+                continue
+            parameters = [resolve(parameter) for parameter in path_item.get("parameters", []) + operation.get("parameters", [])]
+            locations = {name: "path" for name in re.findall(r"{(\w+)}", path)} # Not every path parameter is declared
+            locations.update({parameter["name"]: parameter["in"] for parameter in parameters})
+            operations[operation["operationId"]] = (method.upper(), API_PREFIX + path, locations)
+    return operations
+
+def build_environ(operation):
+    '''WSGI environ of a sub-request, BatchError for unknown operations or parameters.'''
+    operation_id = operation["operation_id"]
+    if operation_id not in spec_operations():
+        raise BatchError(f"Unknown operation {operation_id}.")
+    method, path, locations = spec_operations()[operation_id]
+
+    query, headers = {}, {}
+    for name, value in operation.get("parameters", {}).items():
+        location = locations.get(name)
+        if location == "path":
+            path = path.replace("{" + name + "}", quote(str(value), safe=""))
+        elif location == "query":
+            query[name] = value
+        elif location == "header":
+            headers[name] = str(value)
+        else:
+            raise BatchError(f"Unknown parameter {name} of operation {operation_id}.")
+    if "{" in path:
+        raise BatchError(f"Missing path parameter of operation {operation_id}.")
+
+    builder = EnvironBuilder(path=path, method=method, query_string=query, headers=headers,
+                             json=operation["body"] if "body" in operation else None,
+                             environ_base={PRIMARY_ONLY_ENVIRON_KEY: True}) # Reads its own writes
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+
+## Atomic batches
+def in_atomic_batch():
+    return _atomic.get()
+
+@contextmanager
+def atomic_session():
+    '''Binds the thread's session to one connection for the block; yields its (outer) transaction.'''
+    connection = get_engine().connect()
+    transaction = connection.begin()
+    db_session.remove()
+    # "rollback_only": commits of the session leave the outer transaction open, rollbacks roll it back
+    db_session(bind=connection, join_transaction_mode="rollback_only")
+    token = _atomic.set(True)
+    try:
+        yield transaction
+    finally:
+        _atomic.reset(token)
+        db_session.remove()
+        if transaction.is_active:
+            transaction.rollback()
+        connection.close()
+
+
+## API Endpoint
+@idempotent
+def api_batch():
+    data = request.get_json()
+    operations, atomic = data["operations"], data.get("atomic", False)
+
+    try:
+        if atomic and is_sharded():
+            raise BatchError("Atomic batches are not supported with sharded transactions.")
+        for operation in operations:
+            if atomic and operation["operation_id"] in NON_ATOMIC_OPERATIONS:
+                raise BatchError(f"Operation {operation['operation_id']} cannot run in an atomic batch.")
+        environs = [build_environ(operation) for operation in operations]
+    except BatchError as be:
+        return jsonify({"status": "error", "detail": str(be)}), 400
+
+    if not atomic:
+        return jsonify({"status": "success", "results": [run(environ) for environ in environs]}), 200
+
+    results = []
+    with atomic_session() as transaction:
+        for index, environ in enumerate(environs):
+            results.append(run(environ))
+            if results[-1]["status_code"] >= 400:
+                transaction.rollback()
+                return jsonify({"status": "error",
+                                "detail": f"Operation {index} failed, no operation was applied.",
+                                "results": results}), 400
+        transaction.commit()
+    return jsonify({"status": "success", "results": results}), 200
+
+
+## Subfunctions
+def run(environ):
+    '''Dispatches one sub-request through the API app; its status code and JSON body.'''
+    response = Response.from_app(current_app.wsgi_app, environ, buffered=True)
+    return {"status_code": response.status_code, "body": response.get_json(silent=True)}
@@ -1,100 +1,242 @@
 # SQLAlchemy
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base
-
-# Import for seeding sessions
-import random
-from datetime import datetime, timezone, timedelta
-import pytz
-from pprint import pprint
-
-from project import app
-
-
-
-engine = create_engine(app.app.config["DATABASE_URL"])
-
-db_session = scoped_session(sessionmaker(autocommit=False,
-                                        autoflush=False,
-                                        bind=engine))
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base, Session
+
+import time
+from contextvars import ContextVar
+
+import click
+from flask import request, session
+from flask.cli import with_appcontext
+
+# The engine is created on first use (not at import or app creation), see get_engine()
+_engine = None
+_database_url = None
+
+# Optional read replica, see get_bind() and register_replica_routing()
+_replica_engine = None
+_replica_url = None
+_read_from_replica = ContextVar("read_from_replica", default=False)
+_wrote_to_primary = ContextVar("wrote_to_primary", default=False)
+PRIMARY_UNTIL_SESSION_KEY = "db_primary_until"
+PRIMARY_ONLY_ENVIRON_KEY = "project.primary_only" # Set in the WSGI environ of requests that always read from the primary
+
+# Optional transaction shards in addition to the primary database (shard "0"), see project/sharding.py
+_shard_urls = ()
+_shard_engines = {}
+PRIMARY_SHARD = "0"
+
+# Optional time partitioning of transactions (e.g. "monthly"), see project/partitioning.py
+_partitioning = None
+
+# Storage of amounts and saldos, "decimal" (NUMERIC) or "cents" (BIGINT), see project/money.py
+_amount_storage = "decimal"
+
+# psycopg (3) prepares a statement on the server once it has been executed this many times on a connection.
+# The statements of project/queries.py keep their SQL text, so they are prepared once per connection.
+POSTGRES_PREPARE_THRESHOLD = 2
+
+def configure_engine(database_url, replica_url=None, shard_urls=(), partitioning=None, amount_storage=None):
+    '''Sets the database urls used by get_engine(), get_replica_engine() and get_shard_engine(). Does not connect.'''
+    global _engine, _database_url, _replica_engine, _replica_url, _shard_urls, _shard_engines, _partitioning, _amount_storage
+    amount_storage = amount_storage or "decimal"
+    if partitioning not in (None, "monthly"):
+        raise ValueError(f"Unsupported transaction partitioning {partitioning!r}, only 'monthly' is supported.")
+    if amount_storage not in ("decimal", "cents"):
+        raise ValueError(f"Unsupported amount storage {amount_storage!r}, use 'decimal' or 'cents'.")
+    if (partitioning, amount_storage) != (_partitioning, _amount_storage):
+        # Engines are set up differently for partitioned tables and amounts in cents, see create_configured_engine()
+        for engine in [_engine, _replica_engine, *_shard_engines.values()]:
+            if engine is not None:
+                engine.dispose()
+        _engine, _replica_engine, _shard_engines = None, None, {}
+        _partitioning = partitioning
+        _amount_storage = amount_storage
+    if database_url != _database_url:
+        if _engine is not None:
+            _engine.dispose()
+        _engine = None
+        _database_url = database_url
+    if replica_url != _replica_url:
+        if _replica_engine is not None:
+            _replica_engine.dispose()
+        _replica_engine = None
+        _replica_url = replica_url
+    shard_urls = tuple(shard_urls or ())
+    if shard_urls != _shard_urls:
+        for engine in _shard_engines.values():
+            engine.dispose()
+        _shard_engines = {}
+        _shard_urls = shard_urls
+        db_session.remove() # The session class depends on whether transactions are sharded
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        if _database_url is None:
+            from config import Config
+            configure_engine(Config.DATABASE_URL, getattr(Config, "DATABASE_REPLICA_URL", None), getattr(Config, "TRANSACTION_SHARD_URLS", ()),
+                             getattr(Config, "TRANSACTION_PARTITIONING", None), getattr(Config, "AMOUNT_STORAGE", None))
+        _engine = create_configured_engine(_database_url)
+    return _engine
+
+def create_configured_engine(url):
+    connect_args = {}
+    if make_url(url).get_driver_name() == "psycopg":
+        # psycopg2 has no server-side prepared statements, only psycopg (postgresql+psycopg://) does
+        connect_args["prepare_threshold"] = POSTGRES_PREPARE_THRESHOLD
+    engine = create_engine(url, connect_args=connect_args)
+    # Read by the Money column type (project/money.py) when it binds and loads amounts
+    engine.dialect.amounts_in_cents = _amount_storage == "cents"
+    if engine.dialect.name == "sqlite":
+        # SQLite only enforces foreign keys (and their ON DELETE CASCADE) when asked to, per connection
+        event.listen(engine, "connect", lambda dbapi_connection, connection_record: dbapi_connection.execute("PRAGMA foreign_keys=ON"))
+    if _partitioning is not None and engine.dialect.name == "sqlite":
+        # Partitioned transactions are written through INSTEAD OF triggers of a view, which SQLite
+        # does not count in the number of affected rows (ORM updates would be reported as stale)
+        engine.dialect.supports_sane_rowcount = False
+        engine.dialect.supports_sane_multi_rowcount = False
+    return engine
+
+def get_replica_engine():
+    '''Engine of the read replica, or the primary engine if no replica is configured.'''
+    global _replica_engine
+    if _replica_url is None:
+        return get_engine()
+    if _replica_engine is None:
+        _replica_engine = create_configured_engine(_replica_url)
+    return _replica_engine
+
+def shard_ids():
+    '''Ids of all transaction shards, the primary database being shard "0".'''
+    return [str(index) for index in range(len(_shard_urls) + 1)]
+
+def get_shard_engine(shard_id):
+    if shard_id == PRIMARY_SHARD:
+        return get_engine()
+    if shard_id not in _shard_engines:
+        _shard_engines[shard_id] = create_configured_engine(_shard_urls[int(shard_id) - 1])
+    return _shard_engines[shard_id]
+
+def is_sharded():
+    return len(_shard_urls) > 0
+
+def is_partitioned():
+    return _partitioning is not None
+
+class LazySession(Session):
+    '''
+    Session resolving its engine on first use, so the engine can be configured after import.
+    Reads go to the replica while read_from_replica() is active, flushes and INSERT/UPDATE/DELETE always
+    go to the primary. A session bound to a connection (atomic batches, see project/batch.py) only uses it.
+    '''
+    def get_bind(self, mapper=None, clause=None, **kw):
+        return self.primary_or_replica(clause)
+
+    def primary_or_replica(self, clause=None):
+        if self.bind is not None:
+            return self.bind
+        if _read_from_replica.get() and not self._flushing and not getattr(clause, "is_dml", False):
+            return get_replica_engine()
+        return get_engine()
+
+_session_factory = sessionmaker(class_=LazySession,
+                                autocommit=False,
+                                autoflush=False)
+
+def create_session(**kwargs):
+    if is_sharded():
+        from project.sharding import sharded_session_factory
+        return sharded_session_factory(**kwargs)
+    return _session_factory(**kwargs)
+
+db_session = scoped_session(create_session)
 Base = declarative_base()
 Base.query = db_session.query_property()
 
+## Read/write routing
+@event.listens_for(LazySession, "after_flush")
+def _after_flush(session, flush_context):
+    wrote_to_primary()
+
+@event.listens_for(LazySession, "do_orm_execute")
+def _after_orm_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        wrote_to_primary()
+
+def wrote_to_primary():
+    '''Following reads (of this request) go to the primary, so they see the write.'''
+    _read_from_replica.set(False)
+    _wrote_to_primary.set(True)
+
+def read_from_replica(enabled=True):
+    _read_from_replica.set(enabled and _replica_url is not None)
+    _wrote_to_primary.set(False)
+
+def read_only(view):
+    '''Marks a view that is not sent with GET (e.g. a form POST) as safe to serve from the replica.'''
+    view.read_only = True
+    return view
+
+def register_replica_routing(app):
+    '''
+    Serves GET requests and @read_only views from the replica. After a write, the client's requests
+    stay on the primary for REPLICA_STICKINESS_SECONDS, so it reads its own writes despite replication lag.
+    '''
+    @app.before_request
+    def route_request():
+        view = app.view_functions.get(request.endpoint)
+        is_read = request.method in ("GET", "HEAD") or getattr(view, "read_only", False)
+        sticky = session.get(PRIMARY_UNTIL_SESSION_KEY, 0) > time.time() or request.environ.get(PRIMARY_ONLY_ENVIRON_KEY, False)
+        read_from_replica(is_read and not sticky)
+
+    @app.after_request
+    def stick_to_primary(response):
+        if _wrote_to_primary.get():
+            session[PRIMARY_UNTIL_SESSION_KEY] = time.time() + app.config.get("REPLICA_STICKINESS_SECONDS", 5)
+        return response
+
+    @app.teardown_request
+    def reset_routing(exception=None):
+        read_from_replica(False)
+
 def init_db():
+    from project.models import Account, Transaction, ArchivedTransaction, IdempotencyKey, TransferOutbox, AppliedTransfer, IdBlock, CacheVersion, ArchiveBoundary, DatabaseSetting, AccountDeletion
+    Base.metadata.create_all(bind=get_engine())
+    # create_all() skips the indexes of existing tables, e.g. of an accounts table created before the index
+    # (expression indexes are not reflected, so IF NOT EXISTS instead of checkfirst)
+    from project.models import ACCOUNT_TITLE_LOWER_INDEX
+    with get_engine().begin() as connection:
+        connection.execute(CreateIndex(ACCOUNT_TITLE_LOWER_INDEX, if_not_exists=True))
+    if is_sharded():
+        from project.sharding import init_shards
+        init_shards()
+    if is_partitioned():
+        from project.partitioning import init_partitions
+        for shard_id in shard_ids():
+            init_partitions(get_shard_engine(shard_id))
+    from project.money import record_amount_storage
+    for shard_id in shard_ids():
+        with get_shard_engine(shard_id).begin() as connection:
+            record_amount_storage(connection)
+
+
+## CLI
+@click.command("init-db")
+@click.option("--demo", is_flag=True, help="Seed demo data if the database has less than 3 accounts or no transactions.")
+@with_appcontext
+def init_db_command(demo):
+    '''Create all tables (existing tables are kept).'''
     from project.models import Account, Transaction
-    Base.metadata.create_all(bind=engine)
-
-    print(f"Continuing db setup with db session at: {db_session.get_bind()}")
-    print(f"Table names: {Base.metadata.tables.keys()}")
-
-    if app.app.config["TESTING"] is False:
-        print("__________[DB] NORMAL SETUP__________")
-        print(f"Existing accounts: {Account.query.count()}, existing transactions: {Transaction.query.count()}")
-
-        if Account.query.count() < 3 or Transaction.query.count() == 0:
-            Transaction.query.delete()
-            Account.query.delete()
-            print("Seeding database")
-            create_database(Account, Transaction)
-            print("Seeding complete")
-    else:
-        print("__________[DB] TEST SETUP__________")
-
-
-def create_database(Account, Transaction):
-
-    account1 = Account(title="Main account", iban="GB29000060161331920000")
-    account2 = Account(title="Savings", iban="GB29000060161331920001")
-    account3 = Account(title="Shared", iban="GB29000060161331920002")
-
-    transactions = [
-        # Year 2023 August
-        Transaction(description="Paypal-Henry-Thanks!", amount=-95.00, category="Night out", utc_datetime_booked=random_utc_datetime(2023, 8, 15)),
-        Transaction(description="Rent August", amount=-600.00, category="Rent", utc_datetime_booked=random_utc_datetime(2023, 8, 20)),
-        Transaction(description="Apple salary", amount=1200.00, category="Salary", utc_datetime_booked=random_utc_datetime(2023, 8, 5)),
-        Transaction(description="Grocery Store Purchase - Kroger", amount=-250.00, category="Groceries", utc_datetime_booked=random_utc_datetime(2023, 8, 10)),
-        Transaction(description="Electric bill", amount=-80.00, category="Utilities", utc_datetime_booked=random_utc_datetime(2023, 8, 15)),
-
-        # Year 2023 July
-        Transaction(description="Wire Transfer - Invoice #12345", amount=-200.00, category="Groceries", utc_datetime_booked=random_utc_datetime(2023, 7, 2)),
-        Transaction(description="Withdrawal - ATM Transaction", amount=-600.00, category="Rent", utc_datetime_booked=random_utc_datetime(2023, 7, 5)),
-        Transaction(description="Apple salary", amount=1200.00, category="Salary", utc_datetime_booked=random_utc_datetime(2023, 7, 12)),
-        Transaction(description="Grocery Store Purchase - Kroger", amount=-70.00, category="Groceries", utc_datetime_booked=random_utc_datetime(2023, 7, 18)),
-        Transaction(description="Student Loan Payment - Sallie Mae", amount=150.00, category="Online services", utc_datetime_booked=random_utc_datetime(2023, 7, 25)),
-
-        # Year 2023 June
-        Transaction(description="Spotify lifetime membership", amount=-99.00, category="Online services", utc_datetime_booked=random_utc_datetime(2023, 6, 7)),
-        Transaction(description="Rent June", amount=-600.00, category="Rent", utc_datetime_booked=random_utc_datetime(2023, 6, 11)),
-        Transaction(description="Apple salary", amount=1200.00, category="Salary", utc_datetime_booked=random_utc_datetime(2023, 6, 15)),
-        Transaction(description="Online Purchase - Amazon", amount=-55.00, category="Night out", utc_datetime_booked=random_utc_datetime(2023, 6, 20)),
-        Transaction(description="Utility Bill Payment - Electric", amount=130.00, category="Utilities", utc_datetime_booked=random_utc_datetime(2023, 6, 30)),
-
-        # Year 2023 April
-        Transaction(description="Dividends", amount=70.00, category="Salary", utc_datetime_booked=random_utc_datetime(2023, 4, 4)),
-        Transaction(description="Rent April", amount=-600.00, category="Rent", utc_datetime_booked=random_utc_datetime(2023, 4, 9)),
-        Transaction(description="Apple salary", amount=1200.00, category="Salary", utc_datetime_booked=random_utc_datetime(2023, 4, 16)),
-        Transaction(description="Utility Bill Payment - Electric", amount=-45.00, category="Utilities", utc_datetime_booked=random_utc_datetime(2023, 4, 22)),
-        Transaction(description="EDEKA sagt danke", amount=-390.00, category="Groceries", utc_datetime_booked=random_utc_datetime(2023, 4, 28)),
-    ]
-    for transaction in transactions:
-        account1.transactions.append(transaction)
-    db_session.add_all([account1, account2, account3])
-    db_session.commit()
-
-    transactions = db_session.query(Transaction).all()
-    for transaction in transactions:
-        transaction.calculate_saldo()
-
-    db_session.commit()
-
-def random_utc_datetime(year, month, day):
-    # Assign random time
-    hour = random.randint(0, 23)
-    minute = random.randint(0, 59)
-    second = random.randint(0, 59)
-
-    # Create the datetime object
-    dt = datetime(year, month, day, hour, minute, second)
-
-    # Convert to UTC timezone-aware
-    return dt.replace(tzinfo=pytz.UTC)
+
+    init_db()
+    click.echo(f"Created tables: {', '.join(Base.metadata.tables.keys())}")
+
+    if demo and is_sharded():
+        click.echo("Demo data is not seeded into sharded databases.")
+    elif demo and (Account.query.count() < 3 or Transaction.query.count() == 0):
+        from project.seed import seed_database
+        db_session.remove()
+        seed_database(get_engine(), num_accounts=3, num_transactions=200, months=6)
+        click.echo("Seeded demo data.")
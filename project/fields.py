@@ -0,0 +1,31 @@
+'''
+Sparse fieldsets and compact lists of API responses.
+
+?fields=id,title limits the objects of a response to the named fields (validated against the enum of the
+endpoint's parameter in swagger.yml). ?compact=true encodes lists as {"fields": [...], "rows": [[...], ...]}:
+the field names once, then every object as an array of its values in the same order, so names repeated on
+every object (e.g. account_id of transactions) are not sent again and again.
+
+Without either parameter lists are returned as they are and converted by their @json_encoder while the
+response is serialised (project/json_provider.py).
+'''
+
+
+def select_fields(document, fields=None):
+    '''document with only the given fields, in their order (all of document without fields).'''
+    if not fields:
+        return document
+    return {field: document[field] for field in fields if field in document} # Unknown fields are rejected by the spec
+
+def shape_list(objects, encoder, all_fields, fields=None, compact=False):
+    '''
+    Objects of a list response: as they are without fields and compact, otherwise encoded by encoder and
+    limited to fields (default all_fields), compact as {"fields": [...], "rows": [[...], ...]}.
+    '''
+    if not fields and not compact:
+        return list(objects)
+    fields = [field for field in fields or all_fields if field in all_fields]
+    documents = (encoder(item) for item in objects)
+    if compact:
+        return {"fields": fields, "rows": [[document[field] for field in fields] for document in documents]}
+    return [select_fields(document, fields) for document in documents]
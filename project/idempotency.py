@@ -0,0 +1,217 @@
+'''
+Idempotency keys for API writes.
+
+Clients can send an `Idempotency-Key` header with requests they might retry. The first request with a key
+is executed and its response stored; a retry with the same key (and the same request) gets the stored
+response back without executing the write again. Stored responses are shared by all workers through the
+idempotency_keys table, recently used keys are additionally kept in an in-process LRU cache.
+
+While a request is executed, its key is reserved (a row without response). A reservation older than
+IDEMPOTENCY_RESERVATION_SECONDS belongs to a request that did not finish (e.g. its worker was killed), a
+retry then takes it over instead of getting 409 until the key expires. The reservation time should be
+longer than the slowest API write.
+'''
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+
+import click
+from flask import current_app, request, jsonify, make_response, Response
+from flask.cli import with_appcontext
+from sqlalchemy.exc import IntegrityError
+
+from project.db import db_session
+from project.models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+## Custom exceptions
+class IdempotencyKeyMismatchError(Exception):
+    pass
+class IdempotencyKeyInProgressError(Exception):
+    pass
+
+
+## Cache of recent keys
+class RecentKeysCache:
+    '''Thread-safe LRU cache of completed responses with a time to live per entry.'''
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''Returns (request_fingerprint, status_code, response_body) or None if unknown or expired.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, response, ttl_seconds, max_size):
+        with self._lock:
+            self._entries[key] = (response, time.monotonic() + ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+recent_keys = RecentKeysCache()
+
+
+## Decorator for API endpoints
+def idempotent(func):
+    '''Replays the stored response if the request carries an Idempotency-Key that was used before.'''
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return func(*args, **kwargs)
+
+        try:
+            stored_response = get_or_reserve_key(key, request_fingerprint())
+        except IdempotencyKeyMismatchError as me:
+            return jsonify({"status": "error", "detail": str(me)}), 422
+        except IdempotencyKeyInProgressError as pe:
+            return jsonify({"status": "error", "detail": str(pe)}), 409
+
+        if stored_response is not None:
+            _, status_code, response_body = stored_response
+            return Response(response_body, status=status_code, mimetype="application/json", headers={REPLAYED_HEADER: "true"})
+
+        try:
+            response = make_response(func(*args, **kwargs))
+        except Exception:
+            release_key(key)
+            raise
+
+        # Server errors are not stored, so the client can retry them
+        if response.status_code >= 500:
+            release_key(key)
+        else:
+            store_response(key, response)
+        return response
+
+    return wrapper
+
+
+## Subfunctions
+def ttl_seconds():
+    return current_app.config.get("IDEMPOTENCY_KEY_TTL_SECONDS", 24 * 60 * 60)
+
+def reservation_seconds():
+    return current_app.config.get("IDEMPOTENCY_RESERVATION_SECONDS", 60)
+
+def request_fingerprint():
+    '''Hash of method, path and (normalised) JSON body, so a key cannot be reused for a different request.'''
+    body = request.get_json(silent=True)
+    payload = json.dumps([request.method, request.path, body], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get_or_reserve_key(key, fingerprint):
+    '''
+    Returns the stored (request_fingerprint, status_code, response_body) of a completed request with this key.
+    Returns None if the key is new; it is then reserved (committed without a response) so concurrent retries
+    get a 409 instead of executing the write a second time.
+    '''
+    cached = recent_keys.get(key)
+    if cached is None:
+        stored = db_session.get(IdempotencyKey, key)
+
+        # Expired keys can be used again
+        if stored is not None and stored.utc_datetime_created <= datetime.utcnow() - timedelta(seconds=ttl_seconds()):
+            db_session.delete(stored)
+            db_session.commit()
+            stored = None
+
+        if stored is None:
+            db_session.add(IdempotencyKey(key=key, request_fingerprint=fingerprint, utc_datetime_created=datetime.utcnow()))
+            try:
+                db_session.commit()
+                return None
+            except IntegrityError:
+                # Another request reserved the same key in the meantime
+                db_session.rollback()
+                stored = db_session.get(IdempotencyKey, key)
+
+        if stored.status_code is None:
+            if stored.utc_datetime_created <= datetime.utcnow() - timedelta(seconds=reservation_seconds()):
+                # The request holding the reservation did not finish, this one takes it over
+                if take_over_reservation(key, stored.utc_datetime_created, fingerprint):
+                    return None
+                raise IdempotencyKeyInProgressError("A request with this Idempotency-Key is still being processed.")
+            if stored.request_fingerprint != fingerprint:
+                raise IdempotencyKeyMismatchError("The Idempotency-Key was already used for a different request.")
+            raise IdempotencyKeyInProgressError("A request with this Idempotency-Key is still being processed.")
+
+        cached = (stored.request_fingerprint, stored.status_code, stored.response_body)
+        remaining_seconds = (stored.utc_datetime_created + timedelta(seconds=ttl_seconds()) - datetime.utcnow()).total_seconds()
+        cache_response(key, cached, remaining_seconds)
+
+    if cached[0] != fingerprint:
+        raise IdempotencyKeyMismatchError("The Idempotency-Key was already used for a different request.")
+    return cached
+
+def take_over_reservation(key, reserved_at, fingerprint):
+    '''Reserves the key of a stale reservation made at reserved_at again, False if another retry was faster.'''
+    taken = db_session.query(IdempotencyKey).filter(
+        IdempotencyKey.key == key,
+        IdempotencyKey.status_code.is_(None),
+        IdempotencyKey.utc_datetime_created == reserved_at
+    ).update({"request_fingerprint": fingerprint, "utc_datetime_created": datetime.utcnow()}, synchronize_session=False)
+    db_session.commit()
+    return taken == 1
+
+def store_response(key, response):
+    response_body = response.get_data(as_text=True)
+    db_session.query(IdempotencyKey).filter(IdempotencyKey.key == key).update(
+        {"status_code": response.status_code, "response_body": response_body}, synchronize_session=False)
+    db_session.commit()
+    cache_response(key, (request_fingerprint(), response.status_code, response_body), ttl_seconds())
+
+def cache_response(key, response, ttl):
+    '''
+    Keeps a stored response in recent_keys. Not within an atomic batch (see project/batch.py): its commits do
+    not end the batch's transaction, a rollback of the batch removes the stored response again.
+    '''
+    from project.batch import in_atomic_batch
+    if in_atomic_batch():
+        return
+    recent_keys.set(key, response, ttl, current_app.config.get("IDEMPOTENCY_CACHE_SIZE", 1024))
+
+def release_key(key):
+    db_session.rollback()
+    db_session.query(IdempotencyKey).filter(IdempotencyKey.key == key).delete(synchronize_session=False)
+    db_session.commit()
+
+def purge_expired_keys(ttl_seconds):
+    '''Deletes stored responses older than the time to live. Returns the number of deleted keys.'''
+    expired_before = datetime.utcnow() - timedelta(seconds=ttl_seconds)
+    deleted = db_session.query(IdempotencyKey).filter(IdempotencyKey.utc_datetime_created <= expired_before).delete(synchronize_session=False)
+    db_session.commit()
+    return deleted
+
+
+## CLI
+@click.command("purge-idempotency-keys")
+@with_appcontext
+def purge_idempotency_keys_command():
+    '''Delete expired idempotency keys.'''
+    deleted = purge_expired_keys(ttl_seconds())
+    click.echo(f"Deleted {deleted} expired idempotency keys.")
@@ -0,0 +1,65 @@
+'''
+Numbers handed out from counter rows (table id_blocks) in the primary database.
+
+Each process reserves a block of numbers with one UPDATE and hands them out from memory, so most numbers
+cost no database round trip at all. Numbers are unique across processes, but not gap-free: the rest of
+a block is lost when a process exits. Used for transaction ids on sharded databases (project/sharding.py)
+and for account numbers of new IBANs (project/accounts/ibans.py).
+'''
+import threading
+
+from sqlalchemy import select, update, insert
+from sqlalchemy.exc import IntegrityError
+
+from project.db import get_engine
+from project.models import IdBlock
+
+ID_BLOCK_SIZE = 1000
+
+class IdAllocationError(Exception):
+    pass
+
+
+class IdAllocator:
+    '''
+    Hands out the numbers of the counter row `name` from blocks of block_size. The first block starts at
+    first_id(), called when the counter row does not exist yet.
+    '''
+
+    def __init__(self, name, first_id=lambda: 1, block_size=ID_BLOCK_SIZE):
+        self.name = name
+        self.first_id = first_id
+        self.block_size = block_size
+        self._ids = iter(())
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            next_id = next(self._ids, None)
+            if next_id is None:
+                self._ids = iter(self.reserve_block())
+                next_id = next(self._ids)
+            return next_id
+
+    def reserve_block(self):
+        counter = IdBlock.__table__
+        for _ in range(2):
+            with get_engine().begin() as connection:
+                updated = connection.execute(update(counter).where(counter.c.name == self.name)
+                                             .values(next_id=counter.c.next_id + self.block_size))
+                if updated.rowcount == 1:
+                    end = connection.execute(select(counter.c.next_id).where(counter.c.name == self.name)).scalar()
+                    return range(end - self.block_size, end)
+            start = self.first_id()
+            try:
+                with get_engine().begin() as connection:
+                    connection.execute(insert(counter).values(name=self.name, next_id=start + self.block_size))
+                return range(start, start + self.block_size)
+            except IntegrityError:
+                pass # Another process created the counter in the meantime
+        raise IdAllocationError(f"Could not reserve ids for {self.name}.")
+
+    def reset(self):
+        '''Drops the rest of the current block, e.g. after the counter row was changed.'''
+        with self._lock:
+            self._ids = iter(())
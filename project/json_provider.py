@@ -0,0 +1,102 @@
+'''
+JSON provider of the web and the API app (app.json, used by jsonify, request.get_json and connexion).
+
+Uses orjson when it is installed, the standard library json module otherwise. Both encode the same way:
+- Decimal amounts and saldos as numbers (floats)
+- datetimes as ISO 8601 with offset; naive datetimes are UTC ("2023-09-04T12:00:00+00:00")
+- dates as ISO 8601
+- objects of types registered with @json_encoder through their encoder function
+
+Registered types (e.g. transactions and transaction rows, see project/transactions/api.py) can be put into
+responses as they are: they are converted while the response is serialised, one object at a time.
+'''
+import decimal
+import json
+from datetime import datetime, date
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError: # Optional, see requirements.txt
+    orjson = None
+
+# Encoder functions by type, see json_encoder()
+_encoders = {}
+
+
+def json_encoder(*types):
+    '''Decorator registering the decorated function as the JSON encoder of objects of the given types.'''
+    def register(function):
+        for type_ in types:
+            _encoders[type_] = function
+        return function
+    return register
+
+def datetime_isoformat(value):
+    if value.tzinfo is None:
+        return value.isoformat() + "+00:00"
+    return value.isoformat()
+
+def default(value):
+    '''Encodes what neither orjson nor json handle by themselves.'''
+    encoder = _encoders.get(type(value))
+    if encoder is not None:
+        return encoder(value)
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return datetime_isoformat(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+## Standard library json
+class JSONEncoder(json.JSONEncoder):
+    def default(self, value):
+        return default(value)
+
+def prepare(value):
+    '''
+    Encodes registered types ahead of json.dumps: json writes tuples (e.g. TransactionRow) as arrays without
+    asking default(). orjson does not need this.
+    '''
+    if type(value) in _encoders:
+        return prepare(_encoders[type(value)](value))
+    if isinstance(value, dict):
+        return {key: prepare(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [prepare(item) for item in value]
+    return value
+
+
+## Provider
+class FastJSONProvider(JSONProvider):
+    '''JSON provider using orjson if available (see module docstring).'''
+
+    def dumps(self, obj, **kwargs):
+        if set(kwargs) - {"indent", "sort_keys", "separators"}:
+            # Options orjson has no equivalent for
+            kwargs.setdefault("cls", JSONEncoder)
+            return json.dumps(prepare(obj), **kwargs)
+        return self.dump_bytes(obj, indent=kwargs.get("indent"), sort_keys=kwargs.get("sort_keys", False)).decode()
+
+    def dump_bytes(self, obj, indent=None, sort_keys=False):
+        if orjson is not None:
+            option = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+            if indent:
+                option |= orjson.OPT_INDENT_2
+            if sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            return orjson.dumps(obj, default=default, option=option)
+        return json.dumps(prepare(obj), cls=JSONEncoder, indent=indent, sort_keys=sort_keys, ensure_ascii=False).encode()
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs: # e.g. the object_hook of Flask's session serializer
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dump_bytes(obj) + b"\n", mimetype="application/json")
@@ -0,0 +1,151 @@
+'''
+Logging of the app, installed by create_app().
+
+Modules log through logging.getLogger(__name__). Records are handed to a queue by the calling thread
+(QueueHandler) and formatted and written to stdout by a listener thread (QueueListener), so requests do not
+wait for the stdout pipe. Messages and their arguments are formatted in the calling thread, extra fields
+(logger.info("...", extra={"transaction_id": 1})) should be plain values.
+
+Every record is written as one JSON object per line: time, level, logger, message, the extra fields and the
+traceback of logged exceptions. LOG_LEVEL sets the level of all loggers, LOG_LEVELS the levels of single
+loggers ("project.transactions=WARNING,sqlalchemy.engine=INFO"). High-volume success messages are logged
+with extra={"sampled": True}; of these, only the share LOG_SAMPLE_RATE (e.g. 0.01) is written.
+'''
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from project.json_provider import default, prepare
+
+DEFAULT_LEVEL = "INFO"
+DEFAULT_SAMPLE_RATE = 1.0
+
+# Attributes every LogRecord has, everything else was passed as extra
+RECORD_ATTRIBUTES = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime", "sampled"}
+
+_handler = None # The BackgroundLogHandler on the root logger, see configure_logging()
+
+
+## Formatting
+class JSONFormatter(logging.Formatter):
+    '''One JSON object per record (see module docstring).'''
+
+    def format(self, record):
+        document = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        document.update((key, value) for key, value in record.__dict__.items() if key not in RECORD_ATTRIBUTES)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            document["exception"] = record.exc_text
+        return json.dumps(prepare(document), default=default, ensure_ascii=False)
+
+class StdoutHandler(logging.StreamHandler):
+    '''Writes to the current sys.stdout (which may be replaced after the handler was created, e.g. by pytest).'''
+
+    def emit(self, record):
+        self.stream = sys.stdout
+        super().emit(record)
+
+
+## Sampling
+class SamplingFilter(logging.Filter):
+    '''Lets through the share rate of the records logged with extra={"sampled": True}, all other records.'''
+
+    def __init__(self, rate=DEFAULT_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+        self._credit = 0.0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False) or self.rate >= 1:
+            return True
+        with self._lock:
+            # Evenly spread: every 1/rate-th record
+            self._credit += self.rate
+            if self._credit >= 1:
+                self._credit -= 1
+                return True
+            return False
+
+
+## Queue
+class BackgroundLogHandler(QueueHandler):
+    '''Queues records for a listener thread writing them with handler (one listener per process).'''
+
+    def __init__(self, handler):
+        super().__init__(queue.SimpleQueue())
+        self.handler = handler
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def start(self):
+        # Threads do not survive a fork (e.g. gunicorn workers with --preload), so the listener is started per process
+        if self._listener is None or self._pid != os.getpid():
+            with self._lock:
+                if self._listener is None or self._pid != os.getpid():
+                    self.queue = queue.SimpleQueue()
+                    self._listener = QueueListener(self.queue, self.handler, respect_handler_level=True)
+                    self._pid = os.getpid()
+                    self._listener.start()
+
+    def stop(self):
+        '''Writes everything queued so far and stops the listener thread.'''
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+        self._listener = None
+
+    def prepare(self, record):
+        # Unlike QueueHandler.prepare(), the message is not formatted into text yet (JSONFormatter does that),
+        # only its arguments are merged and the traceback is rendered while it is available
+        message = record.getMessage()
+        exc_text = self.handler.formatter.formatException(record.exc_info) if record.exc_info else record.exc_text
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg, record.args, record.exc_info, record.exc_text = message, None, None, exc_text
+        return record
+
+    def enqueue(self, record):
+        self.start()
+        super().enqueue(record)
+
+
+## Setup
+def parse_levels(levels):
+    '''{"logger": "LEVEL"} of "logger=LEVEL,..."'''
+    parsed = {}
+    for item in (levels or "").split(","):
+        if item.strip():
+            name, _, level = item.partition("=")
+            parsed[name.strip()] = level.strip().upper()
+    return parsed
+
+def configure_logging(config):
+    '''Installs the background JSON handler on the root logger (once per process) and applies the levels and sampling of config.'''
+    global _handler
+    root = logging.getLogger()
+    if _handler is None:
+        stdout_handler = StdoutHandler()
+        stdout_handler.setFormatter(JSONFormatter())
+        _handler = BackgroundLogHandler(stdout_handler)
+        _handler.addFilter(SamplingFilter())
+        root.addHandler(_handler)
+
+    root.setLevel(config.get("LOG_LEVEL") or DEFAULT_LEVEL)
+    for name, level in parse_levels(config.get("LOG_LEVELS")).items():
+        logging.getLogger(name).setLevel(level)
+    for sampling_filter in _handler.filters:
+        sampling_filter.rate = float(config.get("LOG_SAMPLE_RATE", DEFAULT_SAMPLE_RATE))
+    return _handler
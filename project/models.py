@@ -1,32 +1,40 @@
-from datetime import datetime, date
+from collections import namedtuple
+from datetime import datetime, date, time, timedelta
 import pytz
-from sqlalchemy import desc, func
+from sqlalchemy import desc, func, and_
 import decimal
 from pprint import pprint
 
 from sqlalchemy import event
 from sqlalchemy.orm import mapper
 
-from sqlalchemy import Column, Integer, String, DateTime, Numeric, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index
 from sqlalchemy.orm import relationship
 from project.db import Base, db_session
+from project.money import Money, to_amount
+from project.tracing import traced
+
+# Booked by the archival job for the archived transactions of an account (see project/archive.py)
+OPENING_BALANCE_CATEGORY = "Opening balance"
+OPENING_BALANCE_DESCRIPTION = "Opening balance (archived transactions)"
+TRANSFER_CATEGORY = "Transfer" # Both legs of a subaccount transfer
 
 class AccountLimitException(Exception):
     pass
 class IBANAlreadyExistsError(Exception):
     pass
 
-def check_iban_exists(iban):
-    existing_account = db_session.query(Account).filter_by(iban=iban).first()
-    if existing_account:
-        raise IBANAlreadyExistsError(f"The IBAN is already taken by another account.")
-
 class Account(Base):
     __tablename__ = "accounts"
     id = Column(Integer, primary_key = True)
     title = Column(String(15), index = True)
     iban = Column(String(22), index = True, unique = True)
-    transactions = relationship('Transaction', backref='account', lazy="dynamic", cascade="all, delete-orphan")
+    # The database deletes the transactions of a deleted account (ON DELETE CASCADE), see project/accounts/purge.py
+    transactions = relationship('Transaction', backref='account', lazy="dynamic", cascade="all, delete-orphan", passive_deletes=True)
+    archived_transactions = relationship('ArchivedTransaction', lazy="dynamic", cascade="all, delete-orphan", passive_deletes=True)
+    # Set while the history of a deleted account is purged in the background (see project/accounts/purge.py),
+    # loaded with the account (one query): get_account() treats such accounts as deleted
+    deletion = relationship('AccountDeletion', uselist=False, lazy="joined", passive_deletes=True)
 
     def __init__(self, title, iban):
         if (not isinstance(title, str)) or (title[0] in "0123456789"):
@@ -38,9 +46,7 @@ class Account(Base):
             raise ValueError(f"iban should be of type str.")
         elif len(iban) != 22:  # Check if iban length is exactly 22 characters
             raise ValueError(f"iban must be exactly 22 characters long.")
-
-        # Check if IBAN already exists in the database
-        check_iban_exists(iban)
+        # Uniqueness is checked by the unique index on iban (see create_account)
 
         self.title = title
         self.iban = iban
@@ -48,23 +54,35 @@ class Account(Base):
     def __repr__(self):
         return f"[Account] iban: {self.iban}, title: {self.title}"
 
-def limit_accounts(mapper, connection, target):
-    accounts_count = db_session.query(Account).count()
-    if accounts_count >= 5:
-        raise AccountLimitException("Cannot add more than 5 accounts.")
+class AccountDeletion(Base):
+    '''Deleted account whose history is still being purged; the account row is deleted afterwards (see project/accounts/purge.py).'''
+    __tablename__ = "account_deletions"
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), primary_key = True)
+    utc_datetime_requested = Column(DateTime, nullable=False)
 
-event.listen(Account, 'before_insert', limit_accounts)
+# The account search matches titles case-insensitively by their lower-cased prefix (see project/queries.py)
+ACCOUNT_TITLE_LOWER_INDEX = Index("ix_accounts_title_lower", func.lower(Account.title))
+
+# Read-only view of a transaction row, returned by Transaction.read_all(..., as_rows=True). A plain tuple
+# without identity map entry or change tracking, for listings (accounts.show, CSV export, JSON).
+TransactionRow = namedtuple("TransactionRow", ["id", "description", "amount", "saldo", "category", "utc_datetime_booked", "account_id"])
+
+def transaction_row(transaction):
+    '''TransactionRow view of a Transaction instance, e.g. to keep its values beyond a commit.'''
+    return TransactionRow(transaction.id, transaction.description, transaction.amount, transaction.saldo,
+                          transaction.category, transaction.utc_datetime_booked, transaction.account_id)
 
 class Transaction(Base):
 
     __tablename__ = "transactions"
+    __shard_key__ = "account_id" # See project/sharding.py
     id = Column(Integer, primary_key = True)
     description = Column(String(80), index = True)
-    amount = Column(Numeric(precision=10, scale=2), nullable=False, index = False, unique = False)
-    saldo = Column(Numeric(precision=10, scale=2), nullable=True, index = False, unique = False)
+    amount = Column(Money(), nullable=False, index = False, unique = False)
+    saldo = Column(Money(), nullable=True, index = False, unique = False)
     category = Column(String(20), nullable=False)
     utc_datetime_booked = Column(DateTime, nullable=False)
-    account_id = Column(Integer, ForeignKey('accounts.id'), nullable=False)
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete="CASCADE"), nullable=False)
 
     def __init__(self, description, amount, category, utc_datetime_booked=None): # No account_id validation because it happens on db level
         if not isinstance(description, str) or (len(description.strip()) > 80 or len(description.strip()) == 0):
@@ -72,10 +90,11 @@ class Transaction(Base):
         else:
             self.description = description.strip()
 
-        if not isinstance(amount, (int, float, decimal.Decimal)) or amount == 0:
+        # Rounded to cents without binary float artefacts (project/money.py), amounts that round to 0 are rejected
+        if not isinstance(amount, (int, float, decimal.Decimal)) or to_amount(amount) == 0:
             raise ValueError("The amount variable must be non-zero decimal, integer or float.")
         else:
-            self.amount = decimal.Decimal(amount)
+            self.amount = to_amount(amount)
 
         if category not in ["Transfer", "Salary", "Rent", "Utilities", "Groceries", "Night out", "Online services"]:
             raise ValueError("Invalid category value.")
@@ -95,13 +114,12 @@ class Transaction(Base):
     def __repr__(self):
         return "[{}] description: '{}', category: {}, amount: {:.2f}, saldo: {}".format(self.utc_datetime_booked, self.description, self.category, self.amount, self.saldo)
 
+    @traced("Transaction.calculate_saldo")
     def calculate_saldo(self):
         try:
             # Calculate the saldo by summing up the "amount" of older transactions
-            saldo_previous_transactions = db_session.query(func.sum(Transaction.amount)).filter(
-                Transaction.utc_datetime_booked < self.utc_datetime_booked,
-                Transaction.account_id == self.account_id
-            ).scalar()
+            from project.queries import saldo_before
+            saldo_previous_transactions = saldo_before(self.account_id, self.utc_datetime_booked)
 
             # If there are no older transactions, saldo is the same as the current transaction's amount
             if saldo_previous_transactions is None:
@@ -110,17 +128,35 @@ class Transaction(Base):
                 self.saldo = saldo_previous_transactions + self.amount
 
             # Update the "saldo" column in the current transaction instance
-            self.saldo = round(self.saldo, 2)
+            self.saldo = saldo = round(self.saldo, 2)
 
             db_session.add(self)
             db_session.commit()
+            return saldo
 
         except Exception as e:
             db_session.rollback()  # Rollback in case of errors to keep the DB in a consistent state
             raise e
 
     @classmethod
-    def read_all(cls, account_id, start_date = None, end_date = None, category = None, search_type = None, transaction_description = None):
+    def latest_saldos(cls):
+        '''Returns {account_id: saldo} of the most recent transaction of every account (single query).'''
+        latest = db_session.query(
+            Transaction.account_id,
+            func.max(Transaction.utc_datetime_booked).label("utc_datetime_booked")
+        ).group_by(Transaction.account_id).subquery()
+
+        rows = db_session.query(Transaction.account_id, Transaction.saldo).join(
+            latest,
+            and_(Transaction.account_id == latest.c.account_id,
+                 Transaction.utc_datetime_booked == latest.c.utc_datetime_booked)
+        ).all()
+        return {account_id: saldo for account_id, saldo in rows}
+
+    @classmethod
+    @traced("Transaction.read_all")
+    def read_all(cls, account_id, start_date = None, end_date = None, category = None, search_type = None, transaction_description = None, as_rows = False):
+        '''Transactions of the account matching the filters, newest first. With as_rows, TransactionRow views instead of Transaction instances.'''
 
         # Check input parameters
         if account_id is None:
@@ -138,29 +174,27 @@ class Transaction(Base):
 
         # print(f"[Filter] account_id: {account_id}, start: {start_date}, end: {end_date}, search type: {search_type}, description: {transaction_description}, category: {category}")
 
-        # Query database for description & account id
-        if transaction_description != None and transaction_description != "":
-            if search_type == "Matches":
-                transactions = Transaction.query.filter(Transaction.description == transaction_description, Transaction.account_id==account_id).all()
-                # transactions = Transaction.query.filter(Transaction.description == transaction_description).all()
-            else:
-                transactions = Transaction.query.filter(Transaction.account_id==account_id, Transaction.description.ilike("%{}%".format(transaction_description))).all()
-        else:
-            transactions = Transaction.query.filter(Transaction.account_id==account_id).order_by(desc(Transaction.utc_datetime_booked)).all()
-
-        # Filter results for dates
-        if start_date != None and end_date != None:
-            start_date = start_date
-            end_date = end_date
-            filtered_transactions = [transaction for transaction in transactions if (transaction.utc_datetime_booked.date() >= start_date and transaction.utc_datetime_booked.date() <= end_date)]
-        elif start_date != None:
-            start_date = start_date
-            filtered_transactions = [transaction for transaction in transactions if transaction.utc_datetime_booked.date() >= start_date]
-        elif end_date != None:
-            end_date = end_date
-            filtered_transactions = [transaction for transaction in transactions if transaction.utc_datetime_booked.date() <= end_date]
-        else:
-            filtered_transactions = transactions
+        # Booking date bounds are part of the query, so partitioned tables only read the partitions of the range
+        from project.queries import account_transactions
+        filters = {
+            "booked_from": datetime.combine(start_date, time.min) if start_date != None else None,
+            "booked_before": datetime.combine(end_date + timedelta(days=1), time.min) if end_date != None else None,
+            "description": transaction_description,
+            "exact_description": search_type == "Matches",
+        }
+
+        from project.partitioning import transactions_source
+        source = transactions_source(start_date, end_date)
+        filtered_transactions = account_transactions(source, account_id, as_rows=as_rows, **filters) if source is not None else []
+
+        # Archived transactions are read as well if the date filter reaches back into archived periods. The
+        # opening balance is left out then, the archived transactions it sums up are part of the result.
+        from project.archive import reaches_into_archive
+        if reaches_into_archive(account_id, start_date, end_date):
+            archived = [transaction for transaction in account_transactions(ArchivedTransaction, account_id, as_rows=as_rows, **filters) if transaction.category != OPENING_BALANCE_CATEGORY]
+            if archived:
+                filtered_transactions = [transaction for transaction in filtered_transactions if transaction.category != OPENING_BALANCE_CATEGORY]
+                filtered_transactions += archived if as_rows else [transaction.to_transaction() for transaction in archived]
 
         # Filter results for category
         if category != None:
@@ -177,11 +211,13 @@ class Transaction(Base):
             raise TypeError("Input transactions must be a list.")
 
         for transaction in transactions:
-            if not isinstance(transaction, cls):
+            if not isinstance(transaction, (cls, TransactionRow)):
                 raise TypeError("Input transactions must be a list of Transaction objects.")
 
         data = {}
         for transaction in transactions:
+            if transaction.category == OPENING_BALANCE_CATEGORY: # Neither income nor expense
+                continue
 
             if transaction.utc_datetime_booked.year not in data.keys():
                 data[transaction.utc_datetime_booked.year] = {}
@@ -194,3 +230,86 @@ class Transaction(Base):
             data[transaction.utc_datetime_booked.year][transaction.utc_datetime_booked.month]["total"] += transaction.amount
 
         return data
+
+
+class ArchivedTransaction(Base):
+    '''Transaction moved out of the transactions table by the archival job (see project/archive.py).'''
+    __tablename__ = "archived_transactions"
+    __shard_key__ = "account_id"
+    __table_args__ = (Index("ix_archived_transactions_account_id_utc_datetime_booked", "account_id", "utc_datetime_booked"),)
+    id = Column(Integer, primary_key = True, autoincrement = False) # Id of the transaction
+    description = Column(String(80))
+    amount = Column(Money(), nullable=False)
+    saldo = Column(Money(), nullable=True)
+    category = Column(String(20), nullable=False)
+    utc_datetime_booked = Column(DateTime, nullable=False)
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete="CASCADE"), nullable=False)
+
+    def to_transaction(self):
+        '''Transaction (not added to the session) with the values of the archived one, as returned by read_all.'''
+        transaction = Transaction.__mapper__.class_manager.new_instance()
+        for column in Transaction.__table__.columns:
+            setattr(transaction, column.name, getattr(self, column.name))
+        return transaction
+
+    def __repr__(self):
+        return f"[ArchivedTransaction] id: {self.id}, booked: {self.utc_datetime_booked}, amount: {self.amount}"
+
+
+class IdempotencyKey(Base):
+    '''Response of an API write, stored under the Idempotency-Key header sent by the client (see project/idempotency.py).'''
+    __tablename__ = "idempotency_keys"
+    key = Column(String(255), primary_key = True)
+    request_fingerprint = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=True) # None while the request is being processed
+    response_body = Column(Text, nullable=True)
+    utc_datetime_created = Column(DateTime, nullable=False, index = True)
+
+    def __repr__(self):
+        return f"[IdempotencyKey] key: {self.key}, status_code: {self.status_code}"
+
+
+## Sharding (see project/sharding.py)
+class TransferOutbox(Base):
+    '''Recipient side of a transfer between accounts on different shards, stored on the sender's shard.'''
+    __tablename__ = "transfer_outbox"
+    __shard_key__ = "account_id"
+    id = Column(String(36), primary_key = True)
+    account_id = Column(Integer, nullable=False) # Sender
+    recipient_account_id = Column(Integer, nullable=False)
+    description = Column(String(80), nullable=False)
+    amount = Column(Money(), nullable=False)
+    utc_datetime_booked = Column(DateTime, nullable=False)
+    utc_datetime_delivered = Column(DateTime, nullable=True, index = True)
+
+class AppliedTransfer(Base):
+    '''Outbox messages already booked on the recipient's shard, so redelivery does not book them twice.'''
+    __tablename__ = "applied_transfers"
+    __shard_key__ = "account_id"
+    transfer_id = Column(String(36), primary_key = True)
+    account_id = Column(Integer, nullable=False) # Recipient
+    transaction_id = Column(Integer, nullable=False)
+
+class IdBlock(Base):
+    '''Next free id of a sharded table; ids are handed out in blocks so they are unique across shards.'''
+    __tablename__ = "id_blocks"
+    name = Column(String(50), primary_key = True)
+    next_id = Column(Integer, nullable=False)
+
+class CacheVersion(Base):
+    '''Version stamp of data cached by every worker process, bumped by each write (see project/accounts/cache.py).'''
+    __tablename__ = "cache_versions"
+    name = Column(String(50), primary_key = True)
+    version = Column(Integer, nullable=False)
+
+class ArchiveBoundary(Base):
+    '''Transactions booked before utc_datetime_before were archived (one row per database, see project/archive.py).'''
+    __tablename__ = "archive_boundaries"
+    name = Column(String(50), primary_key = True)
+    utc_datetime_before = Column(DateTime, nullable=False)
+
+class DatabaseSetting(Base):
+    '''Setting of the data in one database, e.g. "amount_storage" (see project/money.py).'''
+    __tablename__ = "database_settings"
+    name = Column(String(50), primary_key = True)
+    value = Column(String(50), nullable=False)
@@ -0,0 +1,143 @@
+'''
+Money amounts (the amount and saldo columns).
+
+In Python, amounts are decimal.Decimal with two places. The database stores them as NUMERIC(10, 2) by default,
+or as BIGINT cents with AMOUNT_STORAGE=cents: integers are exact in every database, and SUMs and saldo shifts
+(saldo = saldo + delta) become integer arithmetic. The Money column type converts at the database boundary,
+to_amount() converts the amounts of forms and JSON bodies (floats) without binary float artefacts.
+
+Existing databases are converted with `flask convert-amounts cents` (or back with `decimal`) while the app is
+stopped, before AMOUNT_STORAGE is changed. Databases already in the target storage are skipped, so a repeated run
+does not scale the amounts again: on Postgres the column type tells the storage, on SQLite (whose column types
+are only affinities) the "amount_storage" row of database_settings, recorded by init-db and every conversion.
+'''
+from decimal import Decimal, ROUND_HALF_UP
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import BigInteger, Integer, Numeric, inspect, select, insert, update
+from sqlalchemy.types import TypeDecorator
+
+STORAGES = ("decimal", "cents")
+CENT = Decimal("0.01")
+
+
+## Conversion
+def to_amount(value):
+    '''Decimal with two places (rounded half up) of an int, float, str or Decimal amount.'''
+    if isinstance(value, float):
+        value = repr(value) # Shortest representation: 0.1 becomes Decimal("0.1"), not 0.1000000000000000055...
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+def stores_cents(dialect):
+    '''Whether the engine of dialect stores amounts as cents, see create_configured_engine() in project/db.py.'''
+    return getattr(dialect, "amounts_in_cents", False)
+
+
+class Money(TypeDecorator):
+    '''NUMERIC(10, 2) or BIGINT cents, depending on the engine; Decimal with two places in Python.'''
+    impl = Numeric(precision=10, scale=2)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if stores_cents(dialect):
+            return dialect.type_descriptor(BigInteger())
+        return dialect.type_descriptor(Numeric(precision=10, scale=2))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        amount = to_amount(value)
+        return int(amount.scaleb(2)) if stores_cents(dialect) else amount
+
+    def process_result_value(self, value, dialect):
+        if value is None or not stores_cents(dialect):
+            return value
+        return Decimal(value).scaleb(-2)
+
+
+## Migration
+MONEY_COLUMNS = {
+    "transactions": ["amount", "saldo"],
+    "archived_transactions": ["amount", "saldo"],
+    "transfer_outbox": ["amount"],
+}
+
+STORAGE_SETTING = "amount_storage"
+
+def configured_storage(connection):
+    return "cents" if stores_cents(connection.dialect) else "decimal"
+
+def current_storage(connection):
+    '''Storage ("cents" or "decimal") of the amounts in the database of connection.'''
+    from project.models import DatabaseSetting
+    if connection.dialect.name == "postgresql":
+        amount = next(column for column in inspect(connection).get_columns("transactions") if column["name"] == "amount")
+        return "cents" if isinstance(amount["type"], Integer) else "decimal"
+    recorded = connection.execute(select(DatabaseSetting.value).where(DatabaseSetting.name == STORAGE_SETTING)).scalar()
+    return recorded or configured_storage(connection) # Databases from before the setting was recorded
+
+def record_amount_storage(connection, storage=None):
+    '''Records storage (default: the current one) as the amount storage of the database of connection.'''
+    from project.models import DatabaseSetting
+    settings = DatabaseSetting.__table__
+    storage = storage or current_storage(connection)
+    if connection.execute(update(settings).where(settings.c.name == STORAGE_SETTING).values(value=storage)).rowcount == 0:
+        connection.execute(insert(settings).values(name=STORAGE_SETTING, value=storage))
+
+def conversion_statements(connection, storage):
+    '''Statements converting the money columns of one database to storage ("cents" or "decimal").'''
+    dialect = connection.dialect.name
+    statements = []
+    for table in sorted(inspect(connection).get_table_names()):
+        # Month tables of partitioned SQLite databases (project/partitioning.py) are converted like transactions,
+        # Postgres partitions follow the column types of their parent table
+        base = "transactions" if table.startswith("transactions_p") and dialect == "sqlite" else table
+        for column in MONEY_COLUMNS.get(base, []):
+            if dialect == "postgresql":
+                if storage == "cents":
+                    statements.append(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT USING ROUND({column} * 100)::BIGINT")
+                else:
+                    statements.append(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE NUMERIC(10, 2) USING {column} / 100.0")
+            elif dialect == "sqlite":
+                # Column types of SQLite are only affinities, the values are converted in place
+                if storage == "cents":
+                    statements.append(f"UPDATE {table} SET {column} = CAST(ROUND({column} * 100) AS INTEGER)")
+                else:
+                    statements.append(f"UPDATE {table} SET {column} = ROUND({column} / 100.0, 2)")
+            else:
+                raise click.UsageError(f"Converting amounts is not supported for {dialect}.")
+    return statements
+
+def convert_amounts(storage):
+    '''
+    Converts the money columns of every shard to storage, one database transaction per shard. Shards already
+    in storage are skipped. Returns the number of statements.
+    '''
+    from project.db import get_shard_engine, shard_ids
+    if storage not in STORAGES:
+        raise ValueError(f"Unsupported amount storage {storage!r}, use one of {', '.join(STORAGES)}.")
+
+    count = 0
+    for shard_id in shard_ids():
+        with get_shard_engine(shard_id).begin() as connection:
+            if current_storage(connection) == storage:
+                continue
+            for statement in conversion_statements(connection, storage):
+                connection.exec_driver_sql(statement)
+                count += 1
+            record_amount_storage(connection, storage)
+    return count
+
+
+## CLI
+@click.command("convert-amounts")
+@click.argument("storage", type=click.Choice(STORAGES))
+@with_appcontext
+def convert_amounts_command(storage):
+    '''Convert the stored amounts and saldos to STORAGE (run once, then set AMOUNT_STORAGE accordingly).'''
+    count = convert_amounts(storage)
+    if count == 0:
+        click.echo(f"Amounts are already stored as {storage}, nothing was converted.")
+    else:
+        click.echo(f"Converted amounts to {storage} ({count} columns). Set AMOUNT_STORAGE={storage} and restart the app.")
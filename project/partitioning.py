@@ -0,0 +1,354 @@
+'''
+Monthly partitioning of transactions by utc_datetime_booked (opt-in via TRANSACTION_PARTITIONING=monthly).
+
+- Postgres: `transactions` is a natively partitioned table (PARTITION BY RANGE) with one partition per
+  month, e.g. transactions_p202309. Queries bounded by utc_datetime_booked are pruned by the planner.
+- SQLite has no partitioning. Every month is stored in its own table and `transactions` becomes a
+  UNION ALL view of them, whose INSTEAD OF triggers route inserts, updates and deletes to the table of
+  the booking month. Date-bounded reads (Transaction.read_all) select from the overlapping month tables
+  only, see transactions_source(). Transaction ids are unique across the month tables (see project/ids.py).
+
+Partitions are created automatically: by `flask init-db` (which also converts an existing unpartitioned
+table), for the booking month of every flushed transaction and by `flask create-partitions` (e.g. from a
+daily cron job) for the next PARTITION_MONTHS_AHEAD months.
+'''
+import threading
+from datetime import datetime
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import with_appcontext
+from sqlalchemy import MetaData, Table, Column, ForeignKey, Index, event, select, union_all
+from sqlalchemy.orm import aliased
+from sqlalchemy.schema import CreateTable, CreateIndex
+
+from project.db import LazySession, db_session, is_partitioned, is_sharded, get_shard_engine, shard_ids
+from project.models import Transaction, IdBlock
+
+PARENT_TABLE = Transaction.__tablename__
+UNPARTITIONED_TABLE = f"{PARENT_TABLE}_unpartitioned"
+COLUMNS = [column.name for column in Transaction.__table__.columns]
+CREATED_PARTITIONS_KEY = "created_partitions"
+DEFAULT_MONTHS_AHEAD = 3
+
+class PartitioningError(Exception):
+    pass
+
+
+## Months
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def months_between(first, last):
+    '''Starts of all months from the month of `first` up to (including) the month of `last`.'''
+    months, month = [], month_start(first)
+    while month <= last:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+def partition_name(month):
+    return f"{PARENT_TABLE}_p{month:%Y%m}"
+
+def partition_month(name):
+    return datetime.strptime(name[len(PARENT_TABLE) + 2:], "%Y%m")
+
+def as_datetime(value):
+    '''SQLite returns datetimes of raw SQL as strings.'''
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+## Schema
+_partition_metadata = MetaData()
+_metadata_lock = threading.Lock()
+
+def partition_table(name):
+    '''Table of one month on SQLite: the columns and indexes of transactions (no foreign key, like the view).'''
+    with _metadata_lock:
+        if name not in _partition_metadata.tables:
+            Table(name, _partition_metadata,
+                  *[Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable) for column in Transaction.__table__.columns],
+                  Index(f"ix_{name}_description", "description"),
+                  Index(f"ix_{name}_account_id_utc_datetime_booked", "account_id", "utc_datetime_booked"))
+        return _partition_metadata.tables[name]
+
+def postgres_parent_table():
+    '''transactions as partitioned table; the partition key has to be part of the primary key.'''
+    columns = [Column(column.name, column.type, *[ForeignKey(foreign_key.column, ondelete=foreign_key.ondelete) for foreign_key in column.foreign_keys],
+                      primary_key=column.primary_key or column.name == "utc_datetime_booked",
+                      nullable=column.nullable, autoincrement=column.name == "id")
+               for column in Transaction.__table__.columns]
+    return Table(PARENT_TABLE, MetaData(), *columns,
+                 Index(f"ix_{PARENT_TABLE}_description", "description"),
+                 Index(f"ix_{PARENT_TABLE}_account_id_utc_datetime_booked", "account_id", "utc_datetime_booked"),
+                 postgresql_partition_by="RANGE (utc_datetime_booked)")
+
+def postgres_partition_ddl(month):
+    return (f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {PARENT_TABLE} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')")
+
+def sqlite_view_ddl(names):
+    '''The transactions view and the triggers routing writes to the month tables.'''
+    columns = ", ".join(COLUMNS)
+    new_values = ", ".join(f"NEW.{column}" for column in COLUMNS)
+    other_columns = [column for column in COLUMNS if column != "id"]
+    if names:
+        selects = " UNION ALL ".join(f"SELECT {columns} FROM {name}" for name in names)
+    else:
+        selects = f"SELECT {', '.join(f'NULL AS {column}' for column in COLUMNS)} LIMIT 0"
+    months = ", ".join(f"'{partition_month(name):%Y-%m}'" for name in names)
+    booked_month = lambda row: f"substr({row}.utc_datetime_booked, 1, 7)"
+
+    statements = [f"CREATE VIEW {PARENT_TABLE} AS {selects}"]
+    for name in names:
+        month = f"'{partition_month(name):%Y-%m}'"
+        # Rows inserted without id (e.g. by `flask seed`) take the next one of the id_blocks counter
+        statements.append(
+            f"CREATE TRIGGER {name}_insert INSTEAD OF INSERT ON {PARENT_TABLE} WHEN {booked_month('NEW')} = {month} BEGIN "
+            f"INSERT INTO {name} (id, {', '.join(other_columns)}) "
+            f"VALUES (COALESCE(NEW.id, (SELECT next_id FROM {IdBlock.__tablename__} WHERE name = '{PARENT_TABLE}')), "
+            f"{', '.join(f'NEW.{column}' for column in other_columns)}); "
+            f"UPDATE {IdBlock.__tablename__} SET next_id = next_id + 1 WHERE name = '{PARENT_TABLE}' AND NEW.id IS NULL; END")
+        statements.append(
+            f"CREATE TRIGGER {name}_update INSTEAD OF UPDATE ON {PARENT_TABLE} "
+            f"WHEN {booked_month('OLD')} = {month} AND {booked_month('NEW')} = {month} BEGIN "
+            f"UPDATE {name} SET {', '.join(f'{column} = NEW.{column}' for column in COLUMNS)} WHERE id = OLD.id; END")
+        statements.append(
+            f"CREATE TRIGGER {name}_delete INSTEAD OF DELETE ON {PARENT_TABLE} WHEN {booked_month('OLD')} = {month} BEGIN "
+            f"DELETE FROM {name} WHERE id = OLD.id; END")
+    statements.append(
+        f"CREATE TRIGGER {PARENT_TABLE}_insert_without_partition INSTEAD OF INSERT ON {PARENT_TABLE} "
+        f"WHEN {booked_month('NEW')} NOT IN ({months}) BEGIN "
+        f"SELECT RAISE(ABORT, 'No partition of {PARENT_TABLE} for the booking month'); END")
+    # A booking moved to another month is deleted from its old table and inserted into the new one
+    statements.append(
+        f"CREATE TRIGGER {PARENT_TABLE}_update_month INSTEAD OF UPDATE ON {PARENT_TABLE} "
+        f"WHEN {booked_month('OLD')} != {booked_month('NEW')} BEGIN "
+        f"DELETE FROM {PARENT_TABLE} WHERE id = OLD.id; "
+        f"INSERT INTO {PARENT_TABLE} ({columns}) VALUES ({new_values}); END")
+    return statements
+
+def sqlite_partitions(connection):
+    '''Names of the month tables, oldest first.'''
+    return connection.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ? ORDER BY name",
+        (f"{PARENT_TABLE}_p[0-9][0-9][0-9][0-9][0-9][0-9]",)
+    ).scalars().all()
+
+def rebuild_sqlite_view(connection, names):
+    connection.exec_driver_sql(f"DROP VIEW IF EXISTS {PARENT_TABLE}") # Drops its triggers as well
+    for statement in sqlite_view_ddl(sorted(names)):
+        connection.exec_driver_sql(statement)
+
+
+## Partition creation
+def ensure_partitions(connection, months):
+    '''Creates the partitions of the given months that do not exist yet.'''
+    months = sorted({month_start(month) for month in months})
+    if connection.dialect.name == "postgresql":
+        for month in months:
+            connection.exec_driver_sql(postgres_partition_ddl(month))
+    elif connection.dialect.name == "sqlite":
+        existing = sqlite_partitions(connection)
+        missing = [partition_name(month) for month in months if partition_name(month) not in existing]
+        for name in missing:
+            partition_table(name).create(connection)
+        if missing:
+            rebuild_sqlite_view(connection, existing + missing)
+    else:
+        raise PartitioningError(f"Partitioning is not supported for {connection.dialect.name}.")
+
+def upcoming_months(months_ahead):
+    return months_between(datetime.utcnow(), add_months(month_start(datetime.utcnow()), months_ahead))
+
+def init_partitions(engine, months_ahead=None):
+    '''
+    Partitions transactions on one database: creates the partitions of the current and the next months and
+    moves the rows of an existing unpartitioned transactions table into partitions.
+    '''
+    if months_ahead is None:
+        months_ahead = current_app.config.get("PARTITION_MONTHS_AHEAD", DEFAULT_MONTHS_AHEAD) if has_app_context() else DEFAULT_MONTHS_AHEAD
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            init_postgres_partitions(connection, upcoming_months(months_ahead))
+        elif connection.dialect.name == "sqlite":
+            init_sqlite_partitions(connection, upcoming_months(months_ahead))
+        else:
+            raise PartitioningError(f"Partitioning is not supported for {connection.dialect.name}.")
+
+def booked_months(connection, table_name):
+    first, last = connection.exec_driver_sql(f"SELECT MIN(utc_datetime_booked), MAX(utc_datetime_booked) FROM {table_name}").one()
+    return months_between(as_datetime(first), as_datetime(last)) if first is not None else []
+
+def init_postgres_partitions(connection, months):
+    kind = connection.exec_driver_sql(f"SELECT relkind FROM pg_class WHERE oid = to_regclass('{PARENT_TABLE}')").scalar()
+    if kind == "p":
+        ensure_partitions(connection, months)
+        return
+
+    if kind is not None:
+        # Index, constraint and sequence names of the old table are freed for the partitioned one
+        connection.exec_driver_sql(f"ALTER TABLE {PARENT_TABLE} RENAME TO {UNPARTITIONED_TABLE}")
+        for index_name in connection.exec_driver_sql(f"SELECT indexname FROM pg_indexes WHERE tablename = '{UNPARTITIONED_TABLE}'").scalars().all():
+            connection.exec_driver_sql(f'ALTER INDEX "{index_name}" RENAME TO "{index_name}_unpartitioned"')
+        for constraint_name in connection.exec_driver_sql(f"SELECT conname FROM pg_constraint WHERE conrelid = '{UNPARTITIONED_TABLE}'::regclass AND contype = 'f'").scalars().all():
+            connection.exec_driver_sql(f'ALTER TABLE {UNPARTITIONED_TABLE} RENAME CONSTRAINT "{constraint_name}" TO "{constraint_name}_unpartitioned"')
+        sequence = connection.exec_driver_sql(f"SELECT pg_get_serial_sequence('{UNPARTITIONED_TABLE}', 'id')").scalar()
+        if sequence is not None:
+            connection.exec_driver_sql(f"ALTER SEQUENCE {sequence} RENAME TO {UNPARTITIONED_TABLE}_id_seq")
+        months = months + booked_months(connection, UNPARTITIONED_TABLE)
+
+    parent = postgres_parent_table()
+    connection.execute(CreateTable(parent))
+    for index in parent.indexes:
+        connection.execute(CreateIndex(index))
+    ensure_partitions(connection, months)
+
+    if kind is not None:
+        columns = ", ".join(COLUMNS)
+        connection.exec_driver_sql(f"INSERT INTO {PARENT_TABLE} ({columns}) SELECT {columns} FROM {UNPARTITIONED_TABLE}")
+        connection.exec_driver_sql(f"SELECT setval(pg_get_serial_sequence('{PARENT_TABLE}', 'id'), COALESCE((SELECT MAX(id) FROM {PARENT_TABLE}), 0) + 1, false)")
+        connection.exec_driver_sql(f"DROP TABLE {UNPARTITIONED_TABLE}")
+
+def init_sqlite_partitions(connection, months):
+    kind = connection.exec_driver_sql(f"SELECT type FROM sqlite_master WHERE name = '{PARENT_TABLE}'").scalar()
+    if kind == "view":
+        ensure_partitions(connection, months)
+        return
+
+    if kind is not None:
+        connection.exec_driver_sql(f"ALTER TABLE {PARENT_TABLE} RENAME TO {UNPARTITIONED_TABLE}")
+        months = months + booked_months(connection, UNPARTITIONED_TABLE)
+
+    # Counter of the ids of rows inserted without one, shared with IdAllocator
+    IdBlock.__table__.create(connection, checkfirst=True)
+    next_id = connection.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {UNPARTITIONED_TABLE}").scalar() if kind is not None else 1
+    connection.exec_driver_sql(f"INSERT OR IGNORE INTO {IdBlock.__tablename__} (name, next_id) VALUES (?, ?)", (PARENT_TABLE, next_id))
+
+    for month in sorted(set(months)):
+        partition_table(partition_name(month)).create(connection, checkfirst=True)
+    rebuild_sqlite_view(connection, sqlite_partitions(connection))
+
+    if kind is not None:
+        columns = ", ".join(COLUMNS)
+        connection.exec_driver_sql(f"INSERT INTO {PARENT_TABLE} ({columns}) SELECT {columns} FROM {UNPARTITIONED_TABLE}")
+        connection.exec_driver_sql(f"DROP TABLE {UNPARTITIONED_TABLE}")
+
+def drop_empty_partitions(connection, before):
+    '''Drops the empty partitions of months that ended before `before` (e.g. after archiving them).'''
+    if connection.dialect.name == "postgresql":
+        names = connection.exec_driver_sql(
+            f"SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = '{PARENT_TABLE}'::regclass"
+        ).scalars().all()
+    else:
+        names = sqlite_partitions(connection)
+
+    dropped = [name for name in names
+               if add_months(partition_month(name), 1) <= before
+               and connection.exec_driver_sql(f"SELECT NOT EXISTS (SELECT 1 FROM {name})").scalar()]
+    for name in dropped:
+        connection.exec_driver_sql(f"DROP TABLE {name}")
+    if dropped and connection.dialect.name == "sqlite":
+        rebuild_sqlite_view(connection, [name for name in names if name not in dropped])
+    return dropped
+
+def clear_partitions(connection):
+    '''Deletes all transactions (on SQLite directly from the month tables instead of row by row through the view).'''
+    if connection.dialect.name == "sqlite":
+        for name in sqlite_partitions(connection):
+            connection.exec_driver_sql(f"DELETE FROM {name}")
+    else:
+        connection.exec_driver_sql(f"DELETE FROM {PARENT_TABLE}")
+
+
+## Session
+# Partitions known to exist, per database url (only added after the creating transaction committed)
+_known_partitions = {}
+
+@event.listens_for(LazySession, "before_flush")
+def create_booking_month_partitions(session, flush_context, instances):
+    '''Creates missing partitions for the booking months of new (or rebooked) transactions in the flush's transaction.'''
+    if not is_partitioned():
+        return
+
+    months_by_connection = {}
+    for instance in list(session.new) + list(session.dirty):
+        if isinstance(instance, Transaction) and instance.utc_datetime_booked is not None:
+            connection = session.connection(bind_arguments={"mapper": Transaction.__mapper__, "instance": instance})
+            months_by_connection.setdefault(connection, set()).add(month_start(instance.utc_datetime_booked))
+
+    created = session.info.setdefault(CREATED_PARTITIONS_KEY, {})
+    for connection, months in months_by_connection.items():
+        url = str(connection.engine.url)
+        missing = months - _known_partitions.get(url, set()) - created.get(url, set())
+        if missing:
+            ensure_partitions(connection, missing)
+            created.setdefault(url, set()).update(missing)
+
+@event.listens_for(LazySession, "before_flush")
+def assign_partitioned_transaction_ids(session, flush_context, instances):
+    '''SQLite does not report the ids of rows inserted through the view's triggers, so they are assigned upfront.'''
+    if not is_partitioned() or is_sharded():
+        return
+    new_transactions = [instance for instance in session.new if isinstance(instance, Transaction) and instance.id is None]
+    if new_transactions and session.get_bind(Transaction.__mapper__).dialect.name == "sqlite":
+        from project.sharding import transaction_ids
+        for transaction in new_transactions:
+            transaction.id = transaction_ids.next_id()
+
+@event.listens_for(LazySession, "after_commit")
+def remember_created_partitions(session):
+    for url, months in session.info.pop(CREATED_PARTITIONS_KEY, {}).items():
+        _known_partitions.setdefault(url, set()).update(months)
+
+@event.listens_for(LazySession, "after_rollback")
+def forget_created_partitions(session):
+    session.info.pop(CREATED_PARTITIONS_KEY, None)
+
+def forget_known_partitions():
+    _known_partitions.clear()
+
+
+## Reads
+def transactions_source(start_date=None, end_date=None):
+    '''
+    What to query transactions booked between start_date and end_date (dates, both optional) from:
+    Transaction itself, or on SQLite an alias of the month tables overlapping the range (None if there are none).
+    Postgres prunes the partitions of Transaction queries with bounds on utc_datetime_booked by itself.
+    '''
+    if not is_partitioned() or is_sharded():
+        return Transaction
+
+    connection = db_session.connection(bind_arguments={"mapper": Transaction.__mapper__})
+    if connection.dialect.name != "sqlite":
+        return Transaction
+
+    names = [name for name in sqlite_partitions(connection)
+             if (start_date is None or partition_month(name) >= month_start(start_date))
+             and (end_date is None or partition_month(name) <= month_start(end_date))]
+    if not names:
+        return None
+    if len(names) == 1:
+        source = partition_table(names[0]).alias(PARENT_TABLE)
+    else:
+        source = union_all(*[select(partition_table(name)) for name in names]).subquery(PARENT_TABLE)
+    return aliased(Transaction, source, adapt_on_names=True)
+
+
+## CLI
+@click.command("create-partitions")
+@click.option("--months-ahead", type=click.IntRange(0), help="Number of upcoming months (default: PARTITION_MONTHS_AHEAD).")
+@with_appcontext
+def create_partitions_command(months_ahead):
+    '''Create the transaction partitions of the current and the upcoming months.'''
+    if months_ahead is None:
+        months_ahead = current_app.config["PARTITION_MONTHS_AHEAD"]
+    months = upcoming_months(months_ahead)
+    for shard_id in shard_ids():
+        with get_shard_engine(shard_id).begin() as connection:
+            ensure_partitions(connection, months)
+    click.echo(f"Partitions exist for {months[0]:%Y-%m} to {months[-1]:%Y-%m}.")
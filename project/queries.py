@@ -0,0 +1,133 @@
+'''
+Statements of the hottest queries: account lookups, the IBAN check, the recipient search, the saldo SUM,
+the saldo shift of transaction edits and the listing of Transaction.read_all.
+
+The statements are built once, with named bind parameters for all values, and executed with the values of
+each call. Building a statement and generating its cache key happen once instead of on every call, and its
+SQL is compiled once per engine (compiled cache). As the SQL text never changes, Postgres can keep it as a
+prepared statement (see project/db.py).
+
+Lookups by primary key use Session.get, which finds objects already loaded in the identity map without a
+query and whose load statement the ORM caches itself.
+'''
+from sqlalchemy import select, update, func, bindparam, inspect, or_, and_
+
+from project.db import db_session
+from project.models import Account, AccountDeletion, Transaction, TransactionRow
+
+
+## Accounts
+ACCOUNT_BY_IBAN = select(Account).where(Account.iban == bindparam("iban"))
+IBAN_EXISTS = select(Account.id).where(Account.iban == bindparam("iban")).limit(1)
+
+def get_account(account_id):
+    '''Account by id, None if it does not exist or is being deleted.'''
+    return existing(db_session.get(Account, account_id))
+
+def get_account_by_iban(iban):
+    return existing(db_session.execute(ACCOUNT_BY_IBAN, {"iban": iban}).scalar_one_or_none())
+
+def existing(account):
+    '''None for accounts whose deletion is in progress (see project/accounts/purge.py).'''
+    return account if account is not None and account.deletion is None else None
+
+def iban_exists(iban):
+    return db_session.execute(IBAN_EXISTS, {"iban": iban}).first() is not None
+
+ACCOUNT_COUNT = select(func.count()).select_from(Account).where(~Account.deletion.has())
+
+def account_count():
+    '''Number of accounts, without the ones being deleted.'''
+    return db_session.execute(ACCOUNT_COUNT).scalar()
+
+# Prefixes are matched as ranges (prefix <= value < prefix with its last character incremented), which the
+# indexes on lower(title) and iban serve on SQLite and Postgres alike; LIKE only uses them with special collations
+ACCOUNTS_BY_PREFIX = select(Account.id, Account.title, Account.iban).where(or_(
+    and_(func.lower(Account.title) >= bindparam("title_from"), func.lower(Account.title) < bindparam("title_to")),
+    and_(Account.iban >= bindparam("iban_from"), Account.iban < bindparam("iban_to")),
+)).where(Account.id.not_in(select(AccountDeletion.account_id))).order_by(Account.title, Account.id).limit(bindparam("limit"))
+
+def prefix_range(prefix):
+    '''(prefix, prefix with its last character incremented) of a non-empty prefix.'''
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def search_accounts(prefix, limit):
+    '''
+    (id, title, iban) rows of accounts whose title (case-insensitive) or IBAN (without spaces) starts with
+    prefix. An empty prefix matches no accounts.
+    '''
+    if not prefix:
+        return []
+    title_from, title_to = prefix_range(prefix.lower())
+    iban_from, iban_to = prefix_range(prefix.replace(" ", "").upper() or prefix)
+    return db_session.execute(ACCOUNTS_BY_PREFIX, {"title_from": title_from, "title_to": title_to,
+                                                   "iban_from": iban_from, "iban_to": iban_to, "limit": limit}).all()
+
+
+## Transactions
+SALDO_BEFORE = select(func.sum(Transaction.amount)).where(
+    Transaction.utc_datetime_booked < bindparam("utc_datetime_booked"),
+    Transaction.account_id == bindparam("account_id")
+)
+
+# The saldo of a transaction sums up the amounts of all transactions of the account booked before it, so a changed
+# or deleted amount shifts the saldos of the later ones by the same difference
+SHIFT_LATER_SALDOS = update(Transaction).where(
+    Transaction.account_id == bindparam("shifted_account_id"), # Column names are reserved for the SET clause
+    Transaction.utc_datetime_booked > bindparam("booked_after")
+).values(saldo=Transaction.saldo + bindparam("delta", type_=Transaction.saldo.type)).execution_options(synchronize_session=False)
+
+# Statements of account_transactions by source, as_rows and the filters used
+_account_transactions_statements = {}
+
+def get_transaction(transaction_id):
+    return db_session.get(Transaction, transaction_id)
+
+def saldo_before(account_id, utc_datetime_booked):
+    '''Sum of the amounts of the account's transactions booked before utc_datetime_booked, None if there are none.'''
+    return db_session.execute(SALDO_BEFORE, {"account_id": account_id, "utc_datetime_booked": utc_datetime_booked}).scalar()
+
+def shift_later_saldos(account_id, utc_datetime_booked, delta):
+    '''Adds delta to the saldos of the account's transactions booked after utc_datetime_booked (one UPDATE, not committed).'''
+    db_session.execute(SHIFT_LATER_SALDOS, {"shifted_account_id": account_id, "booked_after": utc_datetime_booked, "delta": delta})
+
+def account_transactions_statement(source, filters, as_rows):
+    # Rows select the columns only: no ORM instances are created for them
+    statement = select(*[getattr(source, field) for field in TransactionRow._fields]) if as_rows else select(source)
+    statement = statement.where(source.account_id == bindparam("account_id"))
+    if "booked_from" in filters:
+        statement = statement.where(source.utc_datetime_booked >= bindparam("booked_from"))
+    if "booked_before" in filters:
+        statement = statement.where(source.utc_datetime_booked < bindparam("booked_before"))
+    if "description" in filters:
+        statement = statement.where(source.description == bindparam("description"))
+    elif "description_pattern" in filters:
+        statement = statement.where(source.description.ilike(bindparam("description_pattern")))
+    return statement.order_by(source.utc_datetime_booked.desc())
+
+def account_transactions(source, account_id, booked_from=None, booked_before=None, description=None, exact_description=False, as_rows=False):
+    '''
+    Transactions of an account, newest first. `source` is the mapped entity to read (Transaction, an alias
+    of it or ArchivedTransaction), the other filters are optional. With as_rows, TransactionRow views of
+    the rows are returned instead of instances of `source`.
+    '''
+    filters = {"booked_from": booked_from, "booked_before": booked_before}
+    if description and exact_description:
+        filters["description"] = description
+    elif description:
+        filters["description_pattern"] = f"%{description}%"
+    filters = {name: value for name, value in filters.items() if value is not None}
+
+    if inspect(source).is_aliased_class:
+        # Aliases of the SQLite month tables (project/partitioning.py) differ per date range
+        statement = account_transactions_statement(source, filters, as_rows)
+    else:
+        key = (source, as_rows, *sorted(filters))
+        if key not in _account_transactions_statements:
+            _account_transactions_statements[key] = account_transactions_statement(source, filters, as_rows)
+        statement = _account_transactions_statements[key]
+
+    result = db_session.execute(statement, {"account_id": account_id, **filters})
+    if as_rows:
+        return list(map(TransactionRow._make, result.tuples()))
+    return result.scalars().all()
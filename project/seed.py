@@ -0,0 +1,309 @@
+'''
+Bulk data seeding (`flask seed`).
+
+Generates accounts and transactions with realistic amounts and booking days (monthly salary and rent,
+frequent groceries, occasional transfers between accounts), computes every saldo in one pass and
+bulk inserts the rows (executemany, COPY on Postgres with psycopg or psycopg2). The same seed and end date
+always produce the same data.
+'''
+import csv
+import random
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from operator import itemgetter
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import insert, select, delete
+
+from project.money import stores_cents
+
+MAX_SEED_ACCOUNTS = 10000
+ACCOUNT_TITLES = ["Main account", "Savings", "Shared", "Holiday", "Emergency", "Household", "Car", "Business"]
+
+# Relative frequency of each category, "Transfer" rows are generated as sender/recipient pairs
+CATEGORY_WEIGHTS = {
+    "Salary": 3,
+    "Rent": 3,
+    "Utilities": 6,
+    "Online services": 5,
+    "Groceries": 50,
+    "Night out": 20,
+    "Transfer": 13,
+}
+GROCERS = ["Tesco", "Aldi", "Lidl", "EDEKA", "Kroger", "Sainsbury's", "Rewe", "Waitrose"]
+ONLINE_SERVICES = ["Spotify", "Netflix", "Amazon Prime", "Disney+", "iCloud", "Dropbox", "Audible"]
+UTILITIES = ["Electric bill", "Water bill", "Gas bill", "Utility Bill Payment - Electric", "Internet"]
+INSERT_CHUNK_SIZE = 50000
+
+
+## Data generation
+class TransactionGenerator:
+    '''
+    Deterministic generator of transaction rows for a set of accounts.
+    Booking times are generated as whole seconds since the start of the seeded period (see booking_datetime).
+    '''
+
+    def __init__(self, account_ids, seed=0, months=12, end_date=None):
+        self.account_ids = list(account_ids)
+        self.rng = random.Random(seed)
+        self.end_date = end_date or date.today()
+        self.start = datetime.combine(self.end_date - timedelta(days=round(months * 30.44)), datetime.min.time())
+        self.num_days = (datetime.combine(self.end_date, datetime.min.time()) - self.start).days + 1
+
+        from faker import Faker # Imported here to keep it out of app startup
+        fake = Faker()
+        fake.seed_instance(seed)
+        self.employers = [fake.company()[:60] for _ in range(50)]
+        self.first_names = [fake.first_name() for _ in range(200)]
+        self.venues = [fake.last_name() for _ in range(200)]
+
+        # Every account has a stable income and rent level
+        self.salaries = {account_id: self.rng.randrange(180000, 520000, 500) for account_id in self.account_ids}
+        self.rents = {account_id: self.rng.randrange(45000, 160000, 500) for account_id in self.account_ids}
+        self.employer_of = {account_id: self.rng.choice(self.employers) for account_id in self.account_ids}
+
+        self.categories = list(CATEGORY_WEIGHTS.keys())
+        self.weights = list(CATEGORY_WEIGHTS.values())
+        if len(self.account_ids) < 2:  # Transfers need a recipient
+            self.weights[self.categories.index("Transfer")] = 0
+
+    def booking_datetime(self, offset):
+        '''Converts a generated booking time (seconds since the start of the period) to a naive UTC datetime.'''
+        return self.start + timedelta(seconds=offset)
+
+    def day_offsets(self, first_day=1, last_day=31):
+        '''Offsets (in seconds) of all days in the period whose day of month is between first_day and last_day.'''
+        offsets = [i * 86400 for i in range(self.num_days) if first_day <= (self.start + timedelta(days=i)).day <= last_day]
+        return offsets or [i * 86400 for i in range(self.num_days)]
+
+    def rows(self, num_transactions):
+        '''Returns num_transactions rows as tuples (account_id, description, amount_cents, category, booking_offset).'''
+        rng = self.rng
+        random = rng.random
+        choice = lambda sequence: sequence[int(random() * len(sequence))]  # Faster than Random.choice
+        account_ids, num_accounts = self.account_ids, len(self.account_ids)
+        any_day, salary_days, rent_days, utility_days = self.day_offsets(), self.day_offsets(25, 28), self.day_offsets(1, 5), self.day_offsets(10, 20)
+        month_names = {offset: self.booking_datetime(offset).strftime("%B") for offset in rent_days}
+        transfer_descriptions = ["Savings", "Monthly transfer", "Holiday budget", "Shared expenses", "Top up"]
+
+        rows = []
+        append = rows.append
+        while len(rows) < num_transactions:
+            # Categories are drawn in batches, drawing them one by one dominates generation time
+            for category in rng.choices(self.categories, self.weights, k=num_transactions - len(rows)):
+                account_id = account_ids[int(random() * num_accounts)]
+                seconds = int(random() * 86400)
+
+                if category == "Groceries":
+                    amount = -100 - int(random() ** 3 * 25000)  # Mostly small baskets, a few large ones
+                    booked = choice(any_day) + seconds
+                    description = f"Grocery Store Purchase - {choice(GROCERS)}"
+                elif category == "Night out":
+                    amount = -800 - int(random() * 14200)
+                    booked = choice(any_day) + seconds
+                    description = f"Paypal-{choice(self.first_names)}-Thanks!" if random() < 0.5 else f"{choice(self.venues)}'s Bar"
+                elif category == "Transfer":
+                    if num_transactions - len(rows) < 2:
+                        continue
+                    recipient_id = account_id
+                    while recipient_id == account_id:
+                        recipient_id = account_ids[int(random() * num_accounts)]
+                    amount = 2000 + 500 * int(random() * 196)
+                    booked = choice(any_day) + seconds
+                    description = choice(transfer_descriptions)
+                    append((account_id, description, -amount, category, booked))
+                    append((recipient_id, description, amount, category, booked))
+                    continue
+                elif category == "Salary":
+                    amount = self.salaries[account_id] - 5000 + int(random() * 10000)
+                    booked = choice(salary_days) + seconds
+                    description = f"{self.employer_of[account_id]} salary"
+                elif category == "Rent":
+                    amount = -self.rents[account_id]
+                    day = choice(rent_days)
+                    booked = day + seconds
+                    description = f"Rent {month_names[day]}"
+                elif category == "Utilities":
+                    amount = -2500 - int(random() * 17500)
+                    booked = choice(utility_days) + seconds
+                    description = choice(UTILITIES)
+                else:  # Online services
+                    amount = -choice([499, 799, 999, 1299, 1599])
+                    booked = choice(any_day) + seconds
+                    description = choice(ONLINE_SERVICES)
+
+                append((account_id, description, amount, category, booked))
+        return rows[:num_transactions]
+
+def calculate_saldos(rows):
+    '''
+    Sorts rows by account and booking time (in place) and returns the saldo (in cents) of every row, computed in one pass.
+    Matches Transaction.calculate_saldo: sum of all strictly older amounts of the account plus own amount.
+    '''
+    rows.sort(key=itemgetter(0, 4))
+    saldos = []
+    append = saldos.append
+    current_account = current_booked = None
+    balance = same_time_amounts = 0
+    for account_id, _, amount, _, booked in rows:
+        if account_id != current_account:
+            current_account, current_booked = account_id, None
+            balance = same_time_amounts = 0
+        if booked != current_booked:
+            current_booked = booked
+            balance += same_time_amounts
+            same_time_amounts = 0
+        same_time_amounts += amount
+        append(balance + amount)
+    return saldos
+
+
+## Database
+def datetime_binder(dialect, generator):
+    '''
+    Returns a function converting booking offsets to bound parameter values for the utc_datetime_booked column.
+    Strings are assembled from per-day and per-second lookup tables when the dialect stores datetimes as
+    "<date> <time>" strings (SQLite), which avoids formatting a million datetimes one by one.
+    '''
+    from project.models import Transaction
+
+    process = Transaction.__table__.c.utc_datetime_booked.type.dialect_impl(dialect).bind_processor(dialect)
+    if process is None:
+        return generator.booking_datetime
+
+    sample = datetime(2001, 2, 3, 4, 5, 6)
+    day_part, time_part = process(datetime(2001, 2, 3)), process(datetime(2000, 1, 1, 4, 5, 6))
+    if not isinstance(day_part, str) or process(sample) != day_part[:10] + time_part[10:]:
+        return lambda offset: process(generator.booking_datetime(offset))
+
+    days = [process(generator.booking_datetime(i * 86400))[:10] for i in range(generator.num_days)]
+    times = [process(datetime(2000, 1, 1) + timedelta(seconds=i))[10:] for i in range(86400)]
+    return lambda offset: days[offset // 86400] + times[offset % 86400]
+
+def insert_transactions(connection, generator, rows, saldos):
+    '''Bulk inserts generated rows (executemany, COPY on Postgres with psycopg or psycopg2).'''
+    from project.models import Transaction
+
+    if connection.dialect.name == "postgresql" and connection.dialect.driver in COPY_DRIVERS:
+        copy_transactions(connection, generator, rows, saldos)
+        return
+
+    table = Transaction.__table__
+    statement = insert(table).compile(dialect=connection.dialect, column_keys=["account_id", "description", "amount", "category", "utc_datetime_booked", "saldo"])
+    if not statement.positional:
+        raise NotImplementedError(f"Bulk seeding is not supported for {connection.dialect.name}.")
+    to_datetime = datetime_binder(connection.dialect, generator)
+    to_numeric = table.c.amount.type.dialect_impl(connection.dialect).bind_processor(connection.dialect) or (lambda value: value)
+    if stores_cents(connection.dialect):
+        to_decimal = lambda cents: cents  # Amounts are stored as cents already (project/money.py)
+    elif isinstance(to_numeric(Decimal("0.10")), float):
+        to_decimal = lambda cents: cents / 100  # Same float the dialect would bind, without the Decimal round trip
+    else:
+        to_decimal = lambda cents: to_numeric(Decimal(cents).scaleb(-2))
+    # Amounts repeat a lot (rent, subscriptions, transfers), their bound values are cached
+    amounts = {}
+    def to_amount(cents):
+        if cents not in amounts:
+            amounts[cents] = to_decimal(cents)
+        return amounts[cents]
+
+    keys = ["account_id", "description", "amount", "category", "utc_datetime_booked", "saldo"]
+    reorder = itemgetter(*[keys.index(key) for key in statement.positiontup])
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        params = [
+            reorder((account_id, description, to_amount(amount), category, to_datetime(booked), to_decimal(saldo)))
+            for (account_id, description, amount, category, booked), saldo in zip(rows[i:i + INSERT_CHUNK_SIZE], saldos[i:i + INSERT_CHUNK_SIZE])
+        ]
+        connection.exec_driver_sql(statement.string, params)
+
+# Postgres drivers with COPY ... FROM STDIN, the others (e.g. pg8000) insert with executemany
+COPY_DRIVERS = ("psycopg", "psycopg2")
+COPY_TRANSACTIONS = "COPY transactions (account_id, description, amount, category, utc_datetime_booked, saldo) FROM STDIN WITH (FORMAT csv)"
+
+def copy_transactions(connection, generator, rows, saldos):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    to_decimal = (lambda cents: cents) if stores_cents(connection.dialect) else (lambda cents: Decimal(cents).scaleb(-2))
+    for (account_id, description, amount, category, booked), saldo in zip(rows, saldos):
+        writer.writerow((account_id, description, to_decimal(amount), category, generator.booking_datetime(booked).isoformat(sep=" "), to_decimal(saldo)))
+    buffer.seek(0)
+
+    cursor = connection.connection.cursor()
+    if connection.dialect.driver == "psycopg":
+        # psycopg (3) has no copy_expert(), its COPY is written to
+        with cursor.copy(COPY_TRANSACTIONS) as copy:
+            copy.write(buffer.getvalue())
+    else:
+        cursor.copy_expert(COPY_TRANSACTIONS, buffer)
+
+def seed_database(engine, num_accounts, num_transactions, seed=0, months=12, end_date=None):
+    '''
+    Replaces all accounts and transactions with generated data within one database transaction.
+    Returns the ids of the created accounts.
+    '''
+    from project.models import Account, Transaction, ArchivedTransaction, ArchiveBoundary, AccountDeletion, IdBlock
+
+    if not 1 <= num_accounts <= MAX_SEED_ACCOUNTS:
+        raise ValueError(f"num_accounts must be between 1 and {MAX_SEED_ACCOUNTS}.")
+
+    titles = [ACCOUNT_TITLES[i] if i < len(ACCOUNT_TITLES) else f"Account {i + 1}" for i in range(num_accounts)]
+    from project.accounts.ibans import format_iban, account_numbers, FIRST_ACCOUNT_NUMBER
+    ibans = [format_iban(FIRST_ACCOUNT_NUMBER + i) for i in range(num_accounts)]
+
+    from project.db import is_partitioned
+    from project.accounts.cache import bump_accounts_version, invalidate_account_cache
+    from project.archive import forget_archive_boundaries
+
+    with engine.begin() as connection:
+        if is_partitioned():
+            from project.partitioning import clear_partitions
+            clear_partitions(connection)
+        else:
+            connection.execute(delete(Transaction))
+        # The archive and its boundary belong to the replaced history (see project/archive.py), deletions in
+        # progress to the replaced accounts; all of them reference accounts
+        connection.execute(delete(ArchivedTransaction))
+        connection.execute(delete(ArchiveBoundary))
+        connection.execute(delete(AccountDeletion))
+        connection.execute(delete(Account))
+        connection.execute(insert(Account), [{"title": title, "iban": iban} for title, iban in zip(titles, ibans)])
+        account_ids = connection.execute(select(Account.id).order_by(Account.iban)).scalars().all()
+        bump_accounts_version(connection)
+        # New accounts continue after the seeded account numbers (see project/accounts/ibans.py)
+        connection.execute(delete(IdBlock).where(IdBlock.name == account_numbers.name))
+
+        generator = TransactionGenerator(account_ids, seed=seed, months=months, end_date=end_date)
+        if is_partitioned():
+            from project.partitioning import ensure_partitions, months_between
+            ensure_partitions(connection, months_between(generator.start, generator.booking_datetime((generator.num_days - 1) * 86400)))
+        rows = generator.rows(num_transactions)
+        saldos = calculate_saldos(rows)
+        insert_transactions(connection, generator, rows, saldos)
+    invalidate_account_cache()
+    forget_archive_boundaries()
+    account_numbers.reset()
+
+    return account_ids
+
+
+## CLI
+@click.command("seed")
+@click.option("--accounts", "num_accounts", default=3, show_default=True, type=click.IntRange(1, MAX_SEED_ACCOUNTS), help="Number of accounts.")
+@click.option("--transactions", "num_transactions", default=1000, show_default=True, type=click.IntRange(0), help="Number of transactions.")
+@click.option("--months", default=12, show_default=True, type=click.IntRange(1), help="Length of the booking history.")
+@click.option("--seed", "random_seed", default=0, show_default=True, help="Random seed.")
+@click.option("--end-date", type=click.DateTime(formats=["%Y-%m-%d"]), help="Last booking day (default: today).")
+@with_appcontext
+def seed_command(num_accounts, num_transactions, months, random_seed, end_date):
+    '''Replace all accounts and transactions with generated data.'''
+    from project.db import get_engine, is_sharded
+
+    if is_sharded():
+        raise click.UsageError("Seeding is not supported with TRANSACTION_SHARD_URLS configured.")
+    start = time.perf_counter()
+    seed_database(get_engine(), num_accounts, num_transactions, seed=random_seed, months=months,
+                  end_date=end_date.date() if end_date else None)
+    click.echo(f"Seeded {num_accounts} accounts and {num_transactions} transactions in {time.perf_counter() - start:.1f}s.")
@@ -0,0 +1,272 @@
+'''
+Account-based sharding of transactions (opt-in via TRANSACTION_SHARD_URLS).
+
+Accounts (and everything else that is not sharded) stay in the primary database, which is also shard "0".
+Transactions are stored on the shard chosen by a hash of their account_id, so all queries of the app that
+filter by account (read_all, calculate_saldo, the CSV export, ...) hit a single database. Queries without
+an account filter run on every shard and their rows are combined.
+
+- Transaction ids are handed out in blocks from a counter in the primary database and are unique
+  across shards (see project/ids.py).
+- Transfers between accounts on different shards use an outbox: the sender's transaction and an outbox
+  message are committed together on the sender's shard, then the message is delivered to the
+  recipient's shard. Undelivered messages are retried with `flask deliver-transfers`.
+- scatter_gather() runs a Core statement on every shard in parallel, e.g. for admin listings.
+'''
+import heapq
+import logging
+import uuid
+import zlib
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import click
+import pytz
+from flask.cli import with_appcontext
+from sqlalchemy import MetaData, Table, Column, Index, event, func, select
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.sql import operators, visitors
+
+from project.db import LazySession, PRIMARY_SHARD, db_session, get_shard_engine, shard_ids
+from project.models import Transaction, ArchivedTransaction, ArchiveBoundary, DatabaseSetting, TransferOutbox, AppliedTransfer
+from project.ids import IdAllocator
+
+logger = logging.getLogger(__name__)
+
+class ShardingError(Exception):
+    pass
+
+
+## Shard selection
+def shard_for_account(account_id):
+    '''Stable (across processes and restarts) hash of the account id.'''
+    return str(zlib.crc32(str(int(account_id)).encode("ascii")) % len(shard_ids()))
+
+def is_sharded_mapper(mapper):
+    return getattr(mapper.class_, "__shard_key__", None) is not None
+
+def shard_chooser(mapper, instance, clause=None):
+    '''Shard of a new object: the shard of its account for sharded models, otherwise the primary.'''
+    if mapper is None or not is_sharded_mapper(mapper) or instance is None:
+        return PRIMARY_SHARD
+    account_id = getattr(instance, mapper.class_.__shard_key__)
+    if account_id is None:
+        raise ShardingError(f"{mapper.class_.__name__} needs an {mapper.class_.__shard_key__} to choose its shard.")
+    return shard_for_account(account_id)
+
+def identity_chooser(mapper, primary_key, *, lazy_loaded_from, execution_options, bind_arguments, **kw):
+    '''Shards to search for an object by primary key (ids of sharded tables are unique across shards).'''
+    if not is_sharded_mapper(mapper):
+        return [PRIMARY_SHARD]
+    return shard_ids()
+
+def execute_chooser(orm_context):
+    '''Shards to run an ORM statement on: the shards of the accounts it filters by, otherwise all shards.'''
+    sharded_mappers = [mapper for mapper in orm_context.all_mappers if is_sharded_mapper(mapper)]
+    if not sharded_mappers:
+        return [PRIMARY_SHARD]
+
+    shard_key_columns = {mapper.local_table.c[mapper.class_.__shard_key__] for mapper in sharded_mappers}
+    account_ids = set()
+    for column, operator, value in get_comparisons(orm_context.statement, orm_context.parameters):
+        if any(column.shares_lineage(key_column) for key_column in shard_key_columns):
+            if operator == operators.eq:
+                account_ids.add(value)
+            elif operator == operators.in_op:
+                account_ids.update(value)
+    if not account_ids:
+        return shard_ids()
+    return sorted({shard_for_account(account_id) for account_id in account_ids})
+
+def get_comparisons(statement, parameters=None):
+    '''
+    (column, operator, value) of all "column <op> bound value" comparisons in the WHERE clause. Values of
+    named bind parameters (project/queries.py) are taken from the execution's parameters.
+    '''
+    parameters = parameters if isinstance(parameters, Mapping) else {} # Not for executemany
+    whereclause = getattr(statement, "whereclause", None)
+    if whereclause is None:
+        return []
+
+    binds = {}
+    columns = set()
+    binaries = []
+    visitors.traverse(whereclause, {}, {"bindparam": lambda bind: binds.setdefault(bind, parameters.get(bind.key, bind.effective_value)),
+                                        "column": columns.add,
+                                        "binary": binaries.append})
+
+    # Binary expressions are visited before their operands, so they are matched afterwards
+    comparisons = []
+    for binary in binaries:
+        if binary.left in columns and binary.right in binds:
+            comparisons.append((binary.left, binary.operator, binds[binary.right]))
+        elif binary.left in binds and binary.right in columns:
+            comparisons.append((binary.right, binary.operator, binds[binary.left]))
+    return comparisons
+
+
+## Session
+class ShardedLazySession(ShardedSession, LazySession):
+    '''db_session while transactions are sharded; the primary shard still honours the read replica.'''
+
+    def __init__(self, **kwargs):
+        super().__init__(shard_chooser=shard_chooser, identity_chooser=identity_chooser, execute_chooser=execute_chooser, **kwargs)
+
+    def get_bind(self, mapper=None, *, shard_id=None, instance=None, clause=None, **kw):
+        if shard_id is None:
+            shard_id = self._choose_shard_and_assign(mapper, instance=instance, clause=clause)
+        if shard_id == PRIMARY_SHARD:
+            return self.primary_or_replica(clause)
+        return get_shard_engine(shard_id)
+
+def sharded_session_factory(**kwargs):
+    return ShardedLazySession(autoflush=False, **kwargs)
+
+@event.listens_for(ShardedLazySession, "before_flush")
+def assign_transaction_ids(session, flush_context, instances):
+    for instance in session.new:
+        if isinstance(instance, Transaction) and instance.id is None:
+            instance.id = transaction_ids.next_id()
+
+
+## Ids
+def first_transaction_id():
+    '''Start of the transaction id counter: after the highest id on any shard.'''
+    return max((row[0] or 0 for row in scatter_gather(select(func.max(Transaction.__table__.c.id)))), default=0) + 1
+
+transaction_ids = IdAllocator(Transaction.__tablename__, first_transaction_id)
+
+
+## Schema
+SHARDED_TABLES = [Transaction.__table__, ArchivedTransaction.__table__, ArchiveBoundary.__table__, DatabaseSetting.__table__, TransferOutbox.__table__, AppliedTransfer.__table__]
+
+def init_shards():
+    '''Creates the sharded tables on all shards except the primary (which has the full schema).'''
+    shard_metadata = MetaData()
+    for table in SHARDED_TABLES:
+        # Same columns and indexes, but no foreign keys (accounts only exist in the primary database)
+        Table(table.name, shard_metadata,
+              *[Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable,
+                       autoincrement=column.autoincrement) for column in table.columns],
+              *[Index(index.name, *[column.name for column in index.columns], unique=index.unique) for index in table.indexes])
+    for shard_id in shard_ids():
+        if shard_id != PRIMARY_SHARD:
+            shard_metadata.create_all(bind=get_shard_engine(shard_id))
+
+
+## Scatter-gather
+def scatter_gather(statement, key=None, reverse=False, limit=None):
+    '''
+    Runs a Core statement on every shard in parallel and returns the combined rows.
+    With `key`, every shard's rows must already be sorted by it (ORDER BY) and are merged in order;
+    `limit` then applies to the merged result (each shard should LIMIT its own rows as well).
+    '''
+    def run(shard_id):
+        with get_shard_engine(shard_id).connect() as connection:
+            return connection.execute(statement).all()
+
+    ids = shard_ids()
+    with ThreadPoolExecutor(max_workers=len(ids)) as executor:
+        results = list(executor.map(run, ids))
+
+    if key is None:
+        rows = [row for shard_rows in results for row in shard_rows]
+    else:
+        rows = heapq.merge(*results, key=key, reverse=reverse)
+    return list(rows)[:limit] if limit is not None else list(rows)
+
+
+## Cross-shard transfers
+def crosses_shards(sender_account_id, recipient_account_id):
+    return shard_for_account(sender_account_id) != shard_for_account(recipient_account_id)
+
+def create_cross_shard_transfer(sender_account, recipient_account, description, amount, utc_datetime_booked=None):
+    '''
+    Books the sender's transaction together with an outbox message (one commit on the sender's shard), then
+    delivers the message to the recipient's shard. Returns (sender_transaction_id, recipient_transaction_id);
+    the latter is None if the delivery failed and will be retried by `flask deliver-transfers`.
+    '''
+    from project.archive import check_booking_date
+    from project.transactions.transactions import TransactionError
+
+    try:
+        check_booking_date(sender_account.id, utc_datetime_booked)
+        check_booking_date(recipient_account.id, utc_datetime_booked)
+        sender_transaction = Transaction(description=description, amount=-amount, category="Transfer", utc_datetime_booked=utc_datetime_booked)
+        sender_transaction.account_id = sender_account.id
+        message = TransferOutbox(id=str(uuid.uuid4()),
+                                 account_id=sender_account.id,
+                                 recipient_account_id=recipient_account.id,
+                                 description=sender_transaction.description,
+                                 amount=amount,
+                                 utc_datetime_booked=sender_transaction.utc_datetime_booked.replace(tzinfo=None))
+        db_session.add_all([sender_transaction, message])
+        db_session.flush()
+        sender_transaction_id = sender_transaction.id
+        sender_transaction.calculate_saldo() # Commits the transaction and the message on the sender's shard
+    except ValueError as ve:
+        db_session.rollback()
+        raise TransactionError(str(ve))
+
+    try:
+        recipient_transaction_id = deliver_transfer(message)
+    except Exception as e:
+        db_session.rollback()
+        logger.warning("Error occurred while delivering transfer %s, it stays in the outbox: %s", message.id, e)
+        recipient_transaction_id = None
+    return sender_transaction_id, recipient_transaction_id
+
+def deliver_transfer(message):
+    '''Books the recipient's transaction of an outbox message (at most once) and marks the message delivered.'''
+    recipient_shard = shard_for_account(message.recipient_account_id)
+    applied = db_session.get(AppliedTransfer, message.id, identity_token=recipient_shard)
+    if applied is None:
+        transaction = Transaction(description=message.description, amount=message.amount, category="Transfer",
+                                  utc_datetime_booked=message.utc_datetime_booked.replace(tzinfo=pytz.UTC))
+        transaction.account_id = message.recipient_account_id
+        db_session.add(transaction)
+        db_session.flush()
+        transaction_id = transaction.id
+        db_session.add(AppliedTransfer(transfer_id=message.id, account_id=message.recipient_account_id, transaction_id=transaction_id))
+        transaction.calculate_saldo() # Commits the transaction and the AppliedTransfer on the recipient's shard
+    else:
+        transaction_id = applied.transaction_id
+
+    message.utc_datetime_delivered = datetime.utcnow()
+    db_session.commit()
+    return transaction_id
+
+def deliver_pending_transfers():
+    '''Delivers all outbox messages that are not delivered yet. Returns the number of delivered messages.'''
+    pending = TransferOutbox.query.filter(TransferOutbox.utc_datetime_delivered.is_(None)).order_by(TransferOutbox.utc_datetime_booked).all()
+    for message in pending:
+        deliver_transfer(message)
+    return len(pending)
+
+
+## CLI
+@click.command("deliver-transfers")
+@with_appcontext
+def deliver_transfers_command():
+    '''Deliver pending cross-shard transfers.'''
+    click.echo(f"Delivered {deliver_pending_transfers()} transfers.")
+
+@click.command("shard-info")
+@with_appcontext
+def shard_info_command():
+    '''Show the number of transactions and pending transfers per shard.'''
+    transactions = Transaction.__table__
+    outbox = TransferOutbox.__table__
+    for shard_id in shard_ids():
+        with get_shard_engine(shard_id).connect() as connection:
+            num_transactions = connection.execute(select(func.count()).select_from(transactions)).scalar()
+            num_pending = connection.execute(select(func.count()).select_from(outbox).where(outbox.c.utc_datetime_delivered.is_(None))).scalar()
+        click.echo(f"Shard {shard_id}: {num_transactions} transactions, {num_pending} pending transfers")
+
+    latest = scatter_gather(select(transactions.c.id, transactions.c.account_id, transactions.c.utc_datetime_booked, transactions.c.amount)
+                            .order_by(transactions.c.utc_datetime_booked.desc()).limit(10),
+                            key=lambda row: row.utc_datetime_booked, reverse=True, limit=10)
+    click.echo("Latest transactions:")
+    for row in latest:
+        click.echo(f"  [{row.utc_datetime_booked}] account {row.account_id}: {row.amount} (shard {shard_for_account(row.account_id)})")
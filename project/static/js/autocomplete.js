@@ -2,4 +2,21 @@ document.addEventListener("DOMContentLoaded", () => {
   $("#autocomplete").autocomplete({
       source: unique_descriptions
   });
+
+  // Recipient of the subaccount transfer: search accounts by title or IBAN prefix, the selected account's id is posted
+  $("#new-transfer-recipient").autocomplete({
+      minLength: 1,
+      source: (request, response) => {
+        $.getJSON(recipient_search_url, { q: request.term, limit: 10 })
+          .done((accounts) => response(accounts
+            .filter((account) => Number(account.id) !== active_account_id)
+            .map((account) => ({ label: `${account.title} (${account.iban.slice(0, 4)}...${account.iban.slice(-2)})`, id: account.id }))))
+          .fail(() => response([]));
+      },
+      select: (event, ui) => {
+        $("#recipient_id").val(ui.item.id);
+        event.target.setCustomValidity("");
+      }
+  });
+  $("#new-transfer-recipient").on("input", () => $("#recipient_id").val(""));
 });
@@ -101,8 +101,8 @@ function initValidation() {
           }
         }
         else if (event.currentTarget.className.includes("form-subaccount-transfer")) {
-          if (document.getElementById("new-transfer-recipient").value === "Recipient"){
-            document.getElementById("new-transfer-recipient").setCustomValidity("Invalid field.")
+          if (document.getElementById("recipient_id").value === ""){
+            document.getElementById("new-transfer-recipient").setCustomValidity("Please select a recipient from the list.")
             event.preventDefault();
             event.stopPropagation();
             form.classList.add('was-validated');
@@ -124,10 +124,8 @@ function initValidation() {
         this.setCustomValidity("");
     }
   });
-  document.getElementById("new-transfer-recipient").addEventListener('change', function() {
-    if (this.value !== "Recipient") {
-        this.setCustomValidity("");
-    }
+  document.getElementById("new-transfer-recipient").addEventListener('input', function() {
+    this.setCustomValidity(""); // Checked again on submit, see above
   });
   document.getElementById("new-transaction-amount").addEventListener('input', function() {
     if (this.value !== "0") {
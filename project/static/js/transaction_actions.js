@@ -0,0 +1,30 @@
+// Edit transaction form, filled with the values of the clicked row
+document.querySelectorAll('.edit-transaction-btn').forEach(function(button) {
+  button.addEventListener('click', function(event) {
+    event.preventDefault();
+    document.getElementById('editTransactionForm').action = button.dataset.updateUrl;
+    document.getElementById('deleteTransactionForm').action = button.dataset.deleteUrl;
+    document.getElementById('editTransactionDescription').value = button.dataset.description;
+    document.getElementById('editTransactionCategory').value = button.dataset.category;
+    document.getElementById('editTransactionAmount').value = button.dataset.amount;
+    // Only the description of subaccount transfers can be changed, the other leg would keep the old amount
+    const isTransfer = button.dataset.transfer === 'true';
+    document.getElementById('editTransactionAmount').readOnly = isTransfer;
+    document.getElementById('deleteTransactionForm').style.display = isTransfer ? 'none' : '';
+    document.getElementById('overlay_edit_transaction').style.display = 'block';
+  });
+});
+
+document.getElementById('closeEditTransactionBtn').addEventListener('click', function() {
+  document.getElementById('overlay_edit_transaction').style.display = 'none';
+});
+
+
+// Delete transaction form
+document.getElementById('delete-transaction-btn').addEventListener('click', function(event) {
+
+  const userResponse = confirm("Are you sure you want to delete this transaction? The saldos of later transactions will change.");
+  if (!userResponse) {
+    event.preventDefault();
+  }
+});
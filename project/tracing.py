@@ -0,0 +1,289 @@
+'''
+Request tracing with local span export (opt-in via TRACE_SAMPLE_RATE).
+
+A sampled request (web or API) gets a trace: a root span for the request and child spans for the API
+request validation, form construction, Transaction.read_all, the saldos of accounts.show, template
+rendering, create_transaction, calculate_saldo and every SQL statement. The current span is kept in a
+ContextVar, so spans of nested calls get their parent without passing it around. Requests that are not
+sampled create no spans at all; the instrumented functions then only look up the ContextVar.
+
+Finished spans are handed to a queue; an exporter thread writes them in batches (at most
+TRACE_EXPORT_BATCH spans or every TRACE_EXPORT_INTERVAL_MS) to the JSONL file TRACE_EXPORT_FILE (one span
+per line) and/or to an OTLP/HTTP collector with JSON encoding at TRACE_OTLP_ENDPOINT (e.g.
+http://localhost:4318/v1/traces). Export errors are logged and the batch is dropped.
+'''
+import atexit
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_EXPORT_BATCH = 512
+DEFAULT_EXPORT_INTERVAL_MS = 1000
+SERVICE_NAME = "flask-banking"
+MAX_STATEMENT_LENGTH = 500
+
+logger = logging.getLogger(__name__)
+
+_current_span = ContextVar("current_span", default=None)
+_sample_rate = 0.0
+_exporter = None # SpanExporter, see configure_tracing()
+
+
+## Spans
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error", "_token")
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.error = None
+        self.end_ns = None
+        self._token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, error=None):
+        '''Finishes the span (once) and makes its parent the current span again.'''
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        try:
+            _current_span.reset(self._token)
+        except ValueError: # Ended in another context than it was started in
+            pass
+        if _exporter is not None:
+            _exporter.export(self)
+
+    def to_dict(self):
+        return {"trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id, "name": self.name,
+                "start_ns": self.start_ns, "end_ns": self.end_ns, "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+                "attributes": self.attributes, "error": self.error}
+
+def current_span():
+    return _current_span.get()
+
+def start_span(name, root=False, **attributes):
+    '''
+    Child span of the current span, None outside of traces. With root, a new trace is started (if sampled)
+    when there is no current span.
+    '''
+    parent = _current_span.get()
+    if parent is not None:
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+    if root and _sample_rate > 0 and random.random() < _sample_rate:
+        return Span(name, f"{random.getrandbits(128):032x}", None, attributes)
+    return None
+
+@contextmanager
+def span(name, **attributes):
+    '''Span around the block (yields None outside of traces).'''
+    current = start_span(name, **attributes)
+    if current is None:
+        yield None
+        return
+    try:
+        yield current
+    except BaseException as e:
+        current.end(error=e)
+        raise
+    current.end()
+
+def traced(name):
+    '''Decorator wrapping every call of the function in a span.'''
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+## Export
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def otlp_payload(spans):
+    '''OTLP/JSON ExportTraceServiceRequest of the spans.'''
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": [{
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+            "name": span.name,
+            "kind": 2 if span.parent_id is None else 1, # Server (request) or internal
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [{"key": key, "value": otlp_value(value)} for key, value in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {},
+        } for span in spans]}],
+    }]}
+
+class SpanExporter:
+    '''Writes finished spans from a queue in batches, in a background thread (one per process).'''
+
+    def __init__(self, file_path=None, otlp_endpoint=None, max_batch=DEFAULT_EXPORT_BATCH, interval_ms=DEFAULT_EXPORT_INTERVAL_MS):
+        self.file_path = file_path
+        self.otlp_endpoint = otlp_endpoint
+        self.max_batch = max_batch
+        self.interval_s = interval_ms / 1000
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        self.start()
+        self._queue.put(span)
+
+    def start(self):
+        # Threads do not survive a fork (e.g. gunicorn workers), so the exporter is started per process
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._queue = queue.SimpleQueue()
+                    self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                    self._pid = os.getpid()
+                    self._thread.start()
+
+    def stop(self):
+        '''Writes everything queued so far and stops the exporter thread.'''
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval_s
+            while batch[-1] is not None and len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            if batch[-1] is None:
+                running = False
+                batch.pop()
+            if batch:
+                self.write(batch)
+
+    def write(self, spans):
+        try:
+            if self.file_path:
+                with open(self.file_path, "a", encoding="utf-8") as trace_file:
+                    trace_file.writelines(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+            if self.otlp_endpoint:
+                body = json.dumps(otlp_payload(spans)).encode()
+                post = urllib.request.Request(self.otlp_endpoint, data=body, headers={"Content-Type": "application/json"}, method="POST")
+                with urllib.request.urlopen(post, timeout=5):
+                    pass
+        except Exception:
+            logger.exception("Error occurred while exporting %s spans, they are dropped", len(spans))
+
+
+## Instrumentation
+def register_request_tracing(app):
+    '''Root span for every sampled request of app, child spans for its templates.'''
+
+    @app.before_request
+    def start_request_span():
+        g.trace_span = start_span(f"{request.method} {request.url_rule or request.path}", root=True, **{"http.method": request.method, "http.target": request.path})
+
+    @app.after_request
+    def record_status(response):
+        if g.get("trace_span") is not None:
+            g.trace_span.set("http.status_code", response.status_code)
+        return response
+
+    @app.teardown_request
+    def end_request_span(error=None):
+        if g.get("trace_span") is not None:
+            g.trace_span.end(error=error)
+
+    def start_template_span(sender, template, context, **extra):
+        start_span("render_template", template=template.name)
+
+    def end_template_span(sender, template, context, **extra):
+        current = _current_span.get()
+        if current is not None and current.name == "render_template":
+            current.end()
+
+    before_render_template.connect(start_template_span, app, weak=False)
+    template_rendered.connect(end_template_span, app, weak=False)
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if _current_span.get() is not None and context is not None:
+        context.trace_span = start_span("sql", statement=statement[:MAX_STATEMENT_LENGTH], database=connection.engine.url.database or "")
+
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    trace_span = getattr(context, "trace_span", None)
+    if trace_span is not None:
+        trace_span.set("rows", cursor.rowcount)
+        trace_span.end()
+
+def handle_error(exception_context):
+    trace_span = getattr(exception_context.execution_context, "trace_span", None)
+    if trace_span is not None:
+        trace_span.end(error=exception_context.original_exception)
+
+def configure_tracing(config):
+    '''Sets the sampling rate and the exporter of config; registers the SQL statement spans (once per process).'''
+    global _sample_rate, _exporter
+    file_path, otlp_endpoint = config.get("TRACE_EXPORT_FILE"), config.get("TRACE_OTLP_ENDPOINT")
+    rate = float(config.get("TRACE_SAMPLE_RATE") or 0)
+    if not rate or not (file_path or otlp_endpoint):
+        _sample_rate = 0.0
+        return False
+
+    if _exporter is None or (_exporter.file_path, _exporter.otlp_endpoint) != (file_path, otlp_endpoint):
+        if _exporter is not None:
+            _exporter.stop()
+        _exporter = SpanExporter(file_path, otlp_endpoint,
+                                 config.get("TRACE_EXPORT_BATCH", DEFAULT_EXPORT_BATCH),
+                                 config.get("TRACE_EXPORT_INTERVAL_MS", DEFAULT_EXPORT_INTERVAL_MS))
+        atexit.register(_exporter.stop)
+    _sample_rate = rate
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(Engine, "handle_error", handle_error)
+    return True
+
+def flush_spans():
+    '''Writes all spans finished so far (the exporter thread is started again by the next span).'''
+    if _exporter is not None:
+        _exporter.stop()
+
+def is_tracing():
+    return _sample_rate > 0
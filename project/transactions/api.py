@@ -1,17 +1,24 @@
 ## Imports
-from flask import jsonify
+from flask import jsonify, current_app
 
 from datetime import datetime
 from flask import request
 
 # Models
-from project.models import Transaction, Account
-from project.transactions.transactions import create_transaction
+from project.models import Transaction, TransactionRow, Account
+from project.transactions.transactions import create_transaction, get_account_transaction, update_transaction, delete_transaction
 
 import re
 import pytz
 
 from project.transactions.transactions import TransactionError
+from project.idempotency import idempotent
+from project.db import is_sharded
+from project.queries import get_transaction
+from project.json_provider import json_encoder
+from project.fields import shape_list, select_fields
+
+TRANSACTION_FIELDS = ("account_id", "transaction_id", "amount", "saldo", "description", "category", "utc_datetime_booked")
 
 ## Custom exceptions
 class DataValidationError(Exception):
@@ -22,7 +29,8 @@ class DateTimeConversionError(Exception):
     pass
 
 ## API Endpoints
-def api_create_transaction(account_id):
+@idempotent
+def api_create_transaction(account_id, fields=None):
     # Local imports to avoid import order error
     from project.accounts.accounts import AccountNotFoundError, validate_account
 
@@ -39,24 +47,19 @@ def api_create_transaction(account_id):
         if data.get("utc_datetime_booked") != None:
             utc_datetime_booked = validate_and_get_utc_datetime(data.get("utc_datetime_booked"))
 
-        status, message, transaction_id = create_transaction(account=account,
+        # The new transaction is returned as a TransactionRow, so it is not queried again for the response
+        status, message, row = api_create_transaction_function()(account=account,
                                                     description=data.get("description"),
                                                     amount=data.get("amount"),
                                                     category=data.get("category"),
-                                                    utc_datetime_booked=utc_datetime_booked
+                                                    utc_datetime_booked=utc_datetime_booked,
+                                                    as_row=True
                                                      )
         if status == "success":
-            transaction = Transaction.query.get(transaction_id)
             return jsonify({
                 "status": "success",
                 "detail": "Successfully created new transaction.",
-                "description": transaction.description,
-                "amount": transaction.amount,
-                "saldo": transaction.saldo,
-                "transaction_id": transaction.id,
-                "category": transaction.category,
-                "utc_datetime_booked": f"{transaction.utc_datetime_booked.isoformat()}+00:00",
-                "account_id": transaction.account.id
+                **select_fields(transaction_to_json(row), fields)
             }), 201
         else:
             return jsonify({"status": "error", "detail": message}), 400
@@ -66,10 +69,12 @@ def api_create_transaction(account_id):
     except (DataValidationError, DateTimeFormatError, DateTimeConversionError) as e:
         return jsonify({"status": "error", "detail": str(e)}), 400
 
-def api_create_subaccount_transfer(sender_account_id):
+@idempotent
+def api_create_subaccount_transfer(sender_account_id, fields=None, compact=False):
 
     # Local imports to avoid import order error
     from project.accounts.accounts import AccountNotFoundError, validate_account
+    from project.sharding import crosses_shards, create_cross_shard_transfer
 
     try:
         sender_account = validate_account(sender_account_id)
@@ -86,12 +91,24 @@ def api_create_subaccount_transfer(sender_account_id):
         if data.get("utc_datetime_booked") != None:
             utc_datetime_booked = validate_and_get_utc_datetime(data.get("utc_datetime_booked"))
 
-        sender_transaction_id = api_process_sender_transaction(sender_account, data)
-        recipient_transaction_id = api_process_recipient_transaction(recipient_account, data)
+        if is_sharded() and crosses_shards(sender_account.id, recipient_account.id):
+            sender_transaction_id, recipient_transaction_id = create_cross_shard_transfer(sender_account, recipient_account,
+                                                                                          data.get("description"), data.get("amount"))
+            if sender_transaction_id and not recipient_transaction_id:
+                return jsonify({
+                    "status": "success",
+                    "detail": "Successfully created subaccount transfer. Crediting the recipient is pending.",
+                    "transactions": transactions_to_json([get_transaction(sender_transaction_id)], fields, compact),
+                }), 201
+            sender_transaction = get_transaction(sender_transaction_id) if sender_transaction_id else None
+            recipient_transaction = get_transaction(recipient_transaction_id) if recipient_transaction_id else None
+        else:
+            sender_transaction = api_process_sender_transaction(sender_account, data)
+            recipient_transaction = api_process_recipient_transaction(recipient_account, data)
 
-        if sender_transaction_id and recipient_transaction_id:
+        if sender_transaction and recipient_transaction:
 
-            transactions = transactions_to_json([Transaction.query.get(sender_transaction_id), Transaction.query.get(recipient_transaction_id)])
+            transactions = transactions_to_json([sender_transaction, recipient_transaction], fields, compact)
 
             return jsonify({
                 "status": "success",
@@ -106,6 +123,39 @@ def api_create_subaccount_transfer(sender_account_id):
     except (DataValidationError, DateTimeFormatError, DateTimeConversionError, TransactionError) as e:
         return jsonify({"status": "error", "detail": str(e)}), 400
 
+def api_update_transaction(account_id, transaction_id, fields=None):
+
+    transaction = get_account_transaction(account_id, transaction_id)
+    if transaction is None:
+        return jsonify({"status": "error", "detail": "Transaction not found."}), 404
+
+    data = request.get_json() # Only description, amount and category (validated by swagger)
+    status, message, row = update_transaction(transaction,
+                                              description=data.get("description"),
+                                              amount=data.get("amount"),
+                                              category=data.get("category"),
+                                              as_row=True)
+    if status == "success":
+        return jsonify({
+            "status": "success",
+            "detail": message,
+            **select_fields(transaction_to_json(row), fields)
+        }), 200
+    else:
+        return jsonify({"status": "error", "detail": message}), 400
+
+def api_delete_transaction(account_id, transaction_id):
+
+    transaction = get_account_transaction(account_id, transaction_id)
+    if transaction is None:
+        return jsonify({"status": "error", "detail": "Transaction not found."}), 404
+
+    status, message = delete_transaction(transaction)
+    if status == "success":
+        return jsonify({"status": "success", "detail": message}), 200
+    else:
+        return jsonify({"status": "error", "detail": message}), 400
+
 
 ## Subfunctions
 def validate_data(required_fields, data):
@@ -124,46 +174,62 @@ def validate_and_get_utc_datetime(datetime_string):
     except:
         raise DateTimeConversionError("Could not convert utc_datetime_booked to datetime object")
 
+def api_create_transaction_function():
+    """create_transaction or, if TRANSACTION_WRITE_QUEUE is enabled, its group-commit equivalent."""
+    from project.batch import in_atomic_batch
+    if current_app.config.get("TRANSACTION_WRITE_QUEUE") and not in_atomic_batch(): # The writer has its own session
+        from project.transactions.write_queue import queue_transaction
+        return queue_transaction
+    return create_transaction
+
 def api_process_sender_transaction(account, data):
-    """Process sender transaction and return its ID."""
-    status, message, transaction_id = create_transaction(
+    """Process sender transaction and return its TransactionRow."""
+    status, message, row = api_create_transaction_function()(
         account=account,
         description=data.get("description"),
         amount=-data.get("amount"),
-        category="Transfer"
+        category="Transfer",
+        as_row=True
     )
-    if not transaction_id or status == "error":
+    if not row or status == "error":
         raise TransactionError(message)
     else:
-        return transaction_id
+        return row
 
 def api_process_recipient_transaction(account, data):
-    """Process recipient transaction and return its ID."""
-    status, message, transaction_id = create_transaction(
+    """Process recipient transaction and return its TransactionRow."""
+    status, message, row = api_create_transaction_function()(
         account=account,
         description=data.get("description"),
         amount=data.get("amount"),
-        category="Transfer"
+        category="Transfer",
+        as_row=True
     )
-    if not transaction_id or status == "error":
+    if not row or status == "error":
         raise TransactionError(message)
     else:
-        return transaction_id
-
-def transactions_to_json(transaction_list):
-    json_transactions = []
-    for transaction in transaction_list:
-        transaction_dict = {
-            "account_id": transaction.account.id,
-            "transaction_id": (transaction.id),
-            "amount": transaction.amount,
-            "saldo": transaction.saldo,
-            "description": transaction.description,
-            "category": transaction.category,
-            "utc_datetime_booked": transaction.utc_datetime_booked.isoformat()
-        }
-        json_transactions.append(transaction_dict)
-    return json_transactions
+        return row
+
+@json_encoder(Transaction, TransactionRow)
+def transaction_to_json(transaction):
+    # Amounts, saldos and booking datetimes are encoded by the app's JSON provider (project/json_provider.py)
+    return {
+        "account_id": transaction.account_id,
+        "transaction_id": transaction.id,
+        "amount": transaction.amount,
+        "saldo": transaction.saldo,
+        "description": transaction.description,
+        "category": transaction.category,
+        "utc_datetime_booked": transaction.utc_datetime_booked
+    }
+
+def transactions_to_json(transaction_list, fields=None, compact=False):
+    '''
+    Transaction instances or TransactionRow views (Transaction.read_all(..., as_rows=True)) for a response,
+    each one is converted by transaction_to_json while the response is serialised.
+    With fields or compact, see project/fields.py.
+    '''
+    return shape_list(transaction_list, transaction_to_json, TRANSACTION_FIELDS, fields, compact)
 
 
 
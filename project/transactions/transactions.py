@@ -2,6 +2,7 @@
 from flask import (
     Blueprint, redirect, url_for, jsonify, abort, request, flash
 )
+from sqlalchemy import delete as delete_statement
 from sqlalchemy.orm.exc import NoResultFound
 
 # CSV download
@@ -11,16 +12,23 @@ from werkzeug.wrappers import Response
 
 # Forms
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, DecimalField, SelectField
-from wtforms.validators import DataRequired, Length, AnyOf, ValidationError
+from wtforms import StringField, SubmitField, DecimalField, SelectField, HiddenField
+from wtforms.validators import DataRequired, Length, AnyOf, ValidationError, Optional
 
 # Basics
+import logging
+import re
 from datetime import datetime
 from pprint import pprint
 
 # Models
-from project.models import Account, Transaction
-from project.db import db_session
+from project.models import Account, Transaction, OPENING_BALANCE_CATEGORY, TRANSFER_CATEGORY, transaction_row
+from project.db import db_session, read_only, is_sharded
+from project.accounts.registry import account_registry
+from project.tracing import traced
+from project.archive import check_booking_date
+
+logger = logging.getLogger(__name__)
 
 ## Forms
 def not_zero(form, field):
@@ -49,14 +57,34 @@ class TransactionForm(FlaskForm):
                           )
     submit = SubmitField("Add")
 
+# Recipient as shown by the transfer form, e.g. "Savings (GB07...01)"
+RECIPIENT_PATTERN = re.compile(r"(?P<title>.*\S) \((?P<fractional_iban>\w{4}\.\.\.\w{2})\)")
+
 class SubaccountTransferForm(TransactionForm):
-    recipient = SelectField("Recipient", choices = ["Recipient"], validators=[DataRequired()], render_kw={"placeholder": "Recipient"})
+    # Search field of the recipient (autocomplete of GET /api/accounts/search), which sets recipient_id.
+    # Without recipient_id, "Title (GB29...00)" is resolved through the account cache.
+    recipient = StringField("Recipient", render_kw={"placeholder": "Recipient"})
+    recipient_id = HiddenField("Recipient id", validators=[Optional()])
 
     # Remove "category" from form
     def __init__(self, *args, **kwargs):
         super(SubaccountTransferForm, self).__init__(*args, **kwargs)
         del self.category
 
+class EditTransactionForm(TransactionForm):
+    # Transfers keep their category when edited
+    choices = TransactionForm.choices + ["Transfer"]
+    category = SelectField("Category",
+                           choices = choices,
+                           validators=[
+                                DataRequired(),
+                                AnyOf(choices[1:])
+                               ])
+    submit = SubmitField("Update")
+
+class DeleteTransactionForm(FlaskForm):
+    delete = SubmitField("Delete")
+
 ## Custom exceptions
 class TransactionError(Exception):
     def __init__(self, message="A transaction error occurred"):
@@ -100,22 +128,21 @@ def create(account_id):
 def create_subaccount_transfer(sender_account_id):
     # Local imports to avoid import order error
     from project.accounts.accounts import AccountNotFoundError, validate_account
+    from project.sharding import crosses_shards, create_cross_shard_transfer
 
     # Process form data
     transfer_form = SubaccountTransferForm()
     try:
+        # Sender and recipient are loaded once each
         sender_account = validate_account(sender_account_id)
-
-        message, status = update_transfer_form(transfer_form, sender_account.id)
-
-        recipient_account_title, recipient_fractional_iban = validate_transfer_data(transfer_form)
-
-        # Retrieve recipient account based on parsed data
-        recipient_account = get_recipient_account(recipient_account_title, recipient_fractional_iban)
+        recipient_account = validate_transfer_data(transfer_form, sender_account_id)
 
         # Create transactions
-        process_sender_transaction(sender_account, transfer_form)
-        process_recipient_transaction(recipient_account, transfer_form)
+        if is_sharded() and crosses_shards(sender_account.id, recipient_account.id):
+            create_cross_shard_transfer(sender_account, recipient_account, transfer_form.description.data, transfer_form.amount.data)
+        else:
+            process_sender_transaction(sender_account, transfer_form)
+            process_recipient_transaction(recipient_account, transfer_form)
 
         message = f"Successfully created transfer from {sender_account.title} to {recipient_account.title}"
         status = "success"
@@ -129,11 +156,49 @@ def create_subaccount_transfer(sender_account_id):
         flash(str(e), "error")
         return redirect(url_for("accounts.show", account_id=sender_account_id))
 
+@transactions_bp.route("/accounts/<int:account_id>/transactions/<int:transaction_id>/update", methods=["POST"])
+def update(account_id, transaction_id):
+
+    edit_transaction_form = EditTransactionForm()
+    if not edit_transaction_form.validate():
+        flash("Form data is not valid.", "error")
+        return redirect(url_for("accounts.show", account_id=account_id))
+
+    transaction = get_account_transaction(account_id, transaction_id)
+    if transaction is None:
+        flash("Transaction not found.", "error")
+        return redirect(url_for("accounts.show", account_id=account_id))
+
+    status, message, _ = update_transaction(transaction,
+                                            description=edit_transaction_form.description.data,
+                                            amount=edit_transaction_form.amount.data,
+                                            category=edit_transaction_form.category.data)
+    flash(message, status)
+    return redirect(url_for("accounts.show", account_id=account_id))
+
+@transactions_bp.route("/accounts/<int:account_id>/transactions/<int:transaction_id>/delete", methods=["POST"])
+def delete(account_id, transaction_id):
+
+    delete_transaction_form = DeleteTransactionForm()
+    if not delete_transaction_form.validate():
+        flash("Form data is not valid.", "error")
+        return redirect(url_for("accounts.show", account_id=account_id))
+
+    transaction = get_account_transaction(account_id, transaction_id)
+    if transaction is None:
+        flash("Transaction not found.", "error")
+        return redirect(url_for("accounts.show", account_id=account_id))
+
+    status, message = delete_transaction(transaction)
+    flash(message, status)
+    return redirect(url_for("accounts.show", account_id=account_id))
+
 # Work on this !
 @transactions_bp.route('/download_csv', methods=['POST'])
+@read_only
 def download_csv():
     try:
-        account = Account.query.get(request.form.get('account_id'))
+        account = account_registry().get(request.form.get('account_id'))
         start_date = datetime.strptime(request.form.get('start_date'), '%Y-%m-%d').date() if request.form.get('start_date') != "None" else None
         end_date = datetime.strptime(request.form.get('end_date'), '%Y-%m-%d').date() if request.form.get('end_date') != "None" else None
         transaction_description = request.form.get('transaction_description') if request.form.get('transaction_description') != "None" else None
@@ -144,7 +209,8 @@ def download_csv():
                                             start_date = start_date,
                                             end_date=end_date,
                                             search_type=search_type,
-                                            transaction_description=transaction_description)
+                                            transaction_description=transaction_description,
+                                            as_rows=True)
 
         def generate():
             data = StringIO()
@@ -157,7 +223,7 @@ def download_csv():
 
             for transaction in transactions:
                 writer.writerow((
-                    transaction.account.iban,
+                    account.iban,
                     transaction.utc_datetime_booked.strftime("%d/%m/%Y"),
                     transaction.description,
                     f"{transaction.amount}€",
@@ -177,75 +243,165 @@ def download_csv():
 
 
 ## Subfunctions
-def create_transaction(account, description, amount, category, utc_datetime_booked=None):
+@traced("create_transaction")
+def create_transaction(account, description, amount, category, utc_datetime_booked=None, as_row=False):
     '''
     :param account: valid (!) account instance
     :param description: Description of transaction
     :param amount: Transaction amount
     :param category: TO BE DISCUSSED
     :param utc_datetime_booked: datetime object in UTC timezone format
+    :param as_row: return the TransactionRow of the new transaction instead of its id
     '''
     try:
         # Create new transaction and link to account
         transaction = Transaction(description=description, amount=amount, category=category, utc_datetime_booked=utc_datetime_booked)
+        check_booking_date(account.id, utc_datetime_booked)
         account.transactions.append(transaction)
         db_session.add(account)
+        db_session.flush()
+        row = transaction_row(transaction) # Before the commits expire its attributes
         db_session.commit()
 
         # Calculate saldo for transaction
-        transaction.calculate_saldo()
+        row = row._replace(saldo=transaction.calculate_saldo())
 
-        print(f"Successfully created the transaction: {transaction}")
-        return "success", "Successfully created the transaction.", transaction.id
+        logger.info("Created transaction %s", row.id, extra={"sampled": True, "transaction_id": row.id, "account_id": row.account_id,
+                                                             "amount": row.amount, "saldo": row.saldo})
+        return "success", "Successfully created the transaction.", row if as_row else row.id
 
     except ValueError as ve: # This will capture all ValueErrors raised in __init__
         db_session.rollback()
-        print(f"Error: {ve}") # Display the actual error message from __init__
+        logger.info("Transaction rejected: %s", ve) # The actual error message from __init__
         return "error", f"{ve}", None
-    except Exception as e:
+    except Exception:
         db_session.rollback()
-        print(f"Error occurred while creating the transaction: {e}")
+        logger.exception("Error occurred while creating the transaction")
         return "error", 'Error occurred while creating the transaction.', None
 
+def get_account_transaction(account_id, transaction_id):
+    '''Booked transaction of the account by id, None if the account has no such transaction.'''
+    from project.queries import get_transaction
+    transaction = get_transaction(transaction_id)
+    if transaction is None or transaction.account_id != int(account_id):
+        return None
+    return transaction
+
+def update_transaction(transaction, description=None, amount=None, category=None, as_row=False):
+    '''
+    Changes the given fields of a booked transaction. A changed amount shifts the saldo of the transaction and
+    of all later transactions of the account by the difference (project/queries.py), in the same commit.
+    Of subaccount transfers only the description can be changed: the other leg would keep the old amount.
+    With as_row, returns the TransactionRow of the updated transaction instead of its id.
+    '''
+    try:
+        if transaction.category == OPENING_BALANCE_CATEGORY:
+            raise ValueError("Opening balances cannot be changed.")
+        is_transfer = transaction.category == TRANSFER_CATEGORY
+        if category is not None and (category == TRANSFER_CATEGORY) != is_transfer:
+            raise ValueError("Only subaccount transfers have the category Transfer.")
+
+        # Validated like a new transaction (not added to the session)
+        changed = Transaction(description=transaction.description if description is None else description,
+                              amount=transaction.amount if amount is None else amount,
+                              category=transaction.category if category is None else category)
+        delta = round(changed.amount, 2) - transaction.amount
+        if is_transfer and delta:
+            raise ValueError("Amounts of subaccount transfers cannot be changed, book a transfer back instead.")
+
+        transaction_id = transaction.id
+        transaction.description = changed.description
+        transaction.category = changed.category
+        if delta:
+            from project.queries import shift_later_saldos
+            shift_later_saldos(transaction.account_id, transaction.utc_datetime_booked, delta)
+            transaction.amount += delta
+            if transaction.saldo is not None:
+                transaction.saldo += delta
+        row = transaction_row(transaction) # Before the commit expires its attributes
+        db_session.commit()
+
+        logger.info("Updated transaction %s", transaction_id, extra={"transaction_id": transaction_id, "account_id": row.account_id, "delta": delta})
+        return "success", "Successfully updated the transaction.", row if as_row else transaction_id
+
+    except ValueError as ve:
+        db_session.rollback()
+        logger.info("Transaction update rejected: %s", ve)
+        return "error", f"{ve}", None
+    except Exception:
+        db_session.rollback()
+        logger.exception("Error occurred while updating the transaction")
+        return "error", 'Error occurred while updating the transaction.', None
+
+def delete_transaction(transaction):
+    '''Deletes a booked transaction and shifts the saldos of all later transactions of the account by its amount, in one commit.'''
+    try:
+        if transaction.category == OPENING_BALANCE_CATEGORY:
+            raise ValueError("Opening balances cannot be deleted.")
+        if transaction.category == TRANSFER_CATEGORY:
+            raise ValueError("Subaccount transfers cannot be deleted, book a transfer back instead.")
+
+        from project.queries import shift_later_saldos
+        shift_later_saldos(transaction.account_id, transaction.utc_datetime_booked, -transaction.amount)
+        deleted = {"transaction_id": transaction.id, "account_id": transaction.account_id, "amount": transaction.amount}
+        # A DELETE statement instead of session.delete(): partitioned SQLite deletes through a trigger of a view,
+        # which reports 0 deleted rows (the account id routes the statement to the account's shard)
+        db_session.execute(delete_statement(Transaction).where(Transaction.account_id == transaction.account_id, Transaction.id == transaction.id),
+                           execution_options={"synchronize_session": False})
+        db_session.expunge(transaction)
+        db_session.commit()
+
+        logger.info("Deleted transaction %s", deleted["transaction_id"], extra=deleted)
+        return "success", "Successfully deleted the transaction."
+
+    except ValueError as ve:
+        db_session.rollback()
+        logger.info("Transaction deletion rejected: %s", ve)
+        return "error", f"{ve}"
+    except Exception:
+        db_session.rollback()
+        logger.exception("Error occurred while deleting the transaction")
+        return "error", 'Error occurred while deleting the transaction.'
+
 def update_transfer_form(form, sender_account_id):
     try:
-        all_accounts = Account.query.all()
-        if len(all_accounts) == 1:
+        if len(account_registry().all()) == 1:
             # If only one account exists, disable all fields (no transfer destination available)
             for field in form:
                 field.render_kw = {**field.render_kw, 'disabled': True} if field.render_kw else {'disabled': True}
-
-        else:
-            for account in all_accounts:
-                if account.id != sender_account_id:
-                    form.recipient.choices.append(f"{account.title} ({account.iban[:4]}...{account.iban[-2:]})") # Do not add currently displayed account
-
-            # Update the (AnyOf) validators for the recipient field
-            form.recipient.validators = [DataRequired()]
-            recipient_values = [choice for choice in form.recipient.choices if choice != "Recipient"] # make Recipient not a valid value
-            form.recipient.validators.append(AnyOf(recipient_values))
     except Exception:
         return "Could not update transfer form.", "error"
     else:
         return "Updated transfer form", "success"
 
-def validate_transfer_data(form):
-    # Evaluate data received from form
-    if not form.validate(): # Validates reference max length, recipient(that it cannot be "Recipient" too), amount(can be string digits, cannot be = 0)
+def validate_transfer_data(form, sender_account_id):
+    '''Recipient account of a valid transfer form, raises ValueError for invalid form data.'''
+    if not form.validate(): # Validates reference max length, amount(can be string digits, cannot be = 0)
         raise ValueError('Form data is not valid.')
+
+    if form.recipient_id.data:
+        if not form.recipient_id.data.isdigit():
+            raise ValueError('Form data is not valid.')
+        recipient_account = get_recipient_account_by_id(form.recipient_id.data)
     else:
-        recipient_title = form.recipient.data.split("(")[0].strip()
-        recipient_fractional_iban = form.recipient.data.split("(")[1].strip()
-        recipient_fractional_iban = recipient_fractional_iban.split(")")[0].strip()
-        return recipient_title, recipient_fractional_iban
+        match = RECIPIENT_PATTERN.fullmatch(form.recipient.data or "")
+        if not match:
+            raise ValueError('Form data is not valid.')
+        recipient_account = get_recipient_account(match["title"], match["fractional_iban"])
+
+    if recipient_account.id == int(sender_account_id):
+        raise ValueError('Form data is not valid.')
+    return recipient_account
+
+def get_recipient_account_by_id(account_id):
+    account = account_registry().get(account_id)
+    if account is None:
+        raise NoResultFound("Recipient account not found.")
+    return account
 
 def get_recipient_account(title, fractional_iban):
     """Retrieve recipient account based on title and fractional IBAN."""
-    return Account.query.filter(
-        Account.title == title,
-        Account.iban.like(f"{fractional_iban[:4]}%"),
-        Account.iban.like(f"%{fractional_iban[-2:]}")
-    ).one()
+    return account_registry().find_recipient(title, fractional_iban)
 
 def process_sender_transaction(account, form):
     """Process sender transaction and return its ID."""
@@ -0,0 +1,210 @@
+'''
+Group-commit write queue for API transactions (opt-in via TRANSACTION_WRITE_QUEUE).
+
+create_transaction() commits twice per transaction (insert, then saldo). With the write queue enabled,
+API requests hand their transaction to a single writer thread instead and wait for the result. The writer
+collects transactions for up to WRITE_QUEUE_MAX_DELAY_MS (or WRITE_QUEUE_MAX_BATCH transactions), computes
+their saldos per account in submission order and inserts the whole group with one commit. If the group
+fails, its transactions are written one by one, so only the offending ones fail.
+
+Saldos are identical to the ones create_transaction() would calculate for the same sequence of requests.
+'''
+import decimal
+import logging
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import Future
+from itertools import accumulate
+
+from flask import current_app
+from sqlalchemy import func
+
+from project.db import db_session
+from project.models import Transaction, transaction_row
+from project.tracing import traced
+from project.archive import check_booking_date
+
+DEFAULT_MAX_BATCH = 500
+DEFAULT_MAX_DELAY_MS = 5
+RESULT_TIMEOUT_S = 30
+
+logger = logging.getLogger(__name__)
+
+class WriteQueue:
+    '''Single writer thread committing queued transactions in groups.'''
+
+    def __init__(self, max_batch=DEFAULT_MAX_BATCH, max_delay_ms=DEFAULT_MAX_DELAY_MS):
+        self.max_batch = max_batch
+        self.max_delay_s = max_delay_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+
+    def submit(self, account_id, description, amount, category, utc_datetime_booked=None):
+        '''
+        Queues a transaction and returns a Future resolving to its TransactionRow (with id and saldo).
+        Invalid transactions raise the ValueError of Transaction.__init__ in the calling thread.
+        '''
+        self.start()
+        future = Future()
+        # Booking time (utcnow by default) and queue position are taken together, so the order in the
+        # queue matches the booking order and every saldo includes all transactions queued before it
+        with self._submit_lock:
+            transaction = Transaction(description=description, amount=amount, category=category, utc_datetime_booked=utc_datetime_booked)
+            transaction.account_id = account_id
+            self._queue.put((transaction, future))
+        return future
+
+    def start(self):
+        # Threads do not survive a fork (e.g. gunicorn workers), so the writer is started per process
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._thread = threading.Thread(target=self._run, name="transaction-write-queue", daemon=True)
+                    self._pid = os.getpid()
+                    self._thread.start()
+
+    def stop(self):
+        '''Commits everything queued so far and stops the writer thread.'''
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+    ## Writer thread
+    def _run(self):
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay_s
+            while batch[-1] is not None and len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            if batch[-1] is None:
+                running = False
+                batch.pop()
+            if batch:
+                self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        try:
+            transactions = [transaction for transaction, _ in batch]
+            calculate_saldos(transactions)
+            db_session.add_all(transactions)
+            db_session.flush()
+            results = [transaction_row(transaction) for transaction in transactions] # Before commit expires them
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+            logger.exception("Error occurred while writing %s queued transactions, writing them one by one", len(batch))
+            for transaction, future in batch:
+                self._write_one(transaction, future)
+        else:
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        finally:
+            db_session.remove()
+
+    def _write_one(self, transaction, future):
+        '''Writes a transaction of a failed group on its own, so only the offending ones get the exception.'''
+        try:
+            transaction.id = None # Assigned by the rolled back flush
+            calculate_saldos([transaction]) # The transactions of the group written before it are stored now
+            db_session.add(transaction)
+            db_session.flush()
+            result = transaction_row(transaction)
+            db_session.commit()
+        except Exception as e:
+            db_session.rollback()
+            logger.exception("Error occurred while writing a queued transaction")
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+class RunningTotals:
+    '''Amounts added by booking time rank; sum of the amounts with a lower rank in O(log n) (Fenwick tree).'''
+
+    def __init__(self, size):
+        self._tree = [decimal.Decimal(0)] * (size + 1)
+
+    def add(self, rank, amount):
+        rank += 1
+        while rank < len(self._tree):
+            self._tree[rank] += amount
+            rank += rank & -rank
+
+    def before(self, rank):
+        total = decimal.Decimal(0)
+        while rank > 0:
+            total += self._tree[rank]
+            rank -= rank & -rank
+        return total
+
+def calculate_saldos(transactions):
+    '''
+    Sets the saldo of new transactions (in submission order) like Transaction.calculate_saldo() would if they
+    were created one after another: sum of all older transactions of the account (including earlier ones of
+    this group) plus the own amount.
+    '''
+    by_account = {}
+    for transaction in transactions:
+        by_account.setdefault(transaction.account_id, []).append(transaction)
+
+    totals = {account_id: (total, latest) for account_id, total, latest in db_session.query(
+        Transaction.account_id,
+        func.sum(Transaction.amount),
+        func.max(Transaction.utc_datetime_booked)
+    ).filter(Transaction.account_id.in_(by_account.keys())).group_by(Transaction.account_id).all()}
+
+    for account_id, account_transactions in by_account.items():
+        total, latest = totals.get(account_id, (None, None))
+        total = decimal.Decimal(total or 0)
+        booked_times = [transaction.utc_datetime_booked.replace(tzinfo=None) for transaction in account_transactions]
+
+        # Stored transactions booked at or after the earliest new one (usually none) are not part of its saldo
+        later_stored = []
+        if latest is not None and min(booked_times) <= latest:
+            later_stored = db_session.query(Transaction.amount, Transaction.utc_datetime_booked).filter(
+                Transaction.account_id == account_id,
+                Transaction.utc_datetime_booked >= min(booked_times)
+            ).order_by(Transaction.utc_datetime_booked).all()
+        stored_times = [stored_booked for _, stored_booked in later_stored]
+        # stored_from[i]: sum of the amounts of later_stored[i:]
+        stored_from = list(accumulate(reversed([amount for amount, _ in later_stored]), initial=decimal.Decimal(0)))[::-1]
+
+        # Earlier queued transactions count if booked before: running totals by booking time rank
+        ranks = sorted(set(booked_times))
+        queued = RunningTotals(len(ranks))
+        for transaction, booked in zip(account_transactions, booked_times):
+            rank = bisect_left(ranks, booked)
+            saldo = total - stored_from[bisect_left(stored_times, booked)] + queued.before(rank)
+            queued.add(rank, transaction.amount)
+            transaction.saldo = round(saldo + transaction.amount, 2)
+
+write_queue = WriteQueue()
+
+@traced("queue_transaction")
+def queue_transaction(account, description, amount, category, utc_datetime_booked=None, as_row=False):
+    '''Same arguments and return values as create_transaction(), but written by the group-commit writer.'''
+    write_queue.max_batch = current_app.config.get("WRITE_QUEUE_MAX_BATCH", DEFAULT_MAX_BATCH)
+    write_queue.max_delay_s = current_app.config.get("WRITE_QUEUE_MAX_DELAY_MS", DEFAULT_MAX_DELAY_MS) / 1000
+    try:
+        check_booking_date(account.id, utc_datetime_booked)
+        future = write_queue.submit(account.id, description, amount, category, utc_datetime_booked)
+        row = future.result(timeout=RESULT_TIMEOUT_S)
+        return "success", "Successfully created the transaction.", row if as_row else row.id
+    except ValueError as ve:
+        logger.info("Transaction rejected: %s", ve)
+        return "error", f"{ve}", None
+    except Exception:
+        logger.exception("Error occurred while creating the transaction")
+        return "error", 'Error occurred while creating the transaction.', None
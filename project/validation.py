@@ -0,0 +1,247 @@
+'''
+Request validation of the API (API_VALIDATION, see create_api_app() in project/__init__.py).
+
+- "full" (default): connexion's validators. The body validator is built once per operation, parameters
+  are validated by a new jsonschema validator (of a deep copy of their schema) on every request.
+- "compiled": the schemas of swagger.yml are compiled once into nested Python checks of the keywords the
+  spec uses, so a valid request costs a few dict lookups and isinstance checks. Whatever the compiled
+  check rejects (and every schema with keywords it does not compile) is validated by connexion's
+  validator as well, so error responses are the same as with "full".
+- "development": "full" outside production, "compiled" in production (IS_PROD). Requests are always
+  checked against the spec: the endpoints rely on its types, required fields and limits.
+
+With request tracing (project/tracing.py), the validators are wrapped by traced_validators(), so the
+validation of a request is a span of its own.
+'''
+import functools
+
+from connexion.decorators.validation import (ParameterValidator, RequestBodyValidator, TypeValidationError,
+                                             coerce_type)
+from connexion.utils import is_null, is_nullable
+from jsonschema import draft4_format_checker
+
+MODES = ("full", "compiled", "development")
+DEFAULT_MODE = "full"
+
+# Keywords without effect on validation
+ANNOTATIONS = {"description", "example", "title", "default", "deprecated", "nullable"}
+
+class UnsupportedSchema(Exception):
+    pass
+
+
+## Compiled checks
+def compile_schema(schema):
+    '''Function(instance) -> bool of a (resolved) JSON schema, None if the schema uses keywords that are not compiled.'''
+    try:
+        return _compile(schema)
+    except UnsupportedSchema:
+        return None
+
+def _compile(schema):
+    if not isinstance(schema, dict):
+        raise UnsupportedSchema(schema)
+    unsupported = [keyword for keyword in schema if keyword not in COMPILERS and keyword not in ANNOTATIONS and not keyword.startswith("x-")]
+    if unsupported:
+        raise UnsupportedSchema(unsupported)
+
+    checks = [COMPILERS[keyword](schema[keyword], schema) for keyword in schema if keyword in COMPILERS]
+    checks = [check for check in checks if check is not None]
+    nullable = schema.get("nullable") is True or schema.get("x-nullable") is True
+
+    def check(instance):
+        if instance is None and nullable:
+            return True
+        for keyword_check in checks:
+            if not keyword_check(instance):
+                return False
+        return True
+    return check
+
+def is_number(instance):
+    return isinstance(instance, (int, float)) and not isinstance(instance, bool)
+
+TYPES = {
+    "string": lambda instance: isinstance(instance, str),
+    "number": is_number,
+    "integer": lambda instance: isinstance(instance, int) and not isinstance(instance, bool), # Draft 4: 1.0 is not an integer
+    "boolean": lambda instance: isinstance(instance, bool),
+    "object": lambda instance: isinstance(instance, dict),
+    "array": lambda instance: isinstance(instance, list),
+    "null": lambda instance: instance is None,
+}
+
+def equal(one, two):
+    # As jsonschema: True and 1 are different values
+    if isinstance(one, bool) or isinstance(two, bool):
+        return isinstance(one, bool) and isinstance(two, bool) and one == two
+    return one == two
+
+def compile_type(types, schema):
+    checks = [TYPES[type_] for type_ in ([types] if isinstance(types, str) else types)]
+    return lambda instance: any(check(instance) for check in checks)
+
+def compile_enum(values, schema):
+    return lambda instance: any(equal(instance, value) for value in values)
+
+def compile_not(subschema, schema):
+    check = _compile(subschema)
+    return lambda instance: not check(instance)
+
+def compile_format(format_, schema):
+    if format_ not in draft4_format_checker.checkers:
+        return None # Unknown formats (e.g. float) are not checked by jsonschema either
+    return lambda instance: draft4_format_checker.conforms(instance, format_)
+
+def compile_length(keyword):
+    def compile_(limit, schema):
+        if keyword == "minLength":
+            return lambda instance: not isinstance(instance, str) or len(instance) >= limit
+        return lambda instance: not isinstance(instance, str) or len(instance) <= limit
+    return compile_
+
+def compile_bound(keyword):
+    def compile_(limit, schema):
+        if schema.get("exclusiveMinimum") or schema.get("exclusiveMaximum"):
+            raise UnsupportedSchema(keyword)
+        if keyword == "minimum":
+            return lambda instance: not is_number(instance) or instance >= limit
+        return lambda instance: not is_number(instance) or instance <= limit
+    return compile_
+
+def compile_items_count(keyword):
+    def compile_(limit, schema):
+        if keyword == "minItems":
+            return lambda instance: not isinstance(instance, list) or len(instance) >= limit
+        return lambda instance: not isinstance(instance, list) or len(instance) <= limit
+    return compile_
+
+def compile_unique_items(unique, schema):
+    if not unique:
+        return None
+    def check(instance):
+        if not isinstance(instance, list):
+            return True
+        return not any(equal(item, other) for index, item in enumerate(instance) for other in instance[index + 1:])
+    return check
+
+def compile_items(subschema, schema):
+    check = _compile(subschema)
+    return lambda instance: not isinstance(instance, list) or all(check(item) for item in instance)
+
+def compile_properties(properties, schema):
+    checks = [(name, _compile(subschema)) for name, subschema in properties.items()]
+    def check(instance):
+        if not isinstance(instance, dict):
+            return True
+        for name, property_check in checks:
+            if name in instance and not property_check(instance[name]):
+                return False
+        return True
+    return check
+
+def compile_required(required, schema):
+    for name in required:
+        if any(schema.get("properties", {}).get(name, {}).get(keyword) for keyword in ("readOnly", "writeOnly", "x-writeOnly")):
+            raise UnsupportedSchema("required") # connexion skips these, see connexion.json_schema.validate_required
+    return lambda instance: not isinstance(instance, dict) or all(name in instance for name in required)
+
+def compile_additional_properties(additional, schema):
+    if additional is not False:
+        raise UnsupportedSchema("additionalProperties")
+    allowed = set(schema.get("properties", {}))
+    return lambda instance: not isinstance(instance, dict) or allowed.issuperset(instance)
+
+def compile_min_properties(limit, schema):
+    return lambda instance: not isinstance(instance, dict) or len(instance) >= limit
+
+COMPILERS = {
+    "type": compile_type,
+    "enum": compile_enum,
+    "not": compile_not,
+    "format": compile_format,
+    "minLength": compile_length("minLength"),
+    "maxLength": compile_length("maxLength"),
+    "minimum": compile_bound("minimum"),
+    "maximum": compile_bound("maximum"),
+    "minItems": compile_items_count("minItems"),
+    "maxItems": compile_items_count("maxItems"),
+    "uniqueItems": compile_unique_items,
+    "items": compile_items,
+    "properties": compile_properties,
+    "required": compile_required,
+    "additionalProperties": compile_additional_properties,
+    "minProperties": compile_min_properties,
+}
+
+
+## connexion validators
+class CompiledRequestBodyValidator(RequestBodyValidator):
+    '''Validates bodies with the compiled check, with connexion's validator (and its error message) otherwise.'''
+
+    def __init__(self, schema, *args, **kwargs):
+        super().__init__(schema, *args, **kwargs)
+        self.check = compile_schema(schema)
+
+    def validate_schema(self, data, url):
+        if self.check is not None and self.check(data):
+            return None
+        return super().validate_schema(data, url)
+
+class CompiledParameterValidator(ParameterValidator):
+    '''Validates parameters with compiled checks of their schemas, with connexion's validator otherwise.'''
+
+    def __init__(self, parameters, api, strict_validation=False):
+        super().__init__(parameters, api, strict_validation=strict_validation)
+        self.checks = {id(parameter): compile_schema(parameter.get("schema", parameter)) if "schema" in parameter else None
+                       for parameter in parameters}
+
+    def validate_parameter(self, parameter_type, value, param, param_name=None):
+        check = self.checks.get(id(param))
+        if check is not None and value is not None and not (is_nullable(param) and is_null(value)):
+            try:
+                if check(coerce_type(param, value, parameter_type, param_name)):
+                    return None
+            except TypeValidationError:
+                pass # Reported by ParameterValidator
+        return ParameterValidator.validate_parameter(parameter_type, value, param, param_name)
+
+
+def traced_validator(validator, name):
+    '''validator with a span name around its validation of a request (ended before the operation runs).'''
+    from project.tracing import current_span, span
+
+    class TracedValidator(validator):
+        def __call__(self, function):
+            @functools.wraps(function)
+            def validated(request):
+                current = current_span()
+                if current is not None and current.name == name:
+                    current.end()
+                return function(request)
+
+            validate = super().__call__(validated)
+
+            @functools.wraps(validate)
+            def wrapper(request):
+                with span(name):
+                    return validate(request)
+            return wrapper
+
+    TracedValidator.__name__ = f"Traced{validator.__name__}"
+    return TracedValidator
+
+def traced_validators(validators=None):
+    '''validator_map (of validator_map()) with traced body and parameter validators.'''
+    validators = validators or {"body": RequestBodyValidator, "parameter": ParameterValidator}
+    return {**validators,
+            "body": traced_validator(validators["body"], "validate_body"),
+            "parameter": traced_validator(validators["parameter"], "validate_parameters")}
+
+def validator_map(mode, is_production=False):
+    '''validator_map of connexion's add_api() for an API_VALIDATION mode, None for connexion's validators.'''
+    if mode not in MODES:
+        raise ValueError(f"Unsupported API_VALIDATION {mode!r}, use one of {', '.join(MODES)}.")
+    if mode == "compiled" or (mode == "development" and is_production):
+        return {"body": CompiledRequestBodyValidator, "parameter": CompiledParameterValidator}
+    return None
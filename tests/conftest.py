@@ -1,4 +1,7 @@
 import pytest
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from project import create_app
 
 
@@ -8,7 +11,15 @@ def app_initialiser():
     app = create_app(test_setup=True)
 
     from project.models import Account, Transaction
-    from project.db import db_session
+    from project.db import db_session, init_db
+    db_session.remove() # Objects of earlier tests would be stale, their rows were deleted outside of the session
+    init_db()
+
+    from project.models import IdempotencyKey
+    from project.idempotency import recent_keys
+    IdempotencyKey.query.delete()
+    db_session.commit()
+    recent_keys.clear()
     num_before_setup = Transaction.query.count()
     try:
        Transaction.query.delete()
@@ -21,6 +32,9 @@ def app_initialiser():
 
     yield app, Account, Transaction, db_session
 
+    from project.accounts.purge import account_purger
+    account_purger.stop() # Account deletions of the test are finished before the next test cleans up
+
 def pytest_runtest_call(item):
     print(f"\n[{item.name}]")
 
@@ -59,3 +73,39 @@ def db_initialiser(app_initialiser):
     db_session.commit()
     print(f"DB initialiser. Num transactions: {Transaction.query.count()}")
     return Account, Transaction, db_session
+
+
+## Query budgets
+class QueryCounter:
+    """Records every SQL statement executed on any engine while active."""
+
+    def __init__(self):
+        self.statements = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event.remove(Engine, "before_cursor_execute", self._before_cursor_execute)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+@pytest.fixture()
+def query_budget(app_initialiser):
+    """Usage: `with query_budget(3): client.get(...)` fails the test if more than 3 statements run."""
+
+    @contextmanager
+    def budget(max_statements):
+        with QueryCounter() as counter:
+            yield counter
+        if counter.count > max_statements:
+            executed = "\n".join(f"  {statement}" for statement in counter.statements)
+            pytest.fail(f"Query budget exceeded: {counter.count} statements executed, budget is {max_statements}.\n{executed}")
+
+    return budget
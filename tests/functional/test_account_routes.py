@@ -80,9 +80,12 @@ def test_create_duplicate_iban(client_initialiser, db_initialiser, first_account
     # Create a third account
     response = client.post("/accounts/create", data={"title": "Duplicate2", "accept_terms": True}, follow_redirects=True)
 
-    # Verify that IBAN has been incremented
+    # Verify that the account number of the IBAN has been incremented and the check digits are valid
+    from project.accounts.ibans import is_valid_iban
+    second_account = Account.query.filter(Account.title=="Duplicate").first()
     third_account = Account.query.filter(Account.title=="Duplicate2").first()
-    assert third_account.iban.endswith("002")
+    assert int(third_account.iban[-10:]) == int(second_account.iban[-10:]) + 1
+    assert is_valid_iban(third_account.iban)
 
     # Verify 3 accounts exist in total
     assert Account.query.count() == 3
@@ -186,7 +189,9 @@ def test_delete_account_nonexistent_account(client_initialiser, two_accounts):
 
 def test_delete_account_last_account(client_initialiser, two_accounts, account_initialiser):
 
+    from project.accounts.purge import account_purger
     client_initialiser.post(f"/accounts/{two_accounts[0].id}/delete")
+    account_purger.stop() # Waits for the background purge
     assert account_initialiser.query.count() == 1
 
     response = client_initialiser.post(f"/accounts/{two_accounts[1].id}/delete", follow_redirects=True)
@@ -196,7 +201,9 @@ def test_delete_account_last_account(client_initialiser, two_accounts, account_i
 
 def test_successful_delete(client_initialiser, two_accounts, account_initialiser):
 
+    from project.accounts.purge import account_purger
     response = client_initialiser.post(f"/accounts/{two_accounts[0].id}/delete", follow_redirects=True)
+    account_purger.stop() # Waits for the background purge
     assert account_initialiser.query.count() == 1
 
     assert "Successfully deleted account." in response.data.decode()
@@ -218,7 +225,9 @@ def test_delete_account_associated_transactions(db_initialiser, client_initialis
     assert Transaction.query.count() == 2 and first_account.transactions.count() == 2
 
     # Delete account and ensure transactions are deleted
+    from project.accounts.purge import account_purger
     response = client_initialiser.post(f"/accounts/{first_account.id}/delete", follow_redirects=True)
+    account_purger.stop() # Waits for the background purge
     assert Account.query.count() == 1
 
     assert Transaction.query.count() == 0
@@ -275,9 +284,11 @@ def test_api_create_account_invalid_property(client_initialiser):
     assert "Additional properties are not allowed ('something' was unexpected)" in response.json["detail"]
 
 def test_api_create_accounts_success(client_initialiser, account_initialiser):
+    from project.accounts.ibans import is_valid_iban
     client = client_initialiser
     Account = account_initialiser
 
+    ibans = []
     for i in range(5):
         response = client.post("/api/accounts", json={"title": f"Test_{i}"})
 
@@ -286,10 +297,12 @@ def test_api_create_accounts_success(client_initialiser, account_initialiser):
         assert response.json['status'] == "success"
         assert response.json['detail'] == "Successfully created new account."
         assert response.json['title'] == f"Test_{i}"
-        assert response.json['iban'] == f"GB2900006016133192000{i}"
+        assert is_valid_iban(response.json['iban'])
         assert response.json['id'] == i+1
+        ibans.append(response.json['iban'])
 
     assert Account.query.count() == 5
+    assert [int(iban[-10:]) for iban in ibans] == list(range(int(ibans[0][-10:]), int(ibans[0][-10:]) + 5))
 
 def test_api_create_accounts_exceed_limit(client_initialiser, account_initialiser):
     client = client_initialiser
@@ -310,6 +323,66 @@ def test_api_create_accounts_exceed_limit(client_initialiser, account_initialise
     assert response.json['status'] == "error"
     assert response.json['detail'] == "Cannot add more than 5 accounts."
 
+def test_api_create_accounts_configurable_limit(client_initialiser, account_initialiser):
+    client = client_initialiser
+    Account = account_initialiser
+
+    client.application.config["ACCOUNT_LIMIT"] = 0 # No limit
+    for i in range(7):
+        assert client.post("/api/accounts", json={"title": f"Test_{i}"}).status_code == 201
+
+    client.application.config["ACCOUNT_LIMIT"] = 7
+    response = client.post("/api/accounts", json={"title": "Eighth"})
+    assert response.status_code == 400
+    assert response.json['detail'] == "Cannot add more than 7 accounts."
+    assert Account.query.count() == 7
+
+# search
+def test_api_search_accounts(client_initialiser, account_initialiser):
+    client = client_initialiser
+    for title in ["Savings", "Salary", "Holiday", "Sav"]:
+        assert client.post("/api/accounts", json={"title": title}).status_code == 201
+    holiday_iban = client.get("/api/accounts").json[2]["iban"]
+
+    response = client.get("/api/accounts/search?q=Sa")
+    assert response.status_code == 200
+    assert [account["title"] for account in response.json] == ["Salary", "Sav", "Savings"]
+
+    response = client.get("/api/accounts/search", query_string={"q": "Sav", "limit": 1})
+    assert [account["title"] for account in response.json] == ["Sav"]
+
+    # IBAN prefixes, also lowercase and with spaces
+    response = client.get("/api/accounts/search", query_string={"q": f"{holiday_iban[:4].lower()} {holiday_iban[4:]}"})
+    assert [account["title"] for account in response.json] == ["Holiday"]
+    assert set(response.json[0]) == {"id", "title", "iban"}
+
+    response = client.get("/api/accounts/search?q=sAV") # Titles are case-insensitive
+    assert [account["title"] for account in response.json] == ["Sav", "Savings"]
+    assert client.get("/api/accounts/search?q=").status_code == 400
+    assert client.get("/api/accounts/search?q=Sa&limit=100").status_code == 400
+
+# sparse fieldsets and compact lists
+def test_api_accounts_fields_and_compact(client_initialiser):
+    client = client_initialiser
+    created = client.post("/api/accounts?fields=id", json={"title": "Main"})
+    assert created.status_code == 201
+    assert created.json == {"status": "success", "detail": "Successfully created new account.", "id": created.json["id"]}
+    iban = client.post("/api/accounts", json={"title": "Savings"}).json["iban"]
+
+    response = client.get("/api/accounts?fields=title,id")
+    assert response.json == [{"title": "Main", "id": str(created.json["id"])}, {"title": "Savings", "id": str(created.json["id"] + 1)}]
+
+    response = client.get("/api/accounts?compact=true")
+    assert response.json["fields"] == ["id", "title", "iban"]
+    assert response.json["rows"][1] == [str(created.json["id"] + 1), "Savings", iban]
+
+    response = client.get("/api/accounts/search", query_string={"q": "Sav", "fields": "iban", "compact": "true"})
+    assert response.json == {"fields": ["iban"], "rows": [[iban]]}
+    assert client.get("/api/accounts/search", query_string={"q": "Zzz", "compact": "true"}).json == {"fields": ["id", "title", "iban"], "rows": []}
+
+    assert client.get("/api/accounts?fields=saldo").status_code == 400
+    assert client.get("/api/accounts?fields=").status_code == 400
+
 # delete
 def test_api_delete_account_success(client_initialiser, two_accounts):
     client = client_initialiser
@@ -346,9 +419,11 @@ def test_api_delete_nonexistent_account(client_initialiser):
 def test_api_delete_last_account(client_initialiser, two_accounts, account_initialiser):
 
     # Delete first account
+    from project.accounts.purge import account_purger
     response = client_initialiser.delete(f"/api/accounts/{two_accounts[0].id}")
     assert response.status_code == 200
 
+    account_purger.stop() # Waits for the background purge
     assert account_initialiser.query.limit(2).count() == 1
 
     # Attempt deleting last account
@@ -375,11 +450,45 @@ def test_api_delete_account_associated_transactions(db_initialiser, client_initi
     assert Transaction.query.count() == 2 and first_account.transactions.count() == 2
 
     # Delete account and ensure transactions are deleted
+    from project.accounts.purge import account_purger
     response = client_initialiser.delete(f"/api/accounts/{first_account.id}")
+    account_purger.stop() # Waits for the background purge
     assert Account.query.count() == 1
 
     assert Transaction.query.count() == 0
 
+
+def test_api_delete_account_does_not_wait_for_purge(db_initialiser, client_initialiser, two_accounts, monkeypatch):
+    Account, Transaction, db_session = db_initialiser
+    import threading
+    from project.accounts import purge
+    from project.models import AccountDeletion
+    from project.transactions.transactions import create_transaction
+
+    first_id, second_id = two_accounts[0].id, two_accounts[1].id
+    create_transaction(two_accounts[0], "Description", 100, "Rent")
+    started, released = threading.Event(), threading.Event()
+    purge_account_history = purge.purge_account_history
+    def blocked_purge(account_id, size=None):
+        started.set()
+        released.wait(timeout=10)
+        return purge_account_history(account_id, size)
+    monkeypatch.setattr(purge, "purge_account_history", blocked_purge)
+
+    # Answered while the purge is blocked, the account is gone for the app right away
+    response = client_initialiser.delete(f"/api/accounts/{first_id}")
+    assert response.status_code == 200
+    assert started.wait(timeout=10)
+    assert Transaction.query.count() == 1
+    assert [account["id"] for account in client_initialiser.get("/api/accounts").json] == [str(second_id)]
+    assert client_initialiser.get(f"/api/accounts/{first_id}").status_code == 404
+    assert client_initialiser.delete(f"/api/accounts/{second_id}").status_code == 400 # The last account
+
+    released.set()
+    purge.account_purger.stop()
+    assert Transaction.query.count() == 0
+    assert Account.query.count() == 1 and AccountDeletion.query.count() == 0
+
 # get
 def test_api_get_account_invalid_id(client_initialiser):
     client = client_initialiser
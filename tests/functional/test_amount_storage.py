@@ -0,0 +1,115 @@
+import pytest
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import text
+
+
+## Test fixtures
+@pytest.fixture()
+def cents_app(tmp_path, monkeypatch):
+    '''App storing amounts as BIGINT cents (AMOUNT_STORAGE=cents) in a fresh SQLite database.'''
+    from config import Config
+    from project import create_app
+    from project.db import init_db, configure_engine, db_session
+
+    default_url = Config.DATABASE_URL
+    monkeypatch.setattr(Config, "DATABASE_URL", f"sqlite:///{tmp_path / 'cents.db'}")
+    monkeypatch.setattr(Config, "AMOUNT_STORAGE", "cents")
+    db_session.remove()
+
+    app = create_app(test_setup=True)
+    with app.app_context():
+        init_db()
+
+    yield app
+
+    db_session.remove()
+    configure_engine(default_url)
+
+def stored(column, table="transactions"):
+    from project.db import get_engine
+    with get_engine().connect() as connection:
+        return connection.execute(text(f"SELECT {column} FROM {table} ORDER BY id")).scalars().all()
+
+
+## Cents
+def test_api_amounts_stored_as_cents(cents_app):
+    client = cents_app.test_client()
+    account_id = client.post('/api/accounts', json={"title": "Cents"}).json["id"]
+
+    saldos = []
+    for amount in (0.1, 0.2, -0.05):
+        response = client.post(f'/api/accounts/{account_id}/transactions', json={"description": "Coins", "amount": amount, "category": "Groceries"})
+        assert response.status_code == 201
+        saldos.append(response.json["saldo"])
+
+    assert saldos == [0.1, 0.3, 0.25]
+    assert stored("amount") == [10, 20, -5]
+    assert stored("saldo") == [10, 30, 25]
+
+def test_saldo_shift_in_cents(cents_app):
+    from project.db import db_session
+    from project.models import Account, Transaction
+    from project.transactions.transactions import update_transaction
+
+    client = cents_app.test_client()
+    account_id = int(client.post('/api/accounts', json={"title": "Cents"}).json["id"])
+    ids = [client.post(f'/api/accounts/{account_id}/transactions', json={"description": "Rent", "amount": amount, "category": "Rent",
+                                                                           "utc_datetime_booked": f"2023-09-0{day}T12:00:00+00:00"}).json["transaction_id"]
+           for day, amount in [(1, 10.5), (2, 20.25)]]
+
+    assert update_transaction(db_session.get(Transaction, ids[0]), amount=0.75)[0] == "success"
+    assert stored("saldo") == [75, 2100]
+    assert [transaction.saldo for transaction in Transaction.read_all(account_id=account_id)] == [Decimal("21.00"), Decimal("0.75")]
+    assert Transaction.latest_saldos() == {account_id: Decimal("21.00")}
+
+def test_seed_in_cents(cents_app):
+    from project.db import get_engine
+    from project.models import Transaction
+    from project.queries import saldo_before
+    from project.seed import seed_database
+
+    account_ids = seed_database(get_engine(), num_accounts=2, num_transactions=200, seed=1)
+    assert all(isinstance(amount, int) for amount in stored("amount"))
+    latest = Transaction.read_all(account_id=account_ids[0])[0]
+    assert saldo_before(account_ids[0], latest.utc_datetime_booked) + latest.amount == latest.saldo
+
+
+## Migration
+def test_convert_amounts(tmp_path, monkeypatch):
+    '''Amounts booked in decimal storage read the same after converting the database to cents and back.'''
+    from config import Config
+    from project import create_app
+    from project.db import init_db, configure_engine, db_session
+    from project.money import convert_amounts
+    from project.models import Transaction
+
+    default_url = Config.DATABASE_URL
+    monkeypatch.setattr(Config, "DATABASE_URL", f"sqlite:///{tmp_path / 'converted.db'}")
+    try:
+        client = create_app(test_setup=True).test_client()
+        init_db()
+        account_id = int(client.post('/api/accounts', json={"title": "Converted"}).json["id"])
+        for amount in (12.34, -0.99):
+            client.post(f'/api/accounts/{account_id}/transactions', json={"description": "Groceries", "amount": amount, "category": "Groceries"})
+        before = [(transaction.amount, transaction.saldo) for transaction in Transaction.read_all(account_id=account_id)]
+        db_session.remove()
+
+        assert convert_amounts("cents") == 5 # amount and saldo of transactions and archived_transactions, amount of transfer_outbox
+        assert convert_amounts("cents") == 0 # Already in cents
+        monkeypatch.setattr(Config, "AMOUNT_STORAGE", "cents")
+        create_app(test_setup=True)
+        assert convert_amounts("cents") == 0
+        assert stored("amount") == [1234, -99]
+        assert [(transaction.amount, transaction.saldo) for transaction in Transaction.read_all(account_id=account_id)] == before
+        db_session.remove()
+
+        assert convert_amounts("decimal") == 5
+        assert convert_amounts("decimal") == 0
+        monkeypatch.setattr(Config, "AMOUNT_STORAGE", "decimal")
+        create_app(test_setup=True)
+        assert stored("amount") == [12.34, -0.99]
+        assert [(transaction.amount, transaction.saldo) for transaction in Transaction.read_all(account_id=account_id)] == before
+    finally:
+        db_session.remove()
+        configure_engine(default_url)
@@ -0,0 +1,69 @@
+import pytest
+
+REQUESTS = [
+    ("post", "/api/accounts", {"title": "ab"}),
+    ("post", "/api/accounts", {"title": "Test", "iban": "GB"}),
+    ("post", "/api/accounts/{account_id}/transactions", {"description": "A" * 81, "amount": 5, "category": "Rent"}),
+    ("post", "/api/accounts/{account_id}/transactions", {"description": "Rent", "amount": 0, "category": "Rent"}),
+    ("post", "/api/accounts/{account_id}/transactions", {"description": "Rent", "amount": 5, "category": "Holiday"}),
+    ("post", "/api/accounts/{account_id}/transactions?fields=iban", {"description": "Rent", "amount": 5, "category": "Rent"}),
+    ("post", "/api/accounts/{account_id}/transactions", {"description": "Rent", "amount": 5, "category": "Rent"}),
+    ("get", "/api/accounts/search?q=Ma&limit=100", None),
+    ("get", "/api/accounts/search?q=Ma&limit=abc", None),
+    ("get", "/api/accounts/search?q=Ma&limit=2&compact=true", None),
+    ("get", "/api/accounts/{account_id}?fields=title,id", None),
+]
+
+## Test fixtures
+@pytest.fixture()
+def api_responses(client_initialiser):
+    def responses(mode):
+        client = client_initialiser
+        client.application.config["API_VALIDATION"] = mode # Before the first API request builds the API app
+        account_id = client.post("/api/accounts", json={"title": "Main"}).json["id"]
+        results = []
+        for method, url, body in REQUESTS:
+            response = getattr(client, method)(url.format(account_id=account_id), json=body)
+            json = dict(response.json) if isinstance(response.json, dict) else response.json
+            if isinstance(json, dict):
+                json.pop("transaction_id", None)
+                json.pop("utc_datetime_booked", None)
+                json.pop("account_id", None)
+            results.append((response.status_code, json))
+        return results
+    return responses
+
+
+## Validation modes
+@pytest.mark.parametrize("mode", ["full", "compiled", "development"])
+def test_validation_modes_respond_alike(api_responses, mode):
+    expected = [
+        (400, "is too short - 'title'"), (400, "('iban' was unexpected)"),
+        (400, "is too long - 'description'"), (400, "should not be valid under"), (400, "is not one of"), (400, "is not one of"),
+        (201, None), (400, "is greater than the maximum of 50"), (400, "Wrong type"), (200, None), (200, None),
+    ]
+    results = api_responses(mode)
+    assert [status for status, _ in results] == [status for status, _ in expected]
+    for (_, json), (_, detail) in zip(results, expected):
+        if detail:
+            assert detail in json["detail"]
+    assert results[-2][1] == {"fields": ["id", "title", "iban"], "rows": [[results[-1][1][0]["id"], "Main", results[-2][1]["rows"][0][2]]]}
+    assert results[-1][1] == [{"title": "Main", "id": results[-1][1][0]["id"]}]
+
+def test_development_validation_rejects_malformed_requests_in_production(client_initialiser):
+    client = client_initialiser
+    client.application.config.update({"API_VALIDATION": "development", "IS_PROD": "True"})
+    account_id = client.post("/api/accounts", json={"title": "Main"}).json["id"]
+    recipient_id = client.post("/api/accounts", json={"title": "Savings"}).json["id"]
+
+    malformed = [
+        ("post", f"/api/accounts/{account_id}/transactions", {"description": "Rent", "amount": 5, "category": "Holiday"}),
+        ("post", f"/api/accounts/{account_id}/transactions", [{"description": "Rent", "amount": 5, "category": "Rent"}]),
+        ("post", f"/api/accounts/{account_id}/subaccount_transfer", {"description": "Rent", "amount": "abc", "recipient_account_id": recipient_id}),
+        ("get", "/api/accounts/search?q=", None),
+        ("post", "/api/batch", {"atomic": True}),
+        ("post", "/api/batch", {"operations": [{"operation_id": "project.accounts.api.api_get_all_accounts"}] * 101}),
+    ]
+    for method, url, body in malformed:
+        response = getattr(client, method)(url, json=body)
+        assert response.status_code == 400, (url, body, response.json)
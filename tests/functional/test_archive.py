@@ -0,0 +1,216 @@
+import pytest
+import pytz
+from datetime import datetime, timedelta
+from sqlalchemy import text
+
+ARCHIVE_AFTER_DAYS = 365
+
+
+## Test fixtures
+@pytest.fixture()
+def archive_app(app_initialiser, monkeypatch):
+    from config import Config
+    app, Account, Transaction, db_session = app_initialiser
+    from project.archive import forget_archive_boundaries
+    from project.models import ArchivedTransaction, ArchiveBoundary
+
+    monkeypatch.setattr(Config, "TRANSACTION_ARCHIVE_AFTER_DAYS", ARCHIVE_AFTER_DAYS, raising=False)
+    app.config["TRANSACTION_ARCHIVE_AFTER_DAYS"] = ARCHIVE_AFTER_DAYS
+    ArchivedTransaction.query.delete()
+    ArchiveBoundary.query.delete()
+    Account.query.delete()
+    db_session.commit()
+    forget_archive_boundaries()
+
+    yield app
+
+    db_session.rollback()
+    ArchivedTransaction.query.delete()
+    ArchiveBoundary.query.delete()
+    db_session.commit()
+    forget_archive_boundaries()
+
+@pytest.fixture()
+def account_with_history(archive_app):
+    '''Account with two transactions before the archive horizon and two after it.'''
+    from project.db import db_session
+    from project.models import Account
+    from project.transactions.transactions import create_transaction
+
+    account = Account(title="Archived", iban="GB29000060161331920003")
+    db_session.add(account)
+    db_session.commit()
+    now = datetime.utcnow()
+    for description, amount, days_ago in [("Old salary", 1000, 500), ("Old rent", -400, 420), ("Recent rent", -400, 60), ("Groceries", -50, 10)]:
+        status, message, _ = create_transaction(account, description, amount, "Groceries", (now - timedelta(days=days_ago)).replace(tzinfo=pytz.UTC))
+        assert status == "success", message
+    return account
+
+def days_ago(days):
+    return (datetime.utcnow() - timedelta(days=days)).date()
+
+
+## Archival
+def test_archive_books_opening_balance(account_with_history):
+    from project.archive import archive_horizon, archive_transactions
+    from project.models import Transaction, ArchivedTransaction, OPENING_BALANCE_CATEGORY
+    from project.transactions.transactions import create_transaction
+
+    assert archive_transactions(archive_horizon()) == 2
+    assert sorted(t.description for t in ArchivedTransaction.query.all()) == ["Old rent", "Old salary"]
+
+    opening_balance = Transaction.query.filter(Transaction.category == OPENING_BALANCE_CATEGORY).one()
+    assert (opening_balance.amount, opening_balance.saldo) == (600, 600)
+    assert opening_balance.utc_datetime_booked < archive_horizon()
+    assert Transaction.query.count() == 3
+
+    # New saldos still include the archived amounts
+    _, _, transaction_id = create_transaction(account_with_history, "New", 25, "Groceries")
+    assert Transaction.query.get(transaction_id).saldo == 175
+    assert Transaction.latest_saldos()[account_with_history.id] == 175
+
+def test_booking_before_boundary_is_rejected(archive_app, account_with_history):
+    from project.archive import archive_horizon, archive_transactions
+    from project.models import Transaction
+    from project.transactions.transactions import create_transaction
+
+    archive_transactions(archive_horizon())
+    status, message, _ = create_transaction(account_with_history, "Late", 10, "Groceries", (datetime.utcnow() - timedelta(days=400)).replace(tzinfo=pytz.UTC))
+    assert status == "error" and "archived" in message
+    assert Transaction.query.count() == 3
+
+    response = archive_app.test_client().post(f"/api/accounts/{account_with_history.id}/transactions", json={
+        "description": "Late", "amount": 10, "category": "Groceries",
+        "utc_datetime_booked": (datetime.utcnow() - timedelta(days=400)).strftime("%Y-%m-%dT%H:%M:%S+00:00")})
+    assert response.status_code == 400 and "archived" in response.json["detail"]
+
+    # After the boundary bookings are fine
+    status, _, transaction_id = create_transaction(account_with_history, "Recent", 10, "Groceries", (datetime.utcnow() - timedelta(days=300)).replace(tzinfo=pytz.UTC))
+    assert status == "success" and Transaction.query.get(transaction_id).saldo == 610
+
+def test_archive_again_folds_opening_balance(account_with_history):
+    from project.archive import archive_transactions
+    from project.models import Transaction, ArchivedTransaction, OPENING_BALANCE_CATEGORY
+
+    archive_transactions(datetime.utcnow() - timedelta(days=400))
+    archive_transactions(datetime.utcnow() - timedelta(days=30))
+
+    opening_balance = Transaction.query.filter(Transaction.category == OPENING_BALANCE_CATEGORY).one()
+    assert (opening_balance.amount, opening_balance.saldo) == (200, 200)
+    assert [t.description for t in Transaction.query.all()] == ["Groceries", opening_balance.description]
+    assert ArchivedTransaction.query.filter(ArchivedTransaction.category == OPENING_BALANCE_CATEGORY).count() == 1
+    assert ArchivedTransaction.query.count() == 4
+
+def test_archive_nothing_to_archive(account_with_history):
+    from project.archive import archive_transactions
+    from project.models import Transaction
+
+    assert archive_transactions(datetime.utcnow() - timedelta(days=1000)) == 0
+    assert Transaction.query.count() == 4
+
+
+## Reads
+def test_read_all_reads_archive_for_old_date_ranges(account_with_history):
+    from project.archive import archive_horizon, archive_transactions
+    from project.models import Transaction
+
+    before = [(t.id, t.description, t.saldo) for t in Transaction.read_all(account_id=account_with_history.id, start_date=days_ago(1000))]
+    archive_transactions(archive_horizon())
+
+    # Without date filter (or a recent one) only the live table is read, the opening balance stands for the archive
+    assert [t.description for t in Transaction.read_all(account_id=account_with_history.id)] == [
+        "Groceries", "Recent rent", "Opening balance (archived transactions)"]
+    assert [t.description for t in Transaction.read_all(account_id=account_with_history.id, start_date=days_ago(90))] == ["Groceries", "Recent rent"]
+
+    # Date filters reaching back before the horizon return the archived transactions instead of the opening balance
+    assert [(t.id, t.description, t.saldo) for t in Transaction.read_all(account_id=account_with_history.id, start_date=days_ago(1000))] == before
+    assert [t.description for t in Transaction.read_all(account_id=account_with_history.id, end_date=days_ago(450))] == ["Old salary"]
+    assert [t.description for t in Transaction.read_all(account_id=account_with_history.id, start_date=days_ago(1000), transaction_description="rent")] == ["Recent rent", "Old rent"]
+    assert [(t.id, t.description, t.saldo) for t in Transaction.read_all(account_id=account_with_history.id, start_date=days_ago(1000), as_rows=True)] == before
+
+def test_read_all_uses_recorded_boundary(archive_app, account_with_history, monkeypatch):
+    from config import Config
+    from project.archive import archive_horizon, archive_transactions, archived_before
+    from project.models import Transaction
+
+    archive_transactions(archive_horizon())
+    assert archived_before(account_with_history.id) == archive_horizon()
+
+    # Archival disabled (or its horizon moved back) after the run: archived transactions are still listed
+    monkeypatch.setattr(Config, "TRANSACTION_ARCHIVE_AFTER_DAYS", None)
+    archive_app.config["TRANSACTION_ARCHIVE_AFTER_DAYS"] = None
+    assert [t.description for t in Transaction.read_all(account_id=account_with_history.id, start_date=days_ago(1000))] == [
+        "Groceries", "Recent rent", "Old rent", "Old salary"]
+
+def test_group_by_month_ignores_opening_balance(account_with_history):
+    from project.archive import archive_horizon, archive_transactions
+    from project.models import Transaction
+
+    archive_transactions(archive_horizon())
+    months = Transaction.group_by_month(Transaction.read_all(account_id=account_with_history.id))
+    assert sum(month["total"] for year in months.values() for month in year.values()) == -450
+
+def test_archived_transactions_have_no_edit_buttons(archive_app, account_with_history):
+    from project.archive import archive_horizon, archive_transactions
+    from project.models import ArchivedTransaction, Transaction
+
+    archive_transactions(archive_horizon())
+    page = archive_app.test_client().post(f"/accounts/{account_with_history.id}", data={
+        "start_date": days_ago(1000).isoformat(), "search_type": "Includes", "category": "-Category-", "submit": True}).data.decode()
+    assert "Old salary" in page and "Recent rent" in page
+    for transaction in ArchivedTransaction.query.all():
+        assert f"/transactions/{transaction.id}/update" not in page
+    for transaction in Transaction.query.filter(Transaction.description == "Recent rent"):
+        assert f"/transactions/{transaction.id}/update" in page
+
+def test_download_csv_includes_archive(archive_app, account_with_history):
+    from project.archive import archive_horizon, archive_transactions
+
+    archive_transactions(archive_horizon())
+    response = archive_app.test_client().post("/download_csv", data={
+        "account_id": account_with_history.id,
+        "start_date": days_ago(1000).isoformat(),
+        "end_date": "None",
+        "transaction_description": "None",
+        "search_type": "None"
+    })
+    csv = response.get_data(as_text=True)
+    assert "Old salary" in csv and "Groceries" in csv
+    assert "Opening balance" not in csv
+
+
+## Partitions
+def test_archive_drops_archived_partitions(tmp_path, monkeypatch):
+    from config import Config
+    from project import create_app
+    from project.archive import archive_transactions
+    from project.db import init_db, configure_engine, db_session, get_engine
+    from project.models import Account, Transaction
+    from project.partitioning import forget_known_partitions, sqlite_partitions
+    from project.sharding import transaction_ids
+    from project.transactions.transactions import create_transaction
+
+    default_url = Config.DATABASE_URL
+    monkeypatch.setattr(Config, "DATABASE_URL", f"sqlite:///{tmp_path / 'archive.db'}")
+    monkeypatch.setattr(Config, "TRANSACTION_PARTITIONING", "monthly")
+    try:
+        create_app(test_setup=True)
+        init_db()
+        account = Account(title="Partitioned", iban="GB29000060161331920004")
+        db_session.add(account)
+        db_session.commit()
+        for month in (1, 2, 3):
+            create_transaction(account, f"Month {month}", 100, "Salary", datetime(2023, month, 5, tzinfo=pytz.UTC))
+
+        assert archive_transactions(datetime(2023, 3, 1)) == 2
+        with get_engine().connect() as connection:
+            partitions = sqlite_partitions(connection)
+        assert "transactions_p202301" not in partitions
+        assert "transactions_p202302" in partitions # Holds the opening balance
+        assert [(t.description, t.saldo) for t in Transaction.read_all(account_id=account.id)] == [
+            ("Month 3", 300), ("Opening balance (archived transactions)", 200)]
+    finally:
+        db_session.remove()
+        configure_engine(default_url)
+        transaction_ids.reset()
+        forget_known_partitions()
@@ -0,0 +1,94 @@
+import pytest
+
+CREATE_TRANSACTION = "project.transactions.api.api_create_transaction"
+GET_ACCOUNT = "project.accounts.api.api_get_one_account"
+
+
+## Test fixtures
+@pytest.fixture()
+def batch_account(client_initialiser):
+    response = client_initialiser.post('/api/accounts', json={"title": "Batch"})
+    assert response.status_code == 201
+    return response.json["id"]
+
+def booking(account_id, amount, description="Groceries"):
+    return {"operation_id": CREATE_TRANSACTION, "parameters": {"account_id": account_id},
+            "body": {"description": description, "amount": amount, "category": "Groceries"}}
+
+def account_transactions(account_id):
+    from project.db import db_session
+    from project.models import Transaction
+    db_session.expire_all()
+    return [(transaction.description, transaction.saldo) for transaction in Transaction.query.filter_by(account_id=account_id).order_by(Transaction.id)]
+
+
+## Batches
+def test_batch_results_in_order(client_initialiser, batch_account):
+    response = client_initialiser.post('/api/batch', json={"operations": [
+        {"operation_id": GET_ACCOUNT, "parameters": {"account_id": batch_account}},
+        booking(batch_account, 10, "First"),
+        booking(batch_account, 0), # Rejected by the request validation of the operation
+        booking(batch_account, 5, "Second"),
+        {"operation_id": "project.accounts.api.api_search_accounts", "parameters": {"q": "Bat"}},
+    ]})
+    assert response.status_code == 200
+    results = response.json["results"]
+    assert [result["status_code"] for result in results] == [200, 201, 400, 201, 200]
+    assert results[0]["body"][0]["title"] == "Batch"
+    assert results[3]["body"]["saldo"] == 15
+    assert [account["title"] for account in results[4]["body"]] == ["Batch"]
+    assert account_transactions(batch_account) == [("First", 10), ("Second", 15)]
+
+def test_batch_unknown_operation(client_initialiser, batch_account):
+    response = client_initialiser.post('/api/batch', json={"operations": [booking(batch_account, 10), {"operation_id": "project.batch.api_batch"}]})
+    assert response.status_code == 400
+    assert response.json["detail"] == "Unknown operation project.batch.api_batch."
+
+    response = client_initialiser.post('/api/batch', json={"operations": [{"operation_id": GET_ACCOUNT, "parameters": {"id": 1}}]})
+    assert response.status_code == 400
+    assert account_transactions(batch_account) == []
+
+def test_atomic_batch_committed(client_initialiser, batch_account):
+    response = client_initialiser.post('/api/batch', json={"atomic": True, "operations": [booking(batch_account, 10, "First"), booking(batch_account, -4, "Second")]})
+    assert response.status_code == 200
+    assert [result["status_code"] for result in response.json["results"]] == [201, 201]
+    assert account_transactions(batch_account) == [("First", 10), ("Second", 6)]
+
+def test_atomic_batch_rolled_back(client_initialiser, batch_account):
+    response = client_initialiser.post('/api/batch', json={"atomic": True, "operations": [
+        booking(batch_account, 10, "First"),
+        {"operation_id": GET_ACCOUNT, "parameters": {"account_id": 999999}},
+        booking(batch_account, 5, "Never booked"),
+    ]})
+    assert response.status_code == 400
+    assert response.json["detail"] == "Operation 1 failed, no operation was applied."
+    assert [result["status_code"] for result in response.json["results"]] == [201, 404]
+    assert account_transactions(batch_account) == []
+
+    # The session works normally afterwards
+    assert client_initialiser.post(f'/api/accounts/{batch_account}/transactions', json=booking(batch_account, 1)["body"]).status_code == 201
+
+def test_atomic_batch_rolled_back_idempotency_key_not_replayed(client_initialiser, batch_account):
+    operation = booking(batch_account, 10, "First")
+    operation["parameters"]["Idempotency-Key"] = "k"
+    response = client_initialiser.post('/api/batch', json={"atomic": True, "operations": [
+        operation,
+        {"operation_id": GET_ACCOUNT, "parameters": {"account_id": 999999}},
+    ]})
+    assert response.status_code == 400
+    assert account_transactions(batch_account) == []
+
+    # The key was rolled back with the booking, the retry books it
+    response = client_initialiser.post(f'/api/accounts/{batch_account}/transactions', json=operation["body"], headers={"Idempotency-Key": "k"})
+    assert response.status_code == 201
+    assert "Idempotent-Replayed" not in response.headers
+    assert account_transactions(batch_account) == [("First", 10)]
+
+def test_atomic_batch_rejects_account_writes(client_initialiser, batch_account):
+    response = client_initialiser.post('/api/batch', json={"atomic": True, "operations": [
+        booking(batch_account, 10),
+        {"operation_id": "project.accounts.api.api_create_account", "body": {"title": "Second"}},
+    ]})
+    assert response.status_code == 400
+    assert response.json["detail"] == "Operation project.accounts.api.api_create_account cannot run in an atomic batch."
+    assert account_transactions(batch_account) == []
@@ -0,0 +1,174 @@
+import pytest
+from datetime import datetime, timedelta
+
+
+## Test fixtures
+@pytest.fixture()
+def first_account(db_initialiser, client_initialiser):
+    Account, Transaction, db_session = db_initialiser
+
+    client = client_initialiser
+    client.post("/accounts/create", data={"title": "John's Savings", "accept_terms": True}, follow_redirects=True)
+    account = Account.query.filter(Account.title == "John's Savings").first()
+    assert account.title == "John's Savings"
+    return account
+
+@pytest.fixture()
+def second_account(db_initialiser, client_initialiser):
+    Account, Transaction, db_session = db_initialiser
+
+    client = client_initialiser
+    client.post("/accounts/create", data={"title": "John's Savings2", "accept_terms": True}, follow_redirects=True)
+    account = Account.query.filter(Account.title == "John's Savings2").first()
+    assert account.title == "John's Savings2"
+    return account
+
+TRANSACTION = {"description": "Groceries Aldi", "amount": -42.5, "category": "Groceries"}
+
+
+## Transactions
+def test_api_create_transaction_replay(first_account, client_initialiser, db_initialiser, query_budget):
+    client = client_initialiser
+    _, Transaction, _ = db_initialiser
+
+    url = f'/api/accounts/{first_account.id}/transactions'
+    response = client.post(url, json=TRANSACTION, headers={"Idempotency-Key": "key-1"})
+    assert response.status_code == 201
+    assert "Idempotent-Replayed" not in response.headers
+
+    # The replay is served from the cache of recent keys without touching the database
+    with query_budget(0):
+        replay = client.post(url, json=TRANSACTION, headers={"Idempotency-Key": "key-1"})
+    assert replay.status_code == 201
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.json == response.json
+    assert Transaction.query.count() == 1
+
+def test_api_create_transaction_replay_from_database(first_account, client_initialiser, db_initialiser):
+    from project.idempotency import recent_keys
+    client = client_initialiser
+    _, Transaction, _ = db_initialiser
+
+    response = client.post(f'/api/accounts/{first_account.id}/transactions', json=TRANSACTION, headers={"Idempotency-Key": "key-1"})
+    recent_keys.clear() # e.g. a retry handled by another worker
+
+    replay = client.post(f'/api/accounts/{first_account.id}/transactions', json=TRANSACTION, headers={"Idempotency-Key": "key-1"})
+    assert replay.status_code == 201
+    assert replay.json == response.json
+    assert Transaction.query.count() == 1
+
+def test_api_create_transaction_without_key_not_deduplicated(first_account, client_initialiser, db_initialiser):
+    client = client_initialiser
+    _, Transaction, _ = db_initialiser
+
+    for _ in range(2):
+        response = client.post(f'/api/accounts/{first_account.id}/transactions', json=TRANSACTION)
+        assert response.status_code == 201
+    assert Transaction.query.count() == 2
+
+def test_api_create_transaction_different_keys(first_account, client_initialiser, db_initialiser):
+    client = client_initialiser
+    _, Transaction, _ = db_initialiser
+
+    first = client.post(f'/api/accounts/{first_account.id}/transactions', json=TRANSACTION, headers={"Idempotency-Key": "key-1"})
+    second = client.post(f'/api/accounts/{first_account.id}/transactions', json=TRANSACTION, headers={"Idempotency-Key": "key-2"})
+    assert first.json["transaction_id"] != second.json["transaction_id"]
+    assert second.json["saldo"] == -85
+    assert Transaction.query.count() == 2
+
+def test_api_create_transaction_key_reused_for_different_request(first_account, client_initialiser, db_initialiser):
+    client = client_initialiser
+    _, Transaction, _ = db_initialiser
+
+    client.post(f'/api/accounts/{first_account.id}/transactions', json=TRANSACTION, headers={"Idempotency-Key": "key-1"})
+    response = client.post(f'/api/accounts/{first_account.id}/transactions', json={**TRANSACTION, "amount": 10}, headers={"Idempotency-Key": "key-1"})
+    assert response.status_code == 422
+    assert response.json["detail"] == "The Idempotency-Key was already used for a different request."
+    assert Transaction.query.count() == 1
+
+def test_api_create_transaction_key_in_progress(first_account, client_initialiser, db_initialiser):
+    from project.models import IdempotencyKey
+    from project.idempotency import request_fingerprint
+    client = client_initialiser
+    _, Transaction, db_session = db_initialiser
+
+    # Simulate a request with the same key that is still being processed by another worker
+    with client.application.test_request_context(f'/api/accounts/{first_account.id}/transactions', method="POST", json=TRANSACTION):
+        fingerprint = request_fingerprint()
+    db_session.add(IdempotencyKey(key="key-1", request_fingerprint=fingerprint, utc_datetime_created=datetime.utcnow()))
+    db_session.commit()
+
+    response = client.post(f'/api/accounts/{first_account.id}/transactions', json=TRANSACTION, headers={"Idempotency-Key": "key-1"})
+    assert response.status_code == 409
+    assert Transaction.query.count() == 0
+
+def test_api_create_transaction_stale_reservation_taken_over(first_account, client_initialiser, db_initialiser):
+    from project.models import IdempotencyKey
+    client = client_initialiser
+    _, Transaction, db_session = db_initialiser
+
+    # Reserved by a request whose worker crashed before it stored a response
+    db_session.add(IdempotencyKey(key="key-1", request_fingerprint="crashed", utc_datetime_created=datetime.utcnow() - timedelta(seconds=61)))
+    db_session.commit()
+
+    response = client.post(f'/api/accounts/{first_account.id}/transactions', json=TRANSACTION, headers={"Idempotency-Key": "key-1"})
+    assert response.status_code == 201
+    assert "Idempotent-Replayed" not in response.headers
+
+    response = client.post(f'/api/accounts/{first_account.id}/transactions', json=TRANSACTION, headers={"Idempotency-Key": "key-1"})
+    assert response.status_code == 201
+    assert response.headers["Idempotent-Replayed"] == "true"
+    assert Transaction.query.count() == 1
+
+def test_api_create_transaction_expired_key(first_account, client_initialiser, db_initialiser):
+    from project.models import IdempotencyKey
+    from project.idempotency import recent_keys
+    client = client_initialiser
+    _, Transaction, db_session = db_initialiser
+
+    client.post(f'/api/accounts/{first_account.id}/transactions', json=TRANSACTION, headers={"Idempotency-Key": "key-1"})
+    recent_keys.clear()
+    stored = IdempotencyKey.query.get("key-1")
+    stored.utc_datetime_created = datetime.utcnow() - timedelta(days=2)
+    db_session.commit()
+
+    response = client.post(f'/api/accounts/{first_account.id}/transactions', json=TRANSACTION, headers={"Idempotency-Key": "key-1"})
+    assert response.status_code == 201
+    assert "Idempotent-Replayed" not in response.headers
+    assert Transaction.query.count() == 2
+
+def test_api_create_transaction_error_response_replayed(client_initialiser, db_initialiser):
+    client = client_initialiser
+
+    response = client.post('/api/accounts/99/transactions', json=TRANSACTION, headers={"Idempotency-Key": "key-1"})
+    assert response.status_code == 400
+
+    replay = client.post('/api/accounts/99/transactions', json=TRANSACTION, headers={"Idempotency-Key": "key-1"})
+    assert replay.status_code == 400
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.json == response.json
+
+
+## Subaccount transfers
+def test_api_create_sub_transfer_replay(first_account, second_account, client_initialiser, db_initialiser):
+    client = client_initialiser
+    _, Transaction, _ = db_initialiser
+    transfer = {"description": "Savings August", "amount": 123, "recipient_account_id": second_account.id}
+
+    response = client.post(f'/api/accounts/{first_account.id}/subaccount_transfer', json=transfer, headers={"Idempotency-Key": "transfer-1"})
+    assert response.status_code == 201
+
+    replay = client.post(f'/api/accounts/{first_account.id}/subaccount_transfer', json=transfer, headers={"Idempotency-Key": "transfer-1"})
+    assert replay.status_code == 201
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.json == response.json
+    assert Transaction.query.count() == 2
+
+def test_api_key_scoped_to_endpoint(first_account, second_account, client_initialiser, db_initialiser):
+    client = client_initialiser
+
+    client.post(f'/api/accounts/{first_account.id}/transactions', json=TRANSACTION, headers={"Idempotency-Key": "key-1"})
+    response = client.post(f'/api/accounts/{first_account.id}/subaccount_transfer',
+                           json={"description": "Savings August", "amount": 123, "recipient_account_id": second_account.id},
+                           headers={"Idempotency-Key": "key-1"})
+    assert response.status_code == 422
@@ -0,0 +1,227 @@
+import os
+import warnings
+import pytest
+import pytz
+from datetime import datetime, date
+from sqlalchemy import text
+from sqlalchemy.exc import SAWarning
+
+
+## Test fixtures
+@pytest.fixture()
+def partitioned_app(tmp_path, monkeypatch):
+    '''
+    App with monthly partitioned transactions in a fresh SQLite database.
+    Set TEST_PARTITIONED_DATABASE_URL to use another (empty) database, e.g. Postgres.
+    '''
+    from config import Config
+    from project import create_app
+    from project.db import init_db, configure_engine, db_session
+    from project.partitioning import forget_known_partitions
+    from project.sharding import transaction_ids
+
+    default_url = Config.DATABASE_URL
+    monkeypatch.setattr(Config, "DATABASE_URL", os.getenv("TEST_PARTITIONED_DATABASE_URL", f"sqlite:///{tmp_path / 'partitioned.db'}"))
+    monkeypatch.setattr(Config, "TRANSACTION_PARTITIONING", "monthly")
+    db_session.remove()
+    transaction_ids.reset()
+    forget_known_partitions()
+
+    app = create_app(test_setup=True)
+    with app.app_context():
+        init_db()
+
+    yield app
+
+    db_session.remove()
+    configure_engine(default_url)
+    transaction_ids.reset()
+    forget_known_partitions()
+
+@pytest.fixture()
+def partitioned_account(partitioned_app):
+    from project.db import db_session
+    from project.models import Account
+
+    account = Account(title="Partitioned", iban="GB29000060161331920001")
+    db_session.add(account)
+    db_session.commit()
+    return account
+
+def book(account, description, amount, utc_datetime_booked):
+    from project.transactions.transactions import create_transaction
+    status, message, transaction_id = create_transaction(account, description, amount, "Groceries", utc_datetime_booked.replace(tzinfo=pytz.UTC))
+    assert status == "success", message
+    return transaction_id
+
+def partition_rows(name):
+    from project.db import get_engine
+    with get_engine().connect() as connection:
+        return connection.execute(text(f"SELECT description FROM {name} ORDER BY id")).scalars().all()
+
+def sqlite_only(app):
+    if not app.config["DATABASE_URL"].startswith("sqlite"):
+        pytest.skip("Checks the SQLite month tables")
+
+
+## Partition creation
+def test_init_creates_upcoming_partitions(partitioned_app):
+    from project.db import get_engine
+    from project.partitioning import sqlite_partitions, partition_name, upcoming_months
+    sqlite_only(partitioned_app)
+
+    with get_engine().connect() as connection:
+        assert sqlite_partitions(connection) == [partition_name(month) for month in upcoming_months(3)]
+        assert connection.execute(text("SELECT type FROM sqlite_master WHERE name = 'transactions'")).scalar() == "view"
+
+def test_transactions_stored_in_booking_month_partition(partitioned_account):
+    from project.models import Transaction
+
+    ids = [book(partitioned_account, "August", 100, datetime(2023, 8, 31, 23, 59)),
+           book(partitioned_account, "September", -30, datetime(2023, 9, 1, 0, 0)),
+           book(partitioned_account, "Late August", 5, datetime(2023, 8, 15, 12, 0))]
+
+    assert len(set(ids)) == 3
+    assert partition_rows("transactions_p202308") == ["August", "Late August"]
+    assert partition_rows("transactions_p202309") == ["September"]
+    # Saldos span partitions
+    assert [(t.description, t.saldo) for t in Transaction.read_all(account_id=partitioned_account.id)] == [
+        ("September", 70), ("August", 100), ("Late August", 5)]
+
+def test_rebooking_moves_transaction_to_other_partition(partitioned_account):
+    from project.db import db_session
+    from project.models import Transaction
+
+    transaction_id = book(partitioned_account, "Moved", 10, datetime(2023, 8, 10))
+    transaction = db_session.get(Transaction, transaction_id)
+    transaction.utc_datetime_booked = datetime(2023, 10, 10, tzinfo=pytz.UTC)
+    db_session.commit()
+
+    assert partition_rows("transactions_p202308") == []
+    assert partition_rows("transactions_p202310") == ["Moved"]
+    assert db_session.get(Transaction, transaction_id).saldo == 10
+
+def test_deleting_account_deletes_partitioned_transactions(partitioned_app, partitioned_account):
+    from project.db import db_session
+    from project.models import Transaction
+    from project.accounts.purge import delete_account, account_purger
+
+    book(partitioned_account, "July", 10, datetime(2023, 7, 10))
+    book(partitioned_account, "August", 10, datetime(2023, 8, 10))
+    delete_account(partitioned_account)
+    account_purger.stop() # Waits for the background purge
+
+    assert Transaction.query.count() == 0
+    assert partition_rows("transactions_p202307") == []
+
+def test_edit_shifts_saldos_in_later_partitions(partitioned_app, partitioned_account):
+    from project.db import db_session
+    from project.models import Transaction
+    from project.transactions.transactions import update_transaction, delete_transaction
+
+    july = book(partitioned_account, "July", 10, datetime(2023, 7, 10))
+    august = book(partitioned_account, "August", 20, datetime(2023, 8, 10))
+    book(partitioned_account, "September", 30, datetime(2023, 9, 10))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", SAWarning) # E.g. rows reported as not deleted by the partition triggers
+        assert update_transaction(db_session.get(Transaction, july), amount=15)[0] == "success"
+        assert delete_transaction(db_session.get(Transaction, august))[0] == "success"
+    db_session.expire_all()
+    assert [(transaction.description, transaction.saldo) for transaction in Transaction.read_all(account_id=partitioned_account.id)] == [
+        ("September", 45), ("July", 15)]
+    assert partition_rows("transactions_p202308") == []
+
+
+## Reads
+def test_read_all_only_reads_partitions_of_date_range(partitioned_app, partitioned_account):
+    from project.models import Transaction
+    from tests.conftest import QueryCounter
+
+    for month in (6, 7, 8, 9):
+        book(partitioned_account, f"Month {month}", 10, datetime(2023, month, 15))
+    account_id = partitioned_account.id
+
+    with QueryCounter() as counter:
+        transactions = Transaction.read_all(account_id=account_id, start_date=date(2023, 7, 15), end_date=date(2023, 8, 14))
+    assert [t.description for t in transactions] == ["Month 7"]
+    if partitioned_app.config["DATABASE_URL"].startswith("sqlite"):
+        statements = " ".join(counter.statements)
+        assert "transactions_p202307" in statements and "transactions_p202308" in statements
+        assert "transactions_p202306" not in statements and "transactions_p202309" not in statements
+
+    assert [t.description for t in Transaction.read_all(account_id=account_id, start_date=date(2023, 8, 1))] == ["Month 9", "Month 8"]
+    assert [t.description for t in Transaction.read_all(account_id=account_id, start_date=date(2023, 8, 1), as_rows=True)] == ["Month 9", "Month 8"]
+    assert [t.description for t in Transaction.read_all(account_id=account_id, end_date=date(2023, 6, 30))] == ["Month 6"]
+    assert Transaction.read_all(account_id=account_id, start_date=date(2010, 1, 1), end_date=date(2010, 2, 1)) == []
+
+
+## Conversion
+def test_init_partitions_existing_table(tmp_path, monkeypatch):
+    '''Rows of an unpartitioned transactions table are moved into partitions, ids and saldos are kept.'''
+    from config import Config
+    from project import create_app
+    from project.db import init_db, configure_engine, db_session
+    from project.models import Account, Transaction
+    from project.partitioning import forget_known_partitions
+    from project.sharding import transaction_ids
+
+    default_url = Config.DATABASE_URL
+    url = f"sqlite:///{tmp_path / 'converted.db'}"
+    monkeypatch.setattr(Config, "DATABASE_URL", url)
+    try:
+        create_app(test_setup=True)
+        init_db()
+        account = Account(title="Converted", iban="GB29000060161331920002")
+        db_session.add(account)
+        db_session.commit()
+        for month in (1, 2):
+            book(account, f"Month {month}", 50, datetime(2023, month, 1))
+        db_session.remove()
+
+        monkeypatch.setattr(Config, "TRANSACTION_PARTITIONING", "monthly")
+        transaction_ids.reset()
+        forget_known_partitions()
+        create_app(test_setup=True)
+        init_db()
+
+        assert partition_rows("transactions_p202301") == ["Month 1"]
+        assert partition_rows("transactions_p202302") == ["Month 2"]
+        account = Account.query.one()
+        assert [(t.id, t.saldo) for t in Transaction.read_all(account_id=account.id)] == [(2, 100), (1, 50)]
+        assert book(account, "After conversion", 1, datetime(2023, 3, 1)) == 3
+    finally:
+        db_session.remove()
+        configure_engine(default_url)
+        transaction_ids.reset()
+        forget_known_partitions()
+
+
+## Seeding
+def test_seed_partitioned(partitioned_app):
+    from project.db import get_engine
+    from project.models import Transaction
+    from project.seed import seed_database
+
+    account_ids = seed_database(get_engine(), num_accounts=3, num_transactions=300, months=3, end_date=date(2023, 9, 30))
+    assert Transaction.query.count() == 300
+    assert len({t.id for t in Transaction.query.all()}) == 300
+    assert partition_rows("transactions_p202307")
+    assert len(Transaction.read_all(account_id=account_ids[0], start_date=date(2023, 9, 1))) > 0
+
+
+## Postgres DDL
+def test_postgres_partitioned_table_ddl():
+    from sqlalchemy.dialects import postgresql
+    from sqlalchemy.schema import CreateTable
+    from project.partitioning import postgres_parent_table, postgres_partition_ddl
+
+    ddl = str(CreateTable(postgres_parent_table()).compile(dialect=postgresql.dialect()))
+    assert "PARTITION BY RANGE (utc_datetime_booked)" in ddl
+    assert "PRIMARY KEY (id, utc_datetime_booked)" in ddl
+    assert "id SERIAL NOT NULL" in ddl
+    assert "REFERENCES accounts (id) ON DELETE CASCADE" in ddl # Rows booked during an account purge, see project/accounts/purge.py
+    assert [foreign_key.ondelete for foreign_key in postgres_parent_table().foreign_keys] == ["CASCADE"]
+    assert postgres_partition_ddl(datetime(2023, 12, 1)) == (
+        "CREATE TABLE IF NOT EXISTS transactions_p202312 PARTITION OF transactions "
+        "FOR VALUES FROM ('2023-12-01') TO ('2024-01-01')")
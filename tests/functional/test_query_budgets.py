@@ -0,0 +1,152 @@
+import pytest
+from datetime import datetime, timedelta
+import pytz
+
+# Each route gets a fixed statement budget. Routes are exercised with a small and a large history,
+# so any per-row lazy load (N+1) pushes the larger run over budget.
+SEED_SIZES = [3, 60]
+
+## Test fixtures
+@pytest.fixture()
+def two_accounts(client_initialiser, db_initialiser):
+    Account, Transaction, db_session = db_initialiser
+    client = client_initialiser
+
+    client.post("/accounts/create", data={"title": "Main", "accept_terms": True})
+    client.post("/accounts/create", data={"title": "Savings", "accept_terms": True})
+    assert Account.query.count() == 2
+    accounts = Account.query.order_by(Account.id).all()
+    # The archive boundary is read at most every ARCHIVE_BOUNDARY_CHECK_SECONDS per process (see project/archive.py),
+    # the budgets do not depend on whether an earlier test read it
+    from project.archive import archived_before
+    archived_before(accounts[0].id)
+    return accounts
+
+@pytest.fixture()
+def seed_transactions(db_initialiser):
+    Account, Transaction, db_session = db_initialiser
+
+    def seed(account, num_transactions):
+        start = datetime.now(pytz.UTC) - timedelta(days=num_transactions)
+        saldo = 0
+        for i in range(num_transactions):
+            transaction = Transaction(description=f"Seeded {i}", amount=10, category="Groceries", utc_datetime_booked=start + timedelta(days=i))
+            saldo += 10
+            transaction.saldo = saldo
+            account.transactions.append(transaction)
+        db_session.add(account)
+        db_session.commit()
+        assert account.transactions.count() == num_transactions
+
+    return seed
+
+## Web routes
+@pytest.mark.parametrize("num_transactions", SEED_SIZES)
+def test_show_query_budget(client_initialiser, two_accounts, seed_transactions, query_budget, num_transactions):
+    account = two_accounts[0]
+    seed_transactions(account, num_transactions)
+
+    with query_budget(4):
+        response = client_initialiser.get(f"/accounts/{account.id}")
+    assert response.status_code == 200
+
+    with query_budget(4):
+        response = client_initialiser.get(f"/accounts/{account.id}?transactions_filter=cleared")
+    assert response.status_code == 200
+
+def test_show_loads_accounts_once(client_initialiser, two_accounts, db_initialiser, query_budget):
+    # Fresh session: nothing is in the identity map. Account cache (version and accounts), transactions and latest saldos.
+    _, _, db_session = db_initialiser
+    client_initialiser.application.config["ACCOUNT_CACHE_CHECK_SECONDS"] = 60
+    db_session.remove()
+
+    with query_budget(4) as counter:
+        response = client_initialiser.get(f"/accounts/{two_accounts[0].id}?transactions_filter=cleared")
+    assert response.status_code == 200
+    assert sum("FROM accounts" in statement for statement in counter.statements) == 1
+
+    # Served from the account cache
+    db_session.remove()
+    with query_budget(2) as counter:
+        response = client_initialiser.get(f"/accounts/{two_accounts[1].id}?transactions_filter=cleared")
+    assert response.status_code == 200
+    assert not any("FROM accounts" in statement or "FROM cache_versions" in statement for statement in counter.statements)
+
+def test_subaccount_transfer_loads_accounts_once(client_initialiser, two_accounts, db_initialiser, query_budget):
+    _, _, db_session = db_initialiser
+    sender, recipient = two_accounts
+    sender_id, recipient_form_value = sender.id, f"{recipient.title} ({recipient.iban[:4]}...{recipient.iban[-2:]})"
+    client_initialiser.application.config["ACCOUNT_CACHE_CHECK_SECONDS"] = 60
+    client_initialiser.get(f"/accounts/{sender_id}") # The page with the transfer form fills the account cache
+    db_session.remove()
+
+    with query_budget(15) as counter:
+        response = client_initialiser.post(f"/accounts/{sender_id}/transactions/create_subaccount_transfer", data={
+            "recipient": recipient_form_value, "description": "Budgeted", "amount": 50})
+    assert response.status_code == 302
+    # Before the transactions are booked: sender and recipient, the recipient choices come from the account cache
+    # (later statements refresh accounts expired by the commits)
+    booked_at = next(i for i, statement in enumerate(counter.statements) if statement.startswith("INSERT"))
+    assert sum("FROM accounts" in statement for statement in counter.statements[:booked_at]) == 2
+
+@pytest.mark.parametrize("num_transactions", SEED_SIZES)
+def test_download_csv_query_budget(client_initialiser, two_accounts, seed_transactions, query_budget, num_transactions):
+    account = two_accounts[0]
+    seed_transactions(account, num_transactions)
+
+    with query_budget(2):
+        response = client_initialiser.post("/download_csv", data={
+            "account_id": account.id,
+            "start_date": "None",
+            "end_date": "None",
+            "transaction_description": "None",
+            "search_type": "None"
+        })
+        csv_lines = response.data.decode().splitlines() # Consume streamed body inside the budget
+    assert len(csv_lines) == num_transactions + 1
+
+## API routes
+@pytest.mark.parametrize("num_transactions", SEED_SIZES)
+def test_api_get_accounts_query_budget(client_initialiser, two_accounts, seed_transactions, query_budget, num_transactions):
+    seed_transactions(two_accounts[0], num_transactions)
+    client_initialiser.application.config["ACCOUNT_CACHE_CHECK_SECONDS"] = 60
+
+    with query_budget(2): # Fills the account cache
+        response = client_initialiser.get("/api/accounts")
+    assert response.status_code == 200
+
+    with query_budget(0):
+        response = client_initialiser.get("/api/accounts")
+    assert response.status_code == 200
+
+    with query_budget(1):
+        response = client_initialiser.get(f"/api/accounts/{two_accounts[0].id}")
+    assert response.status_code == 200
+
+@pytest.mark.parametrize("num_transactions", SEED_SIZES)
+def test_api_create_transaction_query_budget(client_initialiser, two_accounts, seed_transactions, query_budget, num_transactions):
+    account = two_accounts[0]
+    seed_transactions(account, num_transactions)
+
+    # Insert, saldo (refresh, sum, update); the response is built from the new transaction, not queried again
+    with query_budget(4):
+        response = client_initialiser.post(f"/api/accounts/{account.id}/transactions", json={
+            "description": "Budgeted",
+            "amount": 50,
+            "category": "Rent"
+        })
+    assert response.status_code == 201
+    assert response.json["saldo"] == num_transactions * 10 + 50
+
+@pytest.mark.parametrize("num_transactions", SEED_SIZES)
+def test_api_create_sub_transfer_query_budget(client_initialiser, two_accounts, seed_transactions, query_budget, num_transactions):
+    sender, recipient = two_accounts
+    seed_transactions(sender, num_transactions)
+
+    with query_budget(10):
+        response = client_initialiser.post(f"/api/accounts/{sender.id}/subaccount_transfer", json={
+            "description": "Budgeted",
+            "amount": 50,
+            "recipient_account_id": recipient.id
+        })
+    assert response.status_code == 201
@@ -0,0 +1,148 @@
+import os
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+
+## Test fixtures
+@pytest.fixture()
+def replica_app(app_initialiser, tmp_path, monkeypatch):
+    '''
+    App with a second database as read replica. The replica is not actually replicated, so reads
+    served by it do not see rows written through the app.
+    Set TEST_REPLICA_DATABASE_URL (and DATABASE_URL_LOCAL) to run against two Postgres databases.
+    '''
+    from config import Config
+    from project import create_app
+    from project.db import Base, get_replica_engine, configure_engine
+    _, Account, Transaction, db_session = app_initialiser
+
+    Account.query.delete()
+    db_session.commit()
+
+    replica_url = os.getenv("TEST_REPLICA_DATABASE_URL", f"sqlite:///{tmp_path / 'replica.db'}")
+    monkeypatch.setattr(Config, "DATABASE_REPLICA_URL", replica_url, raising=False)
+    app = create_app(test_setup=True)
+    # Accounts are inserted directly into the databases, as by another worker (see insert_account())
+    app.config["ACCOUNT_CACHE_CHECK_SECONDS"] = 0
+
+    replica_engine = get_replica_engine()
+    Base.metadata.create_all(bind=replica_engine)
+    with replica_engine.begin() as connection:
+        connection.execute(text("DELETE FROM transactions"))
+        connection.execute(text("DELETE FROM accounts"))
+
+    yield app
+
+    db_session.remove()
+    configure_engine(app.config["DATABASE_URL"])
+
+@pytest.fixture()
+def statements_by_database(replica_app):
+    '''Lists the databases ("primary"/"replica") of all statements executed while the test runs.'''
+    from project.db import get_engine, get_replica_engine
+    databases = []
+    primary_url, replica_url = str(get_engine().url), str(get_replica_engine().url)
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        databases.append({primary_url: "primary", replica_url: "replica"}[str(conn.engine.url)])
+
+    event.listen(Engine, "before_cursor_execute", record)
+    yield databases
+    event.remove(Engine, "before_cursor_execute", record)
+
+def insert_account(engine, title, iban="GB29000060161331920001"):
+    from project.accounts.cache import bump_accounts_version
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO accounts (id, title, iban) VALUES (1, :title, :iban)"), {"title": title, "iban": iban})
+        bump_accounts_version(connection)
+
+
+## Routing
+def test_api_get_reads_from_replica(replica_app, statements_by_database):
+    from project.db import get_engine, get_replica_engine
+    client = replica_app.test_client()
+
+    insert_account(get_engine(), "Primary")
+    del statements_by_database[:]
+    response = client.get('/api/accounts')
+    assert response.status_code == 404 # Not yet replicated
+    assert set(statements_by_database) == {"replica"}
+
+    insert_account(get_replica_engine(), "Replica")
+    response = client.get('/api/accounts')
+    assert response.status_code == 200
+    assert response.json[0]["title"] == "Replica"
+
+def test_show_reads_from_replica(replica_app, statements_by_database):
+    from project.db import get_engine, get_replica_engine
+    client = replica_app.test_client()
+    insert_account(get_engine(), "Primary")
+    insert_account(get_replica_engine(), "Replica")
+    del statements_by_database[:]
+
+    response = client.get('/accounts/1')
+    assert response.status_code == 200
+    assert b"Replica" in response.data
+    assert set(statements_by_database) == {"replica"}
+
+def test_read_only_post_reads_from_replica(replica_app, statements_by_database):
+    from project.db import get_engine, get_replica_engine
+    client = replica_app.test_client()
+    insert_account(get_engine(), "Primary")
+    insert_account(get_replica_engine(), "Replica")
+    del statements_by_database[:]
+
+    response = client.post('/download_csv', data={"account_id": 1, "start_date": "None", "end_date": "None", "transaction_description": "None", "search_type": "None"})
+    assert response.status_code == 200
+    response.get_data()
+    assert set(statements_by_database) == {"replica"}
+
+def test_writes_go_to_primary(replica_app, statements_by_database):
+    from project.db import get_engine, get_replica_engine
+    client = replica_app.test_client()
+
+    response = client.post('/api/accounts', json={"title": "Savings"})
+    assert response.status_code == 201
+    assert set(statements_by_database) == {"primary"}
+
+    with get_engine().connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM accounts")).scalar() == 1
+    with get_replica_engine().connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM accounts")).scalar() == 0
+
+
+## Read-your-writes
+def test_reads_stick_to_primary_after_write(replica_app, statements_by_database):
+    client = replica_app.test_client()
+
+    client.post('/api/accounts', json={"title": "Savings"})
+    del statements_by_database[:]
+
+    # The writing client sees its account, other clients are served by the (lagging) replica
+    response = client.get('/api/accounts')
+    assert response.status_code == 200
+    assert response.json[0]["title"] == "Savings"
+    assert set(statements_by_database) == {"primary"}
+
+    response = replica_app.test_client().get('/api/accounts')
+    assert response.status_code == 404
+
+def test_stickiness_expires(replica_app, statements_by_database):
+    replica_app.config["REPLICA_STICKINESS_SECONDS"] = 0
+    client = replica_app.test_client()
+
+    client.post('/api/accounts', json={"title": "Savings"})
+    del statements_by_database[:]
+
+    response = client.get('/api/accounts')
+    assert response.status_code == 404
+    assert set(statements_by_database) == {"replica"}
+
+def test_html_write_sticks_to_primary(replica_app, statements_by_database):
+    client = replica_app.test_client()
+
+    response = client.post("/accounts/create", data={"title": "Savings", "accept_terms": True}, follow_redirects=True)
+    assert response.status_code == 200
+    assert b"Savings" in response.data
+    assert "replica" not in statements_by_database
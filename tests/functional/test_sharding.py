@@ -0,0 +1,283 @@
+import os
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import text, select, func
+
+
+## Test fixtures
+@pytest.fixture()
+def sharded_app(app_initialiser, tmp_path, monkeypatch):
+    '''
+    App with the test database as shard "0" and two more SQLite shards.
+    Set TEST_SHARD_DATABASE_URLS (comma separated) to use other databases, e.g. Postgres.
+    '''
+    from config import Config
+    from project import create_app
+    from project.db import init_db, configure_engine, db_session, shard_ids, get_shard_engine
+    from project.sharding import transaction_ids
+    from project.accounts.cache import bump_accounts_version, invalidate_account_cache
+    _, Account, Transaction, _ = app_initialiser
+
+    shard_urls = os.getenv("TEST_SHARD_DATABASE_URLS", f"sqlite:///{tmp_path / 'shard1.db'},sqlite:///{tmp_path / 'shard2.db'}").split(",")
+    monkeypatch.setattr(Config, "TRANSACTION_SHARD_URLS", shard_urls, raising=False)
+    app = create_app(test_setup=True)
+    init_db()
+
+    for shard_id in shard_ids():
+        with get_shard_engine(shard_id).begin() as connection:
+            for table in ("transactions", "archived_transactions", "archive_boundaries", "transfer_outbox", "applied_transfers"):
+                connection.execute(text(f"DELETE FROM {table}"))
+    with get_shard_engine("0").begin() as connection:
+        connection.execute(text("DELETE FROM accounts"))
+        connection.execute(text("DELETE FROM id_blocks"))
+        bump_accounts_version(connection)
+    invalidate_account_cache()
+    transaction_ids.reset()
+
+    yield app
+
+    from project.archive import forget_archive_boundaries
+    with get_shard_engine("0").begin() as connection:
+        connection.execute(text("DELETE FROM archive_boundaries")) # The test database
+    forget_archive_boundaries()
+    db_session.remove()
+    configure_engine(app.config["DATABASE_URL"])
+    transaction_ids.reset()
+
+@pytest.fixture()
+def accounts_on_different_shards(sharded_app):
+    '''Creates accounts until two of them are on different shards other than "0". Returns their ids.'''
+    from project.sharding import shard_for_account
+    client = sharded_app.test_client()
+
+    ids_by_shard = {}
+    for i in range(5):
+        response = client.post('/api/accounts', json={"title": f"Account {chr(65 + i)}"})
+        assert response.status_code == 201
+        account_id = response.json["id"]
+        ids_by_shard.setdefault(shard_for_account(account_id), account_id)
+    assert len(ids_by_shard) >= 2
+    return sorted(ids_by_shard.values(), key=lambda account_id: shard_for_account(account_id))[-2:]
+
+def count_rows(shard_id, table, account_id=None):
+    from project.db import get_shard_engine
+    query = f"SELECT COUNT(*) FROM {table}" + (f" WHERE account_id = {account_id}" if account_id else "")
+    with get_shard_engine(shard_id).connect() as connection:
+        return connection.execute(text(query)).scalar()
+
+
+## Routing
+def test_shard_for_account_is_stable(sharded_app):
+    from project.sharding import shard_for_account
+    assert [shard_for_account(account_id) for account_id in range(1, 10)] == [shard_for_account(account_id) for account_id in range(1, 10)]
+    assert {shard_for_account(account_id) for account_id in range(1, 100)} == {"0", "1", "2"}
+    assert shard_for_account("7") == shard_for_account(7)
+
+def test_transactions_stored_on_account_shard(sharded_app, accounts_on_different_shards):
+    from project.sharding import shard_for_account
+    client = sharded_app.test_client()
+
+    transaction_ids = []
+    for account_id in accounts_on_different_shards:
+        for amount in (100, -30):
+            response = client.post(f'/api/accounts/{account_id}/transactions', json={"description": "Sharded", "amount": amount, "category": "Groceries"})
+            assert response.status_code == 201
+            transaction_ids.append(response.json["transaction_id"])
+        assert response.json["saldo"] == 70
+
+    for account_id in accounts_on_different_shards:
+        for shard_id in ("0", "1", "2"):
+            assert count_rows(shard_id, "transactions", account_id) == (2 if shard_id == shard_for_account(account_id) else 0)
+
+    # Ids are unique across shards
+    assert len(set(transaction_ids)) == 4
+
+def test_reads_from_account_shard(sharded_app, accounts_on_different_shards):
+    from project.models import Transaction
+    client = sharded_app.test_client()
+    first_id, second_id = accounts_on_different_shards
+
+    client.post(f'/api/accounts/{first_id}/transactions', json={"description": "Rent", "amount": -500, "category": "Rent"})
+    client.post(f'/api/accounts/{second_id}/transactions', json={"description": "Salary", "amount": 2000, "category": "Salary"})
+
+    assert [transaction.description for transaction in Transaction.read_all(account_id=first_id)] == ["Rent"]
+    assert [transaction.description for transaction in Transaction.read_all(account_id=second_id)] == ["Salary"]
+    assert Transaction.latest_saldos() == {first_id: -500, second_id: 2000}
+
+    response = client.get(f'/accounts/{second_id}?transactions_filter=cleared')
+    assert response.status_code == 200
+    assert b"Salary" in response.data
+
+def test_named_parameter_queries_routed_to_account_shard(sharded_app, accounts_on_different_shards):
+    from sqlalchemy import event
+    from project.db import get_shard_engine, shard_ids
+    from project.models import Transaction
+    from project.queries import account_transactions, saldo_before
+    from project.sharding import shard_for_account
+    first_id, _ = accounts_on_different_shards
+    sharded_app.test_client().post(f'/api/accounts/{first_id}/transactions', json={"description": "Rent", "amount": -500, "category": "Rent"})
+
+    queried_shards = []
+    listeners = {shard_id: lambda *args, shard_id=shard_id: queried_shards.append(shard_id) for shard_id in shard_ids()}
+    for shard_id, listener in listeners.items():
+        event.listen(get_shard_engine(shard_id), "before_cursor_execute", listener)
+    try:
+        assert [transaction.description for transaction in account_transactions(Transaction, first_id)] == ["Rent"]
+        assert saldo_before(first_id, datetime.utcnow() + timedelta(days=1)) == -500
+    finally:
+        for shard_id, listener in listeners.items():
+            event.remove(get_shard_engine(shard_id), "before_cursor_execute", listener)
+    assert queried_shards == [shard_for_account(first_id)] * 2
+
+def test_delete_account_deletes_transactions_on_shard(sharded_app, accounts_on_different_shards):
+    from project.sharding import shard_for_account
+    from project.accounts.purge import account_purger
+    client = sharded_app.test_client()
+    first_id, second_id = accounts_on_different_shards
+
+    client.post(f'/api/accounts/{first_id}/transactions', json={"description": "Rent", "amount": -500, "category": "Rent"})
+    client.post(f'/api/accounts/{second_id}/transactions', json={"description": "Salary", "amount": 2000, "category": "Salary"})
+
+    response = client.delete(f'/api/accounts/{first_id}')
+    assert response.status_code == 200
+    account_purger.stop() # Waits for the background purge
+    assert count_rows(shard_for_account(first_id), "transactions", first_id) == 0
+    assert count_rows(shard_for_account(second_id), "transactions", second_id) == 1
+
+def test_edit_transaction_on_shard(sharded_app, accounts_on_different_shards):
+    from project.models import Transaction
+    client = sharded_app.test_client()
+    first_id, second_id = accounts_on_different_shards
+
+    ids = [client.post(f'/api/accounts/{first_id}/transactions', json={"description": "Rent", "amount": amount, "category": "Rent",
+                                                                         "utc_datetime_booked": f"2023-09-0{day}T12:00:00+00:00"}).json["transaction_id"]
+           for day, amount in [(1, 100), (2, 50), (3, 25)]]
+    client.post(f'/api/accounts/{second_id}/transactions', json={"description": "Salary", "amount": 2000, "category": "Salary"})
+
+    assert client.patch(f'/api/accounts/{first_id}/transactions/{ids[0]}', json={"amount": 200}).status_code == 200
+    assert client.delete(f'/api/accounts/{first_id}/transactions/{ids[1]}').status_code == 200
+    assert client.delete(f'/api/accounts/{second_id}/transactions/{ids[2]}').status_code == 404
+    assert [transaction.saldo for transaction in Transaction.read_all(account_id=first_id)] == [225, 200]
+    assert Transaction.latest_saldos()[second_id] == 2000
+
+
+## Cross-shard transfers
+def test_cross_shard_transfer(sharded_app, accounts_on_different_shards):
+    from project.sharding import shard_for_account
+    client = sharded_app.test_client()
+    sender_id, recipient_id = accounts_on_different_shards
+
+    response = client.post(f'/api/accounts/{sender_id}/subaccount_transfer', json={"description": "Savings", "amount": 25, "recipient_account_id": recipient_id})
+    assert response.status_code == 201
+    assert sorted((transaction["account_id"], transaction["saldo"]) for transaction in response.json["transactions"]) == sorted([(sender_id, -25), (recipient_id, 25)])
+
+    assert count_rows(shard_for_account(sender_id), "transactions", sender_id) == 1
+    assert count_rows(shard_for_account(recipient_id), "transactions", recipient_id) == 1
+    assert count_rows(shard_for_account(recipient_id), "applied_transfers") == 1
+    with sharded_app.app_context():
+        from project.models import TransferOutbox
+        assert TransferOutbox.query.filter(TransferOutbox.utc_datetime_delivered.is_(None)).count() == 0
+
+def test_cross_shard_transfer_html(sharded_app, accounts_on_different_shards):
+    from project.models import Account, Transaction
+    client = sharded_app.test_client()
+    sender_id, recipient_id = accounts_on_different_shards
+    recipient = Account.query.get(recipient_id)
+
+    response = client.post(f'/accounts/{sender_id}/transactions/create_subaccount_transfer', data={
+        "description": "Savings",
+        "amount": 25,
+        "recipient": f"{recipient.title} ({recipient.iban[:4]}...{recipient.iban[-2:]})",
+    }, follow_redirects=True)
+    assert response.status_code == 200
+    assert b"Successfully created transfer" in response.data
+    assert [transaction.saldo for transaction in Transaction.read_all(account_id=sender_id)] == [-25]
+    assert [transaction.saldo for transaction in Transaction.read_all(account_id=recipient_id)] == [25]
+
+def test_cross_shard_transfer_redelivered_once(sharded_app, accounts_on_different_shards, monkeypatch):
+    import project.sharding
+    from project.sharding import shard_for_account, deliver_pending_transfers, deliver_transfer
+    client = sharded_app.test_client()
+    sender_id, recipient_id = accounts_on_different_shards
+
+    def unavailable(message):
+        raise ConnectionError("Recipient shard unavailable")
+    monkeypatch.setattr(project.sharding, "deliver_transfer", unavailable)
+
+    response = client.post(f'/api/accounts/{sender_id}/subaccount_transfer', json={"description": "Savings", "amount": 25, "recipient_account_id": recipient_id})
+    assert response.status_code == 201
+    assert response.json["detail"] == "Successfully created subaccount transfer. Crediting the recipient is pending."
+    assert count_rows(shard_for_account(sender_id), "transactions", sender_id) == 1
+    assert count_rows(shard_for_account(recipient_id), "transactions", recipient_id) == 0
+
+    monkeypatch.setattr(project.sharding, "deliver_transfer", deliver_transfer)
+    assert deliver_pending_transfers() == 1
+    assert deliver_pending_transfers() == 0
+    assert count_rows(shard_for_account(recipient_id), "transactions", recipient_id) == 1
+
+def test_cross_shard_transfer_not_booked_twice(sharded_app, accounts_on_different_shards):
+    from project.models import TransferOutbox
+    from project.db import db_session
+    from project.sharding import shard_for_account, deliver_transfer
+    client = sharded_app.test_client()
+    sender_id, recipient_id = accounts_on_different_shards
+
+    client.post(f'/api/accounts/{sender_id}/subaccount_transfer', json={"description": "Savings", "amount": 25, "recipient_account_id": recipient_id})
+
+    # E.g. the relay crashed after booking but before marking the message delivered
+    message = TransferOutbox.query.one()
+    message.utc_datetime_delivered = None
+    db_session.commit()
+    deliver_transfer(message)
+    assert count_rows(shard_for_account(recipient_id), "transactions", recipient_id) == 1
+
+
+## Archive
+def test_archive_on_every_shard(sharded_app, accounts_on_different_shards):
+    from datetime import datetime
+    from project.archive import archive_transactions
+    from project.models import Transaction, OPENING_BALANCE_CATEGORY
+    from project.sharding import shard_for_account
+    client = sharded_app.test_client()
+
+    for account_id in accounts_on_different_shards:
+        for amount, booked in ((100, "2023-01-05"), (-30, "2023-02-05"), (5, "2023-03-05")):
+            response = client.post(f'/api/accounts/{account_id}/transactions', json={"description": "Archived", "amount": amount, "category": "Groceries",
+                                                                                      "utc_datetime_booked": f"{booked}T12:00:00+00:00"})
+            assert response.status_code == 201
+
+    assert archive_transactions(datetime(2023, 3, 1)) == 4
+    opening_balances = Transaction.query.filter(Transaction.category == OPENING_BALANCE_CATEGORY).all()
+    assert [transaction.saldo for transaction in opening_balances] == [70, 70]
+    assert len({transaction.id for transaction in opening_balances}) == 2
+    for account_id in accounts_on_different_shards:
+        assert count_rows(shard_for_account(account_id), "archived_transactions", account_id) == 2
+        assert [t.saldo for t in Transaction.read_all(account_id=account_id)] == [75, 70]
+
+
+## Scatter-gather
+def test_scatter_gather(sharded_app, accounts_on_different_shards):
+    from project.models import Transaction
+    from project.sharding import scatter_gather
+    client = sharded_app.test_client()
+    first_id, second_id = accounts_on_different_shards
+
+    for i, account_id in enumerate([first_id, second_id, first_id, second_id]):
+        client.post(f'/api/accounts/{account_id}/transactions', json={"description": f"Transaction {i}", "amount": 10 + i, "category": "Groceries",
+                                                                       "utc_datetime_booked": f"2023-09-0{i + 1}T12:00:00+00:00"})
+
+    table = Transaction.__table__
+    assert sum(row[0] for row in scatter_gather(select(func.count()).select_from(table))) == 4
+
+    latest = scatter_gather(select(table.c.description, table.c.utc_datetime_booked).order_by(table.c.utc_datetime_booked.desc()).limit(3),
+                            key=lambda row: row.utc_datetime_booked, reverse=True, limit=3)
+    assert [row.description for row in latest] == ["Transaction 3", "Transaction 2", "Transaction 1"]
+
+def test_shard_info_command(sharded_app, accounts_on_different_shards):
+    first_id, _ = accounts_on_different_shards
+    sharded_app.test_client().post(f'/api/accounts/{first_id}/transactions', json={"description": "Rent", "amount": -500, "category": "Rent"})
+
+    result = sharded_app.test_cli_runner().invoke(args=["shard-info"])
+    assert result.exit_code == 0
+    assert "Shard 2:" in result.output
+    assert f"account {first_id}: -500" in result.output
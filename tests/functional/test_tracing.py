@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+
+## Test fixtures
+@pytest.fixture()
+def traced_client(client_initialiser, tmp_path):
+    from project.tracing import configure_tracing
+    client = client_initialiser
+    client.application.config.update({"TRACE_SAMPLE_RATE": 1.0, "TRACE_EXPORT_FILE": str(tmp_path / "spans.jsonl")})
+    configure_tracing(client.application.config) # Before the first API request builds the API app
+    yield client
+    configure_tracing({})
+
+def exported_spans(tmp_path):
+    from project.tracing import flush_spans
+    flush_spans()
+    return [json.loads(line) for line in (tmp_path / "spans.jsonl").read_text().splitlines()]
+
+
+## Traces
+def test_web_request_trace(traced_client, tmp_path):
+    account_id = traced_client.post("/api/accounts", json={"title": "Main"}).json["id"]
+    assert traced_client.get(f"/accounts/{account_id}").status_code == 200
+
+    spans = exported_spans(tmp_path)
+    [root] = [span for span in spans if span["name"] == "GET /accounts/<int:account_id>"]
+    trace = [span for span in spans if span["trace_id"] == root["trace_id"]]
+    names = {span["name"] for span in trace}
+    assert {"Transaction.read_all", "account_saldos", "build_forms", "render_template", "sql"} <= names
+    assert root["parent_id"] is None and root["attributes"]["http.status_code"] == 200
+    assert {span["parent_id"] for span in trace if span["name"] == "build_forms"} == {root["span_id"]}
+    [read_all] = [span for span in trace if span["name"] == "Transaction.read_all"]
+    assert any(span["name"] == "sql" and span["parent_id"] == read_all["span_id"] for span in trace)
+
+def test_api_request_trace(traced_client, tmp_path):
+    account_id = traced_client.post("/api/accounts", json={"title": "Main"}).json["id"]
+    response = traced_client.post(f"/api/accounts/{account_id}/transactions", json={"description": "Rent", "amount": -5, "category": "Rent"})
+    assert response.status_code == 201
+
+    spans = exported_spans(tmp_path)
+    [root] = [span for span in spans if span["name"].startswith("POST") and span["name"].endswith("/transactions")]
+    trace = {span["name"]: span for span in spans if span["trace_id"] == root["trace_id"]}
+    assert {"validate_body", "validate_parameters", "create_transaction", "Transaction.calculate_saldo"} <= set(trace)
+    assert trace["validate_body"]["end_ns"] <= trace["create_transaction"]["start_ns"]
+    assert trace["Transaction.calculate_saldo"]["parent_id"] == trace["create_transaction"]["span_id"]
@@ -298,6 +298,28 @@ def test_create_subaccount_transfer_valid_form_data(client_initialiser, first_ac
         assert 'Successfully created transfer' in response.data.decode()
         assert response.request.path == f"/accounts/{first_account.id}"
 
+def test_create_subaccount_transfer_by_recipient_id(client_initialiser, first_account, second_account):
+    client = client_initialiser
+
+    response = client.post(f"/accounts/{first_account.id}/transactions/create_subaccount_transfer", data={
+        "description": "Transfer by id",
+        "amount": 40,
+        "recipient": "John's Savings2",
+        "recipient_id": second_account.id
+    }, follow_redirects=True)
+    assert 'Successfully created transfer' in response.data.decode()
+    assert [transaction.amount for transaction in second_account.transactions] == [40]
+
+    # Unknown recipients and the sender itself
+    for recipient_id in [99, first_account.id]:
+        response = client.post(f"/accounts/{first_account.id}/transactions/create_subaccount_transfer", data={
+            "description": "Transfer by id",
+            "amount": 40,
+            "recipient_id": recipient_id
+        }, follow_redirects=True)
+        assert 'Successfully created transfer' not in response.data.decode()
+    assert first_account.transactions.count() == 1
+
 def test_create_subaccount_transfer_valid_result_both_ends(client_initialiser, first_account, second_account, valid_and_invalid_transaction_data):
     client = client_initialiser
 
@@ -704,3 +726,147 @@ def test_api_create_sub_transfer_valid_response_fields(client_initialiser, first
     assert response.json["transactions"][0]["saldo"] # only ensure that it exists
     assert response.json["transactions"][0]["description"] == "Savings August"
     assert (response.json["transactions"][0]["amount"] == 123) or (response.json["transactions"][1]["amount"] == 123)
+
+def test_api_transactions_fields_and_compact(client_initialiser, first_account, second_account):
+    client = client_initialiser
+
+    response = client.post(f"/api/accounts/{first_account.id}/transactions?fields=transaction_id,saldo", json={
+        "description": "Salary", "amount": 100, "category": "Salary"})
+    assert response.status_code == 201
+    assert set(response.json) == {"status", "detail", "transaction_id", "saldo"}
+    assert response.json["saldo"] == 100
+
+    response = client.post(f"/api/accounts/{first_account.id}/subaccount_transfer?fields=account_id,amount,saldo&compact=true", json={
+        "description": "Savings", "amount": 30, "recipient_account_id": second_account.id})
+    assert response.status_code == 201
+    assert response.json["transactions"] == {"fields": ["account_id", "amount", "saldo"],
+                                             "rows": [[first_account.id, -30, 70], [second_account.id, 30, 30]]}
+
+    transaction_id = client.post(f"/api/accounts/{first_account.id}/transactions", json={
+        "description": "Rent", "amount": -50, "category": "Rent"}).json["transaction_id"]
+    response = client.patch(f"/api/accounts/{first_account.id}/transactions/{transaction_id}?fields=amount,saldo", json={"amount": -60})
+    assert response.json == {"status": "success", "detail": "Successfully updated the transaction.", "amount": -60, "saldo": 10}
+
+    assert client.post(f"/api/accounts/{first_account.id}/transactions?fields=iban", json={
+        "description": "Rent", "amount": -50, "category": "Rent"}).status_code == 400
+
+## Edit and delete
+@pytest.fixture()
+def booked_transactions(first_account, client_initialiser):
+    '''Ids of three transactions of first_account (amounts 100, 50, 25) booked on consecutive days.'''
+    ids = []
+    for day, amount in zip([1, 2, 3], [100, 50, 25]):
+        response = client_initialiser.post(f'/api/accounts/{first_account.id}/transactions', json={
+            "description": f"Day {day}",
+            "amount": amount,
+            "category": "Rent",
+            "utc_datetime_booked": f"2023-09-0{day}T12:00:00+00:00"
+        })
+        assert response.status_code == 201
+        ids.append(response.json["transaction_id"])
+    return ids
+
+def saldos(db_initialiser, account):
+    Account, Transaction, db_session = db_initialiser
+    db_session.expire_all()
+    return [transaction.saldo for transaction in Transaction.query.filter_by(account_id=account.id).order_by(Transaction.utc_datetime_booked)]
+
+def test_update_transaction_shifts_later_saldos(client_initialiser, db_initialiser, first_account, booked_transactions):
+    page = client_initialiser.get(f"/accounts/{first_account.id}?transactions_filter=cleared").data.decode()
+    assert f"/accounts/{first_account.id}/transactions/{booked_transactions[1]}/update" in page
+
+    response = client_initialiser.post(f"/accounts/{first_account.id}/transactions/{booked_transactions[1]}/update", data={
+        "description": "Day 2 corrected",
+        "category": "Groceries",
+        "amount": 40,
+    }, follow_redirects=True)
+    assert "Successfully updated the transaction." in response.data.decode()
+    assert saldos(db_initialiser, first_account) == [100, 140, 165]
+
+def test_update_transaction_invalid_form_data(client_initialiser, db_initialiser, first_account, booked_transactions):
+    response = client_initialiser.post(f"/accounts/{first_account.id}/transactions/{booked_transactions[1]}/update", data={
+        "description": "Day 2",
+        "category": "Category",
+        "amount": 40,
+    }, follow_redirects=True)
+    assert "Form data is not valid." in response.data.decode()
+    assert saldos(db_initialiser, first_account) == [100, 150, 175]
+
+def test_delete_transaction_shifts_later_saldos(client_initialiser, db_initialiser, first_account, booked_transactions):
+    response = client_initialiser.post(f"/accounts/{first_account.id}/transactions/{booked_transactions[0]}/delete", follow_redirects=True)
+    assert "Successfully deleted the transaction." in response.data.decode()
+    assert saldos(db_initialiser, first_account) == [50, 75]
+
+def test_delete_transaction_of_other_account(client_initialiser, db_initialiser, first_account, second_account, booked_transactions):
+    response = client_initialiser.post(f"/accounts/{second_account.id}/transactions/{booked_transactions[0]}/delete", follow_redirects=True)
+    assert "Transaction not found." in response.data.decode()
+    assert saldos(db_initialiser, first_account) == [100, 150, 175]
+
+def test_api_update_transaction(client_initialiser, db_initialiser, first_account, booked_transactions):
+    response = client_initialiser.patch(f"/api/accounts/{first_account.id}/transactions/{booked_transactions[0]}", json={"amount": -20})
+    assert response.status_code == 200
+    assert response.json["detail"] == "Successfully updated the transaction."
+    assert response.json["amount"] == -20
+    assert response.json["saldo"] == -20
+    assert response.json["description"] == "Day 1"
+    assert saldos(db_initialiser, first_account) == [-20, 30, 55]
+
+    # Description only: saldos stay
+    response = client_initialiser.patch(f"/api/accounts/{first_account.id}/transactions/{booked_transactions[2]}", json={"description": "Rent September"})
+    assert response.status_code == 200
+    assert response.json["saldo"] == 55
+    assert saldos(db_initialiser, first_account) == [-20, 30, 55]
+
+def test_api_update_transaction_invalid_data(client_initialiser, first_account, booked_transactions):
+    url = f"/api/accounts/{first_account.id}/transactions/{booked_transactions[0]}"
+    assert client_initialiser.patch(url, json={}).status_code == 400
+    assert client_initialiser.patch(url, json={"amount": 0}).status_code == 400
+    assert client_initialiser.patch(url, json={"category": "Opening balance"}).status_code == 400
+    assert client_initialiser.patch(url, json={"category": "Transfer"}).status_code == 400 # Only subaccount transfers
+    assert client_initialiser.patch(url, json={"utc_datetime_booked": "2023-09-04T12:00:00+00:00"}).status_code == 400
+    assert client_initialiser.patch(f"/api/accounts/{first_account.id}/transactions/999999", json={"amount": 1}).status_code == 404
+
+def test_api_delete_transaction(client_initialiser, db_initialiser, first_account, booked_transactions):
+    response = client_initialiser.delete(f"/api/accounts/{first_account.id}/transactions/{booked_transactions[1]}")
+    assert response.status_code == 200
+    assert response.json["detail"] == "Successfully deleted the transaction."
+    assert saldos(db_initialiser, first_account) == [100, 125]
+
+    response = client_initialiser.delete(f"/api/accounts/{first_account.id}/transactions/{booked_transactions[1]}")
+    assert response.status_code == 404
+
+def test_edit_transaction_statements(client_initialiser, first_account, booked_transactions):
+    from tests.conftest import QueryCounter
+
+    with QueryCounter() as counter:
+        response = client_initialiser.patch(f"/api/accounts/{first_account.id}/transactions/{booked_transactions[0]}", json={"amount": 10})
+    assert response.status_code == 200
+    # The later saldos are shifted by one UPDATE, not read and written one by one
+    updates = [statement for statement in counter.statements if statement.startswith("UPDATE transactions")]
+    assert len(updates) == 2 # Later saldos, the edited transaction
+    assert "saldo + " in updates[0]
+
+def test_transfer_legs_keep_their_amounts(client_initialiser, db_initialiser, first_account, second_account):
+    client = client_initialiser
+    response = client.post(f"/api/accounts/{first_account.id}/subaccount_transfer", json={
+        "description": "Savings", "amount": 30, "recipient_account_id": second_account.id})
+    sender_id, recipient_id = [transaction["transaction_id"] for transaction in response.json["transactions"]]
+
+    response = client.patch(f"/api/accounts/{first_account.id}/transactions/{sender_id}", json={"amount": -50})
+    assert response.status_code == 400 and "cannot be changed" in response.json["detail"]
+    assert client.patch(f"/api/accounts/{first_account.id}/transactions/{sender_id}", json={"category": "Rent"}).status_code == 400
+    response = client.delete(f"/api/accounts/{second_account.id}/transactions/{recipient_id}")
+    assert response.status_code == 400 and "cannot be deleted" in response.json["detail"]
+    response = client.post(f"/accounts/{first_account.id}/transactions/{sender_id}/delete", follow_redirects=True)
+    assert "Subaccount transfers cannot be deleted" in response.data.decode()
+    assert saldos(db_initialiser, first_account) == [-30] and saldos(db_initialiser, second_account) == [30]
+
+    # The description can be corrected, with the amount unchanged (as posted by the edit form)
+    response = client.post(f"/accounts/{first_account.id}/transactions/{sender_id}/update", data={
+        "description": "Savings June", "category": "Transfer", "amount": -30}, follow_redirects=True)
+    assert "Successfully updated the transaction." in response.data.decode()
+
+    # Other transactions cannot become transfers
+    transaction_id = client.post(f"/api/accounts/{first_account.id}/transactions", json={
+        "description": "Rent", "amount": -50, "category": "Rent"}).json["transaction_id"]
+    assert client.patch(f"/api/accounts/{first_account.id}/transactions/{transaction_id}", json={"category": "Transfer"}).status_code == 400
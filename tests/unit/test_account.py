@@ -1,5 +1,6 @@
 import pytest
 from pprint import pprint
+from sqlalchemy.exc import NoResultFound, MultipleResultsFound
 
 ## Model tests (test the __init__ method)
 def test_valid_account_creation(account_initialiser):
@@ -52,7 +53,7 @@ def test_repr_method(account_initialiser):
     assert str(account) == "[Account] iban: GB29000060161331920000, title: John's Savings"
 
 
-## Account sub-function tests (create_account, generate_unique_iban ...)
+## Account sub-function tests (create_account, allocate_iban ...)
 def test_create_account_valid_account_creation(account_initialiser): # -> Sub function of create() route
     from project.accounts.accounts import create_account
 
@@ -113,46 +114,301 @@ def test_create_account_iban_duplicate(account_initialiser):
     assert "The IBAN is already taken by another account." in message2
 
 def test_create_account_iban_increases_and_duplicate_title(account_initialiser):
-    from project.accounts.accounts import create_account, generate_unique_iban
-
-    for i in range(5):
-        new_iban = generate_unique_iban()
-        assert new_iban.endswith(f"0{i}")
+    from project.accounts.accounts import create_account
+    from project.accounts.ibans import allocate_iban
+
+    from project.accounts.ibans import is_valid_iban
+    first_iban = allocate_iban()
+    assert create_account(first_iban, "Title")[0] == "success"
+    for i in range(1, 5):
+        new_iban = allocate_iban()
+        assert int(new_iban[-10:]) == int(first_iban[-10:]) + i
+        assert is_valid_iban(new_iban)
         status, message = create_account(new_iban, "Title")
         assert status == "success"
 
 def test_create_account_accounts_within_limit(account_initialiser):
-    from project.accounts.accounts import create_account, generate_unique_iban
+    from project.accounts.accounts import create_account
+    from project.accounts.ibans import allocate_iban
     Account = account_initialiser
 
     for _ in range(4):
-        iban = generate_unique_iban()
+        iban = allocate_iban()
         status, message = create_account(iban, "Title")
         assert status == "success"
 
     assert Account.query.count() == 4
 
 def test_create_account_accounts_at_limit(account_initialiser):
-    from project.accounts.accounts import create_account, generate_unique_iban
+    from project.accounts.accounts import create_account
+    from project.accounts.ibans import allocate_iban
     Account = account_initialiser
 
     for _ in range(5):
-        iban = generate_unique_iban()
+        iban = allocate_iban()
         status, message = create_account(iban, "Title")
         assert status == "success"
 
     assert Account.query.count() == 5
 
 def test_create_account_accounts_exceed_limit(account_initialiser):
-    from project.accounts.accounts import create_account, generate_unique_iban
+    from project.accounts.accounts import create_account
+    from project.accounts.ibans import allocate_iban
     Account = account_initialiser
 
     for _ in range(5):
-        iban = generate_unique_iban()
+        iban = allocate_iban()
         status, message = create_account(iban, "Title")
         assert status == "success"
 
-    iban = generate_unique_iban()
+    iban = allocate_iban()
     status, message = create_account(iban, "Title")
     assert status == "error"
     assert message == "Cannot add more than 5 accounts."
+
+## Account registry
+def test_account_registry_loads_accounts_once(account_initialiser):
+    from project.accounts.accounts import create_account
+    from project.accounts.registry import AccountRegistry
+    from tests.conftest import QueryCounter
+    Account = account_initialiser
+
+    create_account("GB29000060161331920001", "Main")
+    create_account("GB29000060161331920002", "Savings")
+    registry = AccountRegistry()
+
+    with QueryCounter() as counter:
+        accounts = registry.all()
+        assert registry.all() == accounts
+        assert [account.title for account in accounts] == ["Main", "Savings"]
+        assert registry.info(str(accounts[0].id)) == accounts[0]
+        assert registry.info(-1) is None and registry.info("abc") is None
+    assert counter.count == 2 # Version stamp and accounts of the account cache
+
+    with QueryCounter() as counter:
+        recipient = registry.find_recipient("Savings", "GB29...02")
+        assert isinstance(recipient, Account) and recipient.id == accounts[1].id
+        assert registry.get(str(accounts[1].id)) is recipient
+        assert registry.get("abc") is None
+    assert counter.count == 1
+
+    create_account("GB29000060161331920102", "Savings")
+    registry.forget()
+    with pytest.raises(MultipleResultsFound):
+        registry.find_recipient("Savings", "GB29...02")
+    with pytest.raises(NoResultFound):
+        registry.find_recipient("Unknown", "GB29...02")
+
+def test_account_registry_outside_request(app_initialiser):
+    from project.accounts.registry import account_registry
+    assert account_registry() is not account_registry()
+
+## Account cache
+def test_account_cache_invalidated_by_writes(account_initialiser):
+    from project.accounts.accounts import create_account
+    from project.accounts.cache import cached_accounts
+    from project.db import db_session
+    from tests.conftest import QueryCounter
+    Account = account_initialiser
+
+    def titles():
+        return [account.title for account in cached_accounts()]
+
+    create_account("GB29000060161331920001", "Main")
+    assert titles() == ["Main"]
+    with QueryCounter() as counter:
+        assert titles() == ["Main"]
+    assert counter.count == 0
+
+    create_account("GB29000060161331920002", "Savings")
+    assert titles() == ["Main", "Savings"]
+
+    account = Account.query.filter_by(title="Main").one()
+    account.title = "Checking"
+    db_session.commit()
+    assert titles() == ["Checking", "Savings"]
+
+    # Rolled back writes keep the cache
+    account.title = "Discarded"
+    db_session.flush()
+    db_session.rollback()
+    with QueryCounter() as counter:
+        assert titles() == ["Checking", "Savings"]
+    assert counter.count == 0
+
+    Account.query.delete()
+    db_session.commit()
+    assert titles() == []
+
+def test_account_cache_sees_writes_of_other_workers(app_initialiser, account_initialiser):
+    from sqlalchemy import insert
+    from project.accounts.cache import cached_accounts, bump_accounts_version
+    from project.db import get_engine
+    app = app_initialiser[0]
+    Account = account_initialiser
+
+    with app.app_context():
+        app.config["ACCOUNT_CACHE_CHECK_SECONDS"] = 60
+        assert cached_accounts() == ()
+
+        # Another worker process creates an account
+        with get_engine().begin() as connection:
+            connection.execute(insert(Account), {"title": "Main", "iban": "GB29000060161331920001"})
+            bump_accounts_version(connection)
+        assert cached_accounts() == () # Version not checked again yet
+
+        app.config["ACCOUNT_CACHE_CHECK_SECONDS"] = 0
+        assert [account.title for account in cached_accounts()] == ["Main"]
+
+## IBANs
+def test_iban_check_digits():
+    from project.accounts.ibans import format_iban, is_valid_iban
+
+    assert is_valid_iban("GB82 WEST 1234 5698 7654 32")
+    assert not is_valid_iban("GB29000060161331920001")
+    assert format_iban(1331920001) == "GB07000060161331920001"
+    assert all(is_valid_iban(format_iban(number)) for number in range(1331920000, 1331920100))
+
+def test_allocate_iban_continues_after_existing_accounts(account_initialiser):
+    from sqlalchemy import delete
+    from project.accounts.accounts import create_account
+    from project.accounts.ibans import allocate_iban, account_numbers
+    from project.db import db_session
+    from project.models import IdBlock
+    from tests.conftest import QueryCounter
+
+    create_account("GB29000060161331920102", "Legacy") # IBAN of earlier versions
+    db_session.execute(delete(IdBlock).where(IdBlock.name == account_numbers.name))
+    db_session.commit()
+    account_numbers.reset()
+
+    assert allocate_iban()[-10:] == "1331920103"
+    with QueryCounter() as counter:
+        assert allocate_iban()[-10:] == "1331920104"
+    assert counter.count == 0 # From the reserved block
+
+def test_create_account_statements(account_initialiser):
+    from project.accounts.accounts import create_account
+    from project.accounts.cache import cached_accounts
+    from project.accounts.ibans import allocate_iban
+    from tests.conftest import QueryCounter
+
+    iban = allocate_iban()
+    cached_accounts()
+    with QueryCounter() as counter:
+        assert create_account(iban, "Main")[0] == "success"
+    # No IBAN query: the account count of the limit, the INSERT and the account cache version (project/accounts/cache.py)
+    assert [statement.split()[0] for statement in counter.statements] == ["SELECT", "INSERT", "UPDATE"]
+
+def test_create_account_limit_with_stale_cache(account_initialiser, app_initialiser):
+    from project.accounts.accounts import create_account
+    from project.accounts.cache import cached_accounts
+    from project.accounts.ibans import allocate_iban
+    from project.accounts.cache import bump_accounts_version
+    from project.db import get_engine
+    from sqlalchemy import insert
+    Account = account_initialiser
+    app_initialiser[0].config["ACCOUNT_CACHE_CHECK_SECONDS"] = 60
+
+    assert create_account(allocate_iban(), "Main")[0] == "success"
+    assert len(cached_accounts()) == 1
+    # Created by another process: the account cache of this one still holds a single account
+    with get_engine().begin() as connection:
+        connection.execute(insert(Account.__table__), [{"iban": allocate_iban(), "title": f"Other {i}"} for i in range(4)])
+        bump_accounts_version(connection)
+    assert len(cached_accounts()) == 1
+
+    assert create_account(allocate_iban(), "Sixth") == ("error", "Cannot add more than 5 accounts.")
+    assert Account.query.count() == 5
+
+## Deletion
+def test_purge_account_history_in_chunks(account_initialiser):
+    from datetime import datetime
+    from project.accounts.accounts import create_account
+    from project.accounts.ibans import allocate_iban
+    from project.accounts.purge import purge_account_history
+    from project.db import db_session
+    from project.models import Transaction, ArchivedTransaction
+    from tests.conftest import QueryCounter
+    Account = account_initialiser
+
+    create_account(allocate_iban(), "Main")
+    create_account(allocate_iban(), "Savings")
+    main, savings = Account.query.order_by(Account.id).all()
+    for account in [main, main, main, main, main, savings]:
+        account.transactions.append(Transaction(description="Rent", amount=-10, category="Rent"))
+    db_session.add(ArchivedTransaction(id=1000, description="Old", amount=5, category="Rent", utc_datetime_booked=datetime(2020, 1, 1), account_id=main.id))
+    db_session.commit()
+
+    with QueryCounter() as counter:
+        assert purge_account_history(main.id, size=2) == 6
+    deletes = [statement for statement in counter.statements if statement.startswith("DELETE")]
+    assert len(deletes) == 4 # 2 + 2 + 1 transactions, 1 archived transaction
+    assert Transaction.query.filter_by(account_id=main.id).count() == 0
+    assert ArchivedTransaction.query.filter_by(account_id=main.id).count() == 0
+    assert Transaction.query.filter_by(account_id=savings.id).count() == 1
+
+def test_delete_account_does_not_load_transactions(account_initialiser):
+    from project.accounts.accounts import create_account
+    from project.accounts.ibans import allocate_iban
+    from project.accounts.purge import delete_account, account_purger
+    from project.db import db_session
+    from project.models import Transaction
+    from tests.conftest import QueryCounter
+    Account = account_initialiser
+
+    create_account(allocate_iban(), "Main")
+    create_account(allocate_iban(), "Savings")
+    account = Account.query.filter_by(title="Main").one()
+    for _ in range(3):
+        account.transactions.append(Transaction(description="Rent", amount=-10, category="Rent"))
+    db_session.commit()
+
+    with QueryCounter() as counter:
+        delete_account(account)
+        account_purger.stop() # Waits for the background purge
+    assert not any("transactions.description" in statement for statement in counter.statements) # No ORM loads
+    assert [account.title for account in Account.query.all()] == ["Savings"]
+    assert Transaction.query.count() == 0
+
+def test_purge_deleted_accounts(account_initialiser, monkeypatch):
+    from project.accounts.accounts import create_account
+    from project.accounts.ibans import allocate_iban
+    from project.accounts.purge import delete_account, account_purger, purge_deleted_accounts
+    from project.db import db_session
+    from project.models import Transaction, AccountDeletion
+    from project.queries import get_account
+    Account = account_initialiser
+
+    create_account(allocate_iban(), "Main")
+    create_account(allocate_iban(), "Savings")
+    account = Account.query.filter_by(title="Main").one()
+    account.transactions.append(Transaction(description="Rent", amount=-10, category="Rent"))
+    db_session.commit()
+    account_id = account.id
+
+    # A deletion whose background purge did not run, e.g. because the process was restarted
+    monkeypatch.setattr(account_purger, "submit", lambda account_id, size=None: None)
+    delete_account(account)
+    assert get_account(account_id) is None
+    assert Transaction.query.count() == 1
+
+    assert purge_deleted_accounts() == 1
+    assert [account.title for account in Account.query.all()] == ["Savings"]
+    assert Transaction.query.count() == 0 and AccountDeletion.query.count() == 0
+    assert purge_deleted_accounts() == 0
+
+def test_deleting_account_row_cascades_to_transactions():
+    from datetime import datetime
+    from sqlalchemy import insert, delete, select, func
+    from project.db import Base, create_configured_engine
+    from project.models import Account, Transaction, ArchivedTransaction
+
+    engine = create_configured_engine("sqlite://")
+    Base.metadata.create_all(bind=engine, tables=[Account.__table__, Transaction.__table__, ArchivedTransaction.__table__])
+    with engine.begin() as connection:
+        connection.execute(insert(Account), {"id": 1, "title": "Main", "iban": "GB07000060161331920001"})
+        connection.execute(insert(Transaction), [{"description": "Rent", "amount": -10, "category": "Rent",
+                                                  "utc_datetime_booked": datetime(2023, 9, 1), "account_id": 1}] * 3)
+        connection.execute(delete(Account).where(Account.id == 1))
+        assert connection.execute(select(func.count()).select_from(Transaction)).scalar() == 0
@@ -0,0 +1,25 @@
+def test_create_app_without_database_access():
+    from tests.conftest import QueryCounter
+    from project import create_app
+
+    with QueryCounter() as counter:
+        app = create_app(test_setup=True)
+
+    assert counter.count == 0
+    assert app.wsgi_app.api_app is None
+
+
+def test_api_created_on_first_api_request(app_initialiser):
+    app = app_initialiser[0]
+    client = app.test_client()
+
+    client.get('/accounts/')
+    assert app.wsgi_app.api_app is None
+
+    response = client.get('/api/accounts')
+    assert response.status_code == 200
+    api_app = app.wsgi_app.api_app
+    assert api_app is not None
+
+    client.get('/api/accounts')
+    assert app.wsgi_app.api_app is api_app
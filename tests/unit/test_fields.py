@@ -0,0 +1,22 @@
+from project.fields import select_fields, shape_list
+
+
+def test_select_fields():
+    document = {"id": "1", "title": "Main", "iban": "GB07000060161331920001"}
+    assert select_fields(document) is document
+    assert select_fields(document, ["iban", "id"]) == {"iban": "GB07000060161331920001", "id": "1"}
+
+def test_shape_list():
+    from project.models import TransactionRow
+    from project.transactions.api import transaction_to_json, TRANSACTION_FIELDS
+    rows = [TransactionRow(1, "Salary", 100, 100, "Salary", None, 7), TransactionRow(2, "Rent", -40, 60, "Rent", None, 7)]
+
+    # Unchanged, encoded while the response is serialised
+    assert shape_list(rows, transaction_to_json, TRANSACTION_FIELDS) == rows
+
+    assert shape_list(rows, transaction_to_json, TRANSACTION_FIELDS, ["transaction_id", "saldo"]) == [
+        {"transaction_id": 1, "saldo": 100}, {"transaction_id": 2, "saldo": 60}]
+    assert shape_list(rows, transaction_to_json, TRANSACTION_FIELDS, ["saldo"], compact=True) == {"fields": ["saldo"], "rows": [[100], [60]]}
+    compact = shape_list(iter(rows), transaction_to_json, TRANSACTION_FIELDS, compact=True)
+    assert compact["fields"] == list(TRANSACTION_FIELDS)
+    assert compact["rows"][0] == [7, 1, 100, 100, "Salary", "Salary", None]
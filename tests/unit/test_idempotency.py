@@ -0,0 +1,51 @@
+import pytest
+import time
+from datetime import datetime, timedelta
+
+
+def test_recent_keys_cache_lru():
+    from project.idempotency import RecentKeysCache
+    cache = RecentKeysCache()
+
+    cache.set("a", ("fp", 201, "{}"), ttl_seconds=60, max_size=2)
+    cache.set("b", ("fp", 201, "{}"), ttl_seconds=60, max_size=2)
+    assert cache.get("a") == ("fp", 201, "{}") # a is now the most recently used key
+    cache.set("c", ("fp", 201, "{}"), ttl_seconds=60, max_size=2)
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+def test_recent_keys_cache_ttl():
+    from project.idempotency import RecentKeysCache
+    cache = RecentKeysCache()
+
+    cache.set("a", ("fp", 201, "{}"), ttl_seconds=0.01, max_size=2)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+def test_purge_expired_keys(app_initialiser):
+    from project.models import IdempotencyKey
+    from project.idempotency import purge_expired_keys
+    _, _, _, db_session = app_initialiser
+
+    db_session.add(IdempotencyKey(key="old", request_fingerprint="fp", status_code=201, response_body="{}", utc_datetime_created=datetime.utcnow() - timedelta(days=2)))
+    db_session.add(IdempotencyKey(key="new", request_fingerprint="fp", status_code=201, response_body="{}", utc_datetime_created=datetime.utcnow()))
+    db_session.commit()
+
+    assert purge_expired_keys(24 * 60 * 60) == 1
+    assert [key.key for key in IdempotencyKey.query.all()] == ["new"]
+
+def test_purge_idempotency_keys_command_default_ttl(app_initialiser):
+    from project.models import IdempotencyKey
+    app, _, _, db_session = app_initialiser
+    app.config.pop("IDEMPOTENCY_KEY_TTL_SECONDS", None)
+
+    db_session.add(IdempotencyKey(key="old", request_fingerprint="fp", status_code=201, response_body="{}", utc_datetime_created=datetime.utcnow() - timedelta(days=2)))
+    db_session.commit()
+
+    result = app.test_cli_runner().invoke(args=["purge-idempotency-keys"])
+    assert result.exit_code == 0
+    assert "Deleted 1 expired idempotency keys." in result.output
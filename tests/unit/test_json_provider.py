@@ -0,0 +1,54 @@
+import pytest
+from datetime import datetime, date
+from decimal import Decimal
+import pytz
+
+
+## Test fixtures
+@pytest.fixture(params=["orjson", "json"])
+def json_app(request, monkeypatch):
+    '''App with FastJSONProvider, using orjson and the standard library fallback.'''
+    from flask import Flask
+    from project import json_provider
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(json_provider, "orjson", None)
+    app = Flask(__name__)
+    app.json = json_provider.FastJSONProvider(app)
+    return app
+
+@pytest.fixture()
+def provider(json_app):
+    return json_app.json
+
+
+## Encoding
+def test_decimal_and_datetimes(provider):
+    encoded = provider.loads(provider.dumps({
+        "amount": Decimal("-12.50"),
+        "naive": datetime(2023, 9, 4, 12, 0),
+        "utc": datetime(2023, 9, 4, 12, 0, 0, 500, tzinfo=pytz.UTC),
+        "date": date(2023, 9, 4),
+    }))
+    assert encoded == {"amount": -12.5, "naive": "2023-09-04T12:00:00+00:00", "utc": "2023-09-04T12:00:00.000500+00:00", "date": "2023-09-04"}
+
+def test_transaction_rows(provider):
+    import project.transactions.api # Registers the transaction encoder
+    from project.models import TransactionRow
+
+    row = TransactionRow(7, "Rent", Decimal("-500.00"), Decimal("1500.00"), "Rent", datetime(2023, 9, 1), 2)
+    assert provider.loads(provider.dumps({"transactions": [row]})) == {"transactions": [{
+        "account_id": 2, "transaction_id": 7, "amount": -500.0, "saldo": 1500.0, "description": "Rent",
+        "category": "Rent", "utc_datetime_booked": "2023-09-01T00:00:00+00:00"}]}
+
+def test_unknown_type(provider):
+    with pytest.raises(TypeError):
+        provider.dumps({"value": object()})
+
+def test_indent_and_response(json_app, provider):
+    assert provider.dumps([1], indent=2) == "[\n  1\n]"
+    with json_app.app_context():
+        response = provider.response(status="success")
+    assert response.mimetype == "application/json"
+    assert provider.loads(response.get_data()) == {"status": "success"}
@@ -0,0 +1,71 @@
+import json
+import logging
+from decimal import Decimal
+
+
+def record(message, *args, level=logging.INFO, exc_info=None, **extra):
+    log_record = logging.LogRecord("project.test", level, __file__, 1, message, args, exc_info)
+    log_record.__dict__.update(extra)
+    return log_record
+
+def test_json_formatter():
+    import sys
+    from project.log import JSONFormatter
+    formatter = JSONFormatter()
+
+    document = json.loads(formatter.format(record("Created transaction %s", 5, sampled=True, transaction_id=5, amount=Decimal("12.50"))))
+    assert document["message"] == "Created transaction 5"
+    assert document["level"] == "INFO" and document["logger"] == "project.test"
+    assert document["transaction_id"] == 5 and document["amount"] == 12.5
+    assert "sampled" not in document and "exception" not in document
+
+    try:
+        raise ZeroDivisionError("boom")
+    except ZeroDivisionError:
+        document = json.loads(formatter.format(record("Failed", level=logging.ERROR, exc_info=sys.exc_info())))
+    assert document["exception"].endswith("ZeroDivisionError: boom")
+
+def test_sampling_filter():
+    from project.log import SamplingFilter
+    sampling_filter = SamplingFilter(0.25)
+    assert [sampling_filter.filter(record("Created", sampled=True)) for _ in range(8)].count(True) == 2
+    assert all(sampling_filter.filter(record("Failed")) for _ in range(8)) # Not sampled
+
+    sampling_filter.rate = 0
+    assert not any(sampling_filter.filter(record("Created", sampled=True)) for _ in range(8))
+
+def test_background_handler_writes_in_listener_thread():
+    import threading
+    from project.log import BackgroundLogHandler, JSONFormatter
+
+    class Collector(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.records = []
+        def emit(self, log_record):
+            self.records.append((threading.current_thread(), self.format(log_record)))
+
+    collector = Collector()
+    collector.setFormatter(JSONFormatter())
+    handler = BackgroundLogHandler(collector)
+    handler.handle(record("Rejected: %s", "amount is 0", reason="invalid"))
+    handler.stop() # Writes everything queued
+
+    [(thread, line)] = collector.records
+    assert thread is not threading.current_thread()
+    assert json.loads(line)["message"] == "Rejected: amount is 0"
+    assert json.loads(line)["reason"] == "invalid"
+
+def test_configure_logging():
+    from project.log import configure_logging, parse_levels
+    assert parse_levels("project.transactions=warning, sqlalchemy.engine=INFO,") == {"project.transactions": "WARNING", "sqlalchemy.engine": "INFO"}
+
+    handler = configure_logging({"LOG_LEVEL": "WARNING", "LOG_LEVELS": "project.transactions=DEBUG", "LOG_SAMPLE_RATE": 0.5})
+    try:
+        assert configure_logging({"LOG_LEVEL": "WARNING", "LOG_LEVELS": "project.transactions=DEBUG", "LOG_SAMPLE_RATE": 0.5}) is handler
+        assert logging.getLogger().handlers.count(handler) == 1
+        assert logging.getLogger().level == logging.WARNING
+        assert logging.getLogger("project.transactions").level == logging.DEBUG
+        assert handler.filters[0].rate == 0.5
+    finally:
+        configure_logging({"LOG_LEVELS": "project.transactions=NOTSET"})
@@ -0,0 +1,43 @@
+import pytest
+from decimal import Decimal
+
+
+## Conversion
+def test_to_amount_without_float_artefacts():
+    from project.money import to_amount
+
+    assert Decimal(0.1) != Decimal("0.1")
+    assert to_amount(0.1) == Decimal("0.10")
+    assert str(to_amount(0.1) + to_amount(0.2)) == "0.30"
+    assert to_amount(1.005) == Decimal("1.01") # Rounded half up from its shortest representation
+    assert to_amount(-12) == Decimal("-12.00")
+    assert to_amount("7.5") == Decimal("7.50")
+
+def test_transaction_amounts_rounded_to_cents():
+    from project.models import Transaction
+
+    assert Transaction(description="Groceries", amount=0.1, category="Groceries").amount == Decimal("0.10")
+    with pytest.raises(ValueError, match="The amount variable must be non-zero decimal, integer or float."):
+        Transaction(description="Groceries", amount=0.001, category="Groceries")
+
+
+## Column type
+@pytest.mark.parametrize("storage, stored", [("decimal", 12.5), ("cents", 1250)])
+def test_money_column_storage(storage, stored):
+    from sqlalchemy import MetaData, Table, Column, Integer, insert, select, func, text
+    from project.db import create_configured_engine, configure_engine
+    from project.money import Money
+    from config import Config
+
+    configure_engine(Config.DATABASE_URL, amount_storage=storage)
+    try:
+        engine = create_configured_engine("sqlite://")
+        table = Table("amounts", MetaData(), Column("id", Integer, primary_key=True), Column("amount", Money()))
+        table.create(engine)
+        with engine.begin() as connection:
+            connection.execute(insert(table), [{"amount": 12.5}, {"amount": Decimal("0.10")}, {"amount": 0.2}])
+            assert connection.execute(text("SELECT amount FROM amounts WHERE id = 1")).scalar() == stored
+            assert connection.execute(select(table.c.amount).order_by(table.c.id)).scalars().all() == [Decimal("12.50"), Decimal("0.10"), Decimal("0.20")]
+            assert connection.execute(select(func.sum(table.c.amount))).scalar() == Decimal("12.80")
+    finally:
+        configure_engine(Config.DATABASE_URL)
@@ -0,0 +1,84 @@
+import pytest
+from datetime import datetime, timedelta
+import pytz
+
+
+## Test fixtures
+@pytest.fixture()
+def account_with_transactions(db_initialiser):
+    Account, Transaction, db_session = db_initialiser
+    from project.transactions.transactions import create_transaction
+
+    account = Account(title="Queries", iban="GB29000060161331920010")
+    db_session.add(account)
+    db_session.commit()
+    now = datetime.utcnow()
+    for description, amount, days_ago in [("Salary", 1000, 30), ("Rent", -400, 20), ("Rent refund", 50, 10)]:
+        create_transaction(account, description, amount, "Rent", (now - timedelta(days=days_ago)).replace(tzinfo=pytz.UTC))
+    return account
+
+
+## Accounts
+def test_account_lookups(account_with_transactions):
+    from project.queries import get_account, get_account_by_iban, iban_exists
+
+    assert get_account(account_with_transactions.id) is account_with_transactions
+    assert get_account(-1) is None
+    assert get_account_by_iban("GB29000060161331920010") is account_with_transactions
+    assert get_account_by_iban("GB29000060161331920011") is None
+    assert iban_exists("GB29000060161331920010") and not iban_exists("GB29000060161331920011")
+
+def test_search_accounts(account_with_transactions):
+    from project.queries import search_accounts
+
+    assert search_accounts("", 10) == [] # No rows instead of an empty range
+    assert [row.title for row in search_accounts("qUE", 10)] == ["Queries"]
+    assert [row.title for row in search_accounts("gb29 0000", 10)] == ["Queries"]
+    assert search_accounts("Quer ", 10) == []
+
+## Transactions
+def test_saldo_before(account_with_transactions):
+    from project.queries import saldo_before
+
+    assert saldo_before(account_with_transactions.id, datetime.utcnow() - timedelta(days=15)) == 600
+    assert saldo_before(account_with_transactions.id, datetime.utcnow() - timedelta(days=60)) is None
+
+def test_account_transactions_filters(account_with_transactions):
+    from project.models import Transaction
+    from project.queries import account_transactions
+
+    account_id = account_with_transactions.id
+    def descriptions(**filters):
+        return [transaction.description for transaction in account_transactions(Transaction, account_id, **filters)]
+
+    assert descriptions() == ["Rent refund", "Rent", "Salary"]
+    assert descriptions(booked_from=datetime.utcnow() - timedelta(days=25)) == ["Rent refund", "Rent"]
+    assert descriptions(booked_before=datetime.utcnow() - timedelta(days=15)) == ["Rent", "Salary"]
+    assert descriptions(description="rent") == ["Rent refund", "Rent"]
+    assert descriptions(description="Rent", exact_description=True) == ["Rent"]
+    assert descriptions(description="") == ["Rent refund", "Rent", "Salary"]
+
+def test_account_transactions_statements_reused(account_with_transactions):
+    from project.models import Transaction
+    from project.queries import account_transactions, _account_transactions_statements
+
+    account_transactions(Transaction, account_with_transactions.id, description="Rent")
+    statements = dict(_account_transactions_statements)
+    account_transactions(Transaction, account_with_transactions.id, description="Salary")
+    assert _account_transactions_statements == statements
+
+def test_read_all_as_rows(account_with_transactions):
+    from project.db import db_session
+    from project.models import Transaction, TransactionRow
+
+    account_id = account_with_transactions.id
+    db_session.expunge_all()
+    rows = Transaction.read_all(account_id=account_id, transaction_description="rent", as_rows=True)
+    assert all(isinstance(row, TransactionRow) for row in rows)
+    assert [(row.description, row.amount, row.saldo) for row in rows] == [("Rent refund", 50, 650), ("Rent", -400, 600)]
+    assert len(db_session.identity_map) == 0 # Nothing hydrated
+    assert rows == [TransactionRow(*[getattr(transaction, field) for field in TransactionRow._fields])
+                    for transaction in Transaction.read_all(account_id=account_id, transaction_description="rent")]
+
+    months = Transaction.group_by_month(Transaction.read_all(account_id=account_id, as_rows=True))
+    assert sum(month["total"] for year in months.values() for month in year.values()) == 650
@@ -0,0 +1,144 @@
+import pytest
+from datetime import date
+
+## Generator tests
+def test_generator_is_deterministic_per_seed():
+    from project.seed import TransactionGenerator
+
+    rows_a = TransactionGenerator([1, 2, 3], seed=7, end_date=date(2023, 9, 1)).rows(500)
+    rows_b = TransactionGenerator([1, 2, 3], seed=7, end_date=date(2023, 9, 1)).rows(500)
+    rows_c = TransactionGenerator([1, 2, 3], seed=8, end_date=date(2023, 9, 1)).rows(500)
+
+    assert rows_a == rows_b
+    assert rows_a != rows_c
+
+def test_generator_categories_and_transfers():
+    from project.seed import TransactionGenerator
+
+    rows = TransactionGenerator([1, 2], seed=1, end_date=date(2023, 9, 1)).rows(2000)
+    assert len(rows) == 2000
+    assert {row[3] for row in rows} == {"Transfer", "Salary", "Rent", "Utilities", "Groceries", "Night out", "Online services"}
+
+    # Salaries are income, all other non-transfer categories are expenses
+    assert all(row[2] > 0 for row in rows if row[3] == "Salary")
+    assert all(row[2] < 0 for row in rows if row[3] not in ["Salary", "Transfer"])
+
+    # Transfers are booked on both accounts and cancel out
+    assert sum(row[2] for row in rows if row[3] == "Transfer") == 0
+
+def test_generator_single_account_has_no_transfers():
+    from project.seed import TransactionGenerator
+
+    rows = TransactionGenerator([1], seed=1).rows(500)
+    assert len(rows) == 500
+    assert "Transfer" not in {row[3] for row in rows}
+
+def test_calculate_saldos_matches_definition():
+    from project.seed import calculate_saldos
+
+    rows = [
+        (1, "b", 300, "Salary", 20),
+        (1, "a", -100, "Rent", 10),
+        (2, "c", 50, "Salary", 10),
+        (1, "d", -20, "Groceries", 20), # Same booking time as "b": neither is older than the other
+        (1, "e", -5, "Groceries", 30),
+    ]
+    saldos = calculate_saldos(rows)
+
+    assert [row[1] for row in rows] == ["a", "b", "d", "e", "c"]
+    assert saldos == [-100, 200, -120, 175, 50]
+
+def test_copy_transactions_with_psycopg_and_psycopg2():
+    from contextlib import contextmanager
+    from types import SimpleNamespace
+    from project.seed import TransactionGenerator, copy_transactions, COPY_TRANSACTIONS
+
+    class Psycopg2Cursor:
+        def copy_expert(self, sql, file):
+            copied.append((sql, file.read()))
+
+    class PsycopgCursor: # psycopg (3) has no copy_expert()
+        @contextmanager
+        def copy(self, sql):
+            copy = SimpleNamespace(data=[])
+            copy.write = copy.data.append
+            yield copy
+            copied.append((sql, "".join(copy.data)))
+
+    generator = TransactionGenerator([1], seed=1, end_date=date(2023, 9, 1))
+    rows = [(1, "Rent", -1050, "Rent", 0), (1, "Salary", 250000, "Salary", 86400)]
+    copied = []
+    for driver, cursor in [("psycopg2", Psycopg2Cursor()), ("psycopg", PsycopgCursor())]:
+        connection = SimpleNamespace(dialect=SimpleNamespace(name="postgresql", driver=driver),
+                                     connection=SimpleNamespace(cursor=lambda cursor=cursor: cursor))
+        copy_transactions(connection, generator, rows, [-1050, 248950])
+
+    assert copied[0] == copied[1]
+    assert copied[0][0] == COPY_TRANSACTIONS
+    assert [line.split(",")[2] for line in copied[0][1].splitlines()] == ["-10.50", "2500.00"]
+
+
+## Database tests
+def test_seed_database(db_initialiser):
+    from project.seed import seed_database
+    from project.db import get_engine
+    Account, Transaction, db_session = db_initialiser
+
+    account_ids = seed_database(get_engine(), num_accounts=3, num_transactions=300, seed=3)
+
+    assert Account.query.count() == 3
+    assert Transaction.query.count() == 300
+    assert sorted(account.id for account in Account.query.all()) == sorted(account_ids)
+    from project.accounts.ibans import is_valid_iban
+    assert all(is_valid_iban(account.iban) for account in Account.query.all())
+
+    # Stored saldos equal the ones calculate_saldo computes
+    for transaction in Transaction.query.order_by(Transaction.id).limit(50).all():
+        stored_saldo = transaction.saldo
+        transaction.calculate_saldo()
+        assert transaction.saldo == stored_saldo
+
+def test_seed_database_replaces_existing_data(db_initialiser):
+    from project.seed import seed_database
+    from project.db import get_engine
+    Account, Transaction, db_session = db_initialiser
+
+    seed_database(get_engine(), num_accounts=2, num_transactions=100, seed=1)
+    seed_database(get_engine(), num_accounts=4, num_transactions=50, seed=1)
+
+    assert Account.query.count() == 4
+    assert Transaction.query.count() == 50
+
+def test_seed_database_replaces_archive(db_initialiser):
+    from datetime import datetime
+    from project.seed import seed_database
+    from project.db import get_engine
+    from project.archive import archive_transactions, archived_before
+    from project.models import ArchivedTransaction, ArchiveBoundary
+    Account, Transaction, db_session = db_initialiser
+
+    seed_database(get_engine(), num_accounts=2, num_transactions=100, seed=1, months=6, end_date=date(2023, 9, 1))
+    assert archive_transactions(datetime(2023, 6, 1)) > 0
+    account_ids = seed_database(get_engine(), num_accounts=2, num_transactions=50, seed=1, months=6, end_date=date(2023, 9, 1))
+
+    assert ArchivedTransaction.query.count() == 0 and ArchiveBoundary.query.count() == 0
+    assert archived_before(account_ids[0]) is None # Not cached from before the reseed
+    assert Transaction.query.count() == 50
+
+def test_seed_command(app_initialiser, db_initialiser):
+    app = app_initialiser[0]
+    Account, Transaction, db_session = db_initialiser
+
+    result = app.test_cli_runner().invoke(args=["seed", "--accounts", "2", "--transactions", "120", "--seed", "5"])
+
+    assert result.exit_code == 0
+    assert "Seeded 2 accounts and 120 transactions" in result.output
+    assert Account.query.count() == 2
+    assert Transaction.query.count() == 120
+    assert Transaction.query.filter(Transaction.saldo == None).count() == 0
+
+def test_seed_command_invalid_accounts(app_initialiser):
+    app = app_initialiser[0]
+
+    result = app.test_cli_runner().invoke(args=["seed", "--accounts", "0"])
+    assert result.exit_code != 0
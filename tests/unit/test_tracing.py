@@ -0,0 +1,70 @@
+import json
+
+
+def test_spans_nest_through_context():
+    from project import tracing
+    tracing._sample_rate = 1.0
+    try:
+        root = tracing.start_span("request", root=True)
+        with tracing.span("read_all") as read_all:
+            assert tracing.current_span() is read_all
+            with tracing.span("sql", statement="SELECT 1") as sql:
+                pass
+        root.end()
+    finally:
+        tracing._sample_rate = 0.0
+
+    assert tracing.current_span() is None
+    assert read_all.parent_id == root.span_id and sql.parent_id == read_all.span_id
+    assert read_all.trace_id == sql.trace_id == root.trace_id
+    assert root.end_ns >= read_all.end_ns >= sql.end_ns
+
+def test_no_spans_without_sampling():
+    from project import tracing
+
+    @tracing.traced("add")
+    def add(one, two):
+        return one + two
+
+    assert tracing.start_span("request", root=True) is None
+    with tracing.span("read_all") as read_all:
+        assert read_all is None
+    assert add(1, 2) == 3 and tracing.current_span() is None
+
+def test_span_records_error():
+    from project import tracing
+    tracing._sample_rate = 1.0
+    try:
+        root = tracing.start_span("request", root=True)
+        try:
+            with tracing.span("create_transaction") as failed:
+                raise ValueError("amount is 0")
+        except ValueError:
+            pass
+        root.end()
+    finally:
+        tracing._sample_rate = 0.0
+    assert failed.error == "ValueError: amount is 0" and root.error is None
+
+def test_exporter_writes_jsonl_and_otlp(tmp_path):
+    from project.tracing import Span, SpanExporter, otlp_payload
+    from project import tracing
+
+    root = Span("GET /accounts", "ab" * 16, None, {"http.status_code": 200})
+    child = Span("sql", root.trace_id, root.span_id, {"statement": "SELECT 1"})
+    for span in (child, root):
+        span.end_ns = span.start_ns + 1000
+    tracing._current_span.set(None)
+
+    exporter = SpanExporter(tmp_path / "spans.jsonl", max_batch=1)
+    exporter.export(child)
+    exporter.export(root)
+    exporter.stop()
+    lines = [json.loads(line) for line in (tmp_path / "spans.jsonl").read_text().splitlines()]
+    assert [line["name"] for line in lines] == ["sql", "GET /accounts"]
+    assert lines[0]["parent_id"] == lines[1]["span_id"] and lines[0]["duration_ms"] == 0.001
+
+    [otlp_span, otlp_root] = otlp_payload([child, root])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert otlp_span["parentSpanId"] == root.span_id and "parentSpanId" not in otlp_root
+    assert otlp_root["attributes"] == [{"key": "http.status_code", "value": {"intValue": "200"}}]
+    assert otlp_span["endTimeUnixNano"] == str(child.start_ns + 1000)
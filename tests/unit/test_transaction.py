@@ -203,21 +203,24 @@ def test_get_recipient_account_valid(bulk_accounts):
     assert third.id == next((account for account in bulk_accounts if account.iban.endswith("03")), None).id
 
 @pytest.fixture()
-def configure_transfer_form(app_initialiser, bulk_accounts):
+def transfer_sender(bulk_accounts):
+    # Assing account with iban ending "02" as current account
+    sender_account =  next((account for account in bulk_accounts if account.iban.endswith("02")), None)
+    assert sender_account.iban == "DE89370400440532013002"
+    return sender_account
+
+@pytest.fixture()
+def configure_transfer_form(app_initialiser, bulk_accounts, transfer_sender):
     app = app_initialiser[0]
     Account = app_initialiser[1]
     from project.transactions.transactions import update_transfer_form, SubaccountTransferForm
 
     assert Account.query.count() == len(bulk_accounts)
 
-    # Assing account with iban ending "02" as current account
-    sender_account =  next((account for account in bulk_accounts if account.iban.endswith("02")), None)
-    assert sender_account.iban == "DE89370400440532013002"
-
     with app.app_context():
         form = SubaccountTransferForm()
 
-        message, status = update_transfer_form(form, sender_account.id)
+        message, status = update_transfer_form(form, transfer_sender.id)
         assert status == "success"
 
         return form
@@ -244,13 +247,11 @@ def test_update_transfer_form_one_account_diabled(app_initialiser, valid_account
 
 def test_update_transfer_form_success(configure_transfer_form):
     form = configure_transfer_form
-    # Ensure default value is "Recipient" and sender account is not in choices
-    assert form.recipient.choices[0] == "Recipient"
-    assert len(form.recipient.choices) == 4 # "Recipient" + 3 accounts (not sender account)
-
-    assert form.recipient.choices == ["Recipient", "Main (DE89...00)", "Savings (DE89...01)", "Shared (DE89...03)" ]
+    # Recipients are searched (GET /api/accounts/search), the form itself does not list them
+    assert 'disabled' not in form.recipient.render_kw
+    assert form.recipient.render_kw["placeholder"] == "Recipient"
 
-def test_validate_transfer_data_valid_data(configure_transfer_form):
+def test_validate_transfer_data_valid_data(configure_transfer_form, transfer_sender, bulk_accounts):
     from project.transactions.transactions import validate_transfer_data
 
     # Starts with form with choices and validation added. Sender account has iban DE89370400440532013002
@@ -261,13 +262,18 @@ def test_validate_transfer_data_valid_data(configure_transfer_form):
     subaccount_transfer_form.amount.data = 100
     subaccount_transfer_form.recipient.data = "Main (DE89...00)"
 
-    title, fractional_iban = validate_transfer_data(subaccount_transfer_form)
+    recipient = validate_transfer_data(subaccount_transfer_form, transfer_sender.id)
 
     # Ensure form accepts input as valid
-    assert title == "Main"
-    assert fractional_iban == "DE89...00"
+    assert recipient.title == "Main"
+    assert recipient.iban == "DE89370400440532013000"
 
-def test_validate_transfer_data_invalid_recipient_format(configure_transfer_form):
+    # The recipient id chosen in the recipient search takes precedence
+    shared = next(account for account in bulk_accounts if account.title == "Shared")
+    subaccount_transfer_form.recipient_id.data = str(shared.id)
+    assert validate_transfer_data(subaccount_transfer_form, transfer_sender.id).id == shared.id
+
+def test_validate_transfer_data_invalid_recipient_format(configure_transfer_form, transfer_sender):
     from project.transactions.transactions import validate_transfer_data
 
     invalid_formats = [" ", "Invalid Format", None, "Main (DE89...00", "Savings DE89...01)", "Shared(DE89...03)", "Main(DE89..00)"]
@@ -281,9 +287,13 @@ def test_validate_transfer_data_invalid_recipient_format(configure_transfer_form
     for invalid_recipient_format in invalid_formats:
         subaccount_transfer_form.recipient.data = invalid_recipient_format
         with pytest.raises(ValueError, match="Form data is not valid."):
-            validate_transfer_data(subaccount_transfer_form)
+            validate_transfer_data(subaccount_transfer_form, transfer_sender.id)
+
+    subaccount_transfer_form.recipient_id.data = "abc"
+    with pytest.raises(ValueError, match="Form data is not valid."):
+        validate_transfer_data(subaccount_transfer_form, transfer_sender.id)
 
-def test_validate_transfer_data_invalid_recipient_account(configure_transfer_form):
+def test_validate_transfer_data_invalid_recipient_account(configure_transfer_form, transfer_sender):
     from project.transactions.transactions import validate_transfer_data
 
     recipient_sender_account = "Main (DE89...02)"
@@ -297,7 +307,15 @@ def test_validate_transfer_data_invalid_recipient_account(configure_transfer_for
 
     subaccount_transfer_form.recipient.data = recipient_sender_account
     with pytest.raises(ValueError, match="Form data is not valid."):
-        validate_transfer_data(subaccount_transfer_form)
+        validate_transfer_data(subaccount_transfer_form, transfer_sender.id)
+
+    subaccount_transfer_form.recipient_id.data = str(transfer_sender.id)
+    with pytest.raises(ValueError, match="Form data is not valid."):
+        validate_transfer_data(subaccount_transfer_form, transfer_sender.id)
+
+    subaccount_transfer_form.recipient_id.data = "99"
+    with pytest.raises(NoResultFound, match="Recipient account not found."):
+        validate_transfer_data(subaccount_transfer_form, transfer_sender.id)
 
 def test_process_sender_transaction_invalid_data(configure_transfer_form, bulk_accounts):
     from project.transactions.transactions import process_sender_transaction, TransactionError
@@ -0,0 +1,75 @@
+import pytest
+
+
+def resolved_schemas():
+    from connexion.json_schema import resolve_refs
+    from project import load_spec
+    return resolve_refs(load_spec())["components"]["schemas"]
+
+INSTANCES = {
+    "Transaction": [
+        {"description": "Tesco", "amount": -25.5, "category": "Groceries"},
+        {"description": "Tesco", "amount": 3, "category": "Groceries", "utc_datetime_booked": "2023-09-04T12:00:00+00:00"},
+        {"description": "Tesco", "amount": 3, "category": "Groceries", "extra": [1, 2]},
+        {"description": "", "amount": 3, "category": "Groceries"},
+        {"description": "A" * 81, "amount": 3, "category": "Groceries"},
+        {"description": "Tesco", "amount": 0, "category": "Groceries"},
+        {"description": "Tesco", "amount": 0.0, "category": "Groceries"},
+        {"description": "Tesco", "amount": True, "category": "Groceries"},
+        {"description": "Tesco", "amount": "3", "category": "Groceries"},
+        {"description": "Tesco", "amount": 3, "category": "Transfer"},
+        {"description": None, "amount": 3, "category": "Groceries"},
+        {"amount": 3, "category": "Groceries"},
+        [], None, "Tesco",
+    ],
+    "TransactionUpdate": [
+        {"amount": 1}, {"category": "Transfer"}, {}, {"amount": 1, "iban": "GB"}, {"description": 5},
+    ],
+    "Account": [{"title": "Savings"}, {"title": "ab"}, {"title": "a" * 16}, {"title": 12345}, {"title": "Savings", "iban": "GB"}, {}],
+    "Batch": [
+        {"operations": [{"operation_id": "x", "parameters": {"account_id": 1}, "body": {}}], "atomic": True},
+        {"operations": []},
+        {"operations": [{"operation_id": "x"}] * 101},
+        {"operations": [{"parameters": {}}]},
+        {"operations": [{"operation_id": "x", "other": 1}]},
+        {"operations": [{"operation_id": "x"}], "atomic": 1},
+        {"operations": "x"},
+    ],
+    "Transfer": [
+        {"description": "Savings", "amount": 5, "recipient_account_id": 2},
+        {"description": "Savings", "amount": 5, "recipient_account_id": 2.0},
+        {"description": "Savings", "amount": 5, "recipient_account_id": True},
+        {"description": "Savings", "amount": 5},
+    ],
+}
+
+@pytest.mark.parametrize("name", sorted(INSTANCES))
+def test_compiled_schema_matches_jsonschema(name):
+    from jsonschema import draft4_format_checker
+    from connexion.json_schema import Draft4RequestValidator
+    from project.validation import compile_schema
+    schema = resolved_schemas()[name]
+
+    check = compile_schema(schema)
+    assert check is not None
+    validator = Draft4RequestValidator(schema, format_checker=draft4_format_checker)
+    for instance in INSTANCES[name]:
+        assert check(instance) == validator.is_valid(instance), instance
+
+def test_unsupported_keywords_are_not_compiled():
+    from project.validation import compile_schema
+    assert compile_schema({"type": "object", "patternProperties": {"^a": {}}}) is None
+    assert compile_schema({"type": "object", "properties": {"a": {"anyOf": [{"type": "string"}]}}}) is None
+    assert compile_schema({"type": "object", "additionalProperties": {"type": "string"}}) is None
+    assert compile_schema({"type": "integer", "minimum": 1, "exclusiveMinimum": True}) is None
+    assert compile_schema({"type": "string", "nullable": True, "x-body-name": "a"})(None)
+
+def test_validator_map():
+    from project.validation import validator_map, CompiledRequestBodyValidator, CompiledParameterValidator
+    assert validator_map("full") is None
+    assert validator_map("full", is_production=True) is None
+    assert validator_map("development") is None
+    assert validator_map("development", is_production=True) == {"body": CompiledRequestBodyValidator, "parameter": CompiledParameterValidator}
+    assert validator_map("compiled")["body"] is CompiledRequestBodyValidator
+    with pytest.raises(ValueError):
+        validator_map("fast")
@@ -0,0 +1,131 @@
+import pytest
+import decimal
+import threading
+from datetime import datetime, timedelta
+import pytz
+
+
+@pytest.fixture()
+def accounts(db_initialiser):
+    Account, Transaction, db_session = db_initialiser
+    first = Account(title="Main", iban="GB29000060161331920001")
+    second = Account(title="Savings", iban="GB29000060161331920002")
+    db_session.add_all([first, second])
+    db_session.commit()
+    return first.id, second.id
+
+@pytest.fixture()
+def write_queue():
+    from project.transactions.write_queue import WriteQueue
+    write_queue = WriteQueue(max_batch=50, max_delay_ms=20)
+    yield write_queue
+    write_queue.stop()
+
+
+def test_write_queue_saldos_in_submission_order(accounts, write_queue, db_initialiser):
+    _, Transaction, _ = db_initialiser
+    first_id, second_id = accounts
+
+    futures = [write_queue.submit(account_id, "Queued", amount, "Groceries")
+               for account_id, amount in [(first_id, 100), (second_id, 10), (first_id, -30), (first_id, 5.5), (second_id, -2)]]
+    results = [future.result(timeout=5) for future in futures]
+
+    assert [row.saldo for row in results] == [decimal.Decimal("100"), decimal.Decimal("10"), decimal.Decimal("70"), decimal.Decimal("75.5"), decimal.Decimal("8")]
+    for row in results:
+        assert Transaction.query.get(row.id).saldo == row.saldo
+        assert row.account_id in accounts and row.description == "Queued"
+
+def test_write_queue_matches_calculate_saldo(accounts, write_queue, db_initialiser):
+    from project.transactions.transactions import create_transaction
+    Account, Transaction, db_session = db_initialiser
+    first_id, _ = accounts
+    now = datetime.utcnow().replace(tzinfo=pytz.UTC)
+
+    create_transaction(account=Account.query.get(first_id), description="Stored", amount=50, category="Salary", utc_datetime_booked=now - timedelta(days=3))
+    create_transaction(account=Account.query.get(first_id), description="Stored", amount=20, category="Salary", utc_datetime_booked=now - timedelta(days=1))
+
+    # Booked before/between/after the stored transactions and each other
+    submitted = [(now - timedelta(days=2), -5), (now, 7), (now - timedelta(days=4), 1), (now - timedelta(hours=1), 3)]
+    futures = [write_queue.submit(first_id, "Queued", amount, "Groceries", booked) for booked, amount in submitted]
+    queued_saldos = [future.result(timeout=5).saldo for future in futures]
+
+    # Same requests, one after another, through create_transaction
+    Transaction.query.filter(Transaction.description == "Queued").delete()
+    db_session.commit()
+    expected_saldos = []
+    for booked, amount in submitted:
+        _, _, transaction_id = create_transaction(account=Account.query.get(first_id), description="Sequential", amount=amount, category="Groceries", utc_datetime_booked=booked)
+        expected_saldos.append(Transaction.query.get(transaction_id).saldo)
+
+    assert queued_saldos == expected_saldos
+
+def test_write_queue_same_booking_time(accounts, write_queue):
+    first_id, _ = accounts
+    booked = datetime.utcnow().replace(tzinfo=pytz.UTC) - timedelta(days=1)
+
+    # Neither of two transactions booked at the same time is older than the other
+    submitted = [(booked, 10), (booked, 5), (booked - timedelta(hours=1), 1), (booked + timedelta(hours=1), 2)]
+    futures = [write_queue.submit(first_id, "Queued", amount, "Groceries", booked) for booked, amount in submitted]
+
+    assert [future.result(timeout=5).saldo for future in futures] == [decimal.Decimal(saldo) for saldo in [10, 5, 1, 18]]
+
+def test_write_queue_invalid_transaction(accounts, write_queue):
+    first_id, _ = accounts
+    with pytest.raises(ValueError):
+        write_queue.submit(first_id, "Queued", 0, "Groceries")
+    with pytest.raises(ValueError):
+        write_queue.submit(first_id, "Queued", 10, "Not a category")
+
+def test_write_queue_failed_row_only_fails_own_future(accounts, db_initialiser):
+    from sqlalchemy.exc import IntegrityError
+    from project.transactions.write_queue import WriteQueue
+    _, Transaction, _ = db_initialiser
+    first_id, _ = accounts
+    write_queue = WriteQueue(max_batch=3, max_delay_ms=1000) # One group of all three
+
+    try:
+        futures = [write_queue.submit(account_id, "Queued", amount, "Groceries") for account_id, amount in [(first_id, 100), (999999, 10), (first_id, -30)]]
+        with pytest.raises(IntegrityError): # No such account
+            futures[1].result(timeout=5)
+        results = [futures[0].result(timeout=5), futures[2].result(timeout=5)]
+    finally:
+        write_queue.stop()
+
+    assert [row.saldo for row in results] == [decimal.Decimal("100"), decimal.Decimal("70")]
+    assert sorted(transaction.amount for transaction in Transaction.query.all()) == [decimal.Decimal("-30"), decimal.Decimal("100")]
+
+def test_write_queue_concurrent_submits(accounts, write_queue, db_initialiser):
+    _, Transaction, _ = db_initialiser
+    first_id, _ = accounts
+    results = []
+
+    def submit_many():
+        for _ in range(25):
+            results.append(write_queue.submit(first_id, "Queued", 1, "Groceries").result(timeout=5))
+
+    threads = [threading.Thread(target=submit_many) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert Transaction.query.count() == 100
+    assert sorted(row.saldo for row in results) == [decimal.Decimal(n) for n in range(1, 101)]
+
+def test_api_create_transaction_with_write_queue(accounts, app_initialiser):
+    from project.transactions.write_queue import write_queue
+    app = app_initialiser[0]
+    app.config["TRANSACTION_WRITE_QUEUE"] = True
+    client = app.test_client()
+    first_id, second_id = accounts
+
+    try:
+        response = client.post(f'/api/accounts/{first_id}/transactions', json={"description": "Queued", "amount": 50, "category": "Salary"})
+        assert response.status_code == 201
+        assert response.json["saldo"] == 50
+
+        response = client.post(f'/api/accounts/{first_id}/subaccount_transfer', json={"description": "Queued", "amount": 20, "recipient_account_id": second_id})
+        assert response.status_code == 201
+        assert sorted(transaction["saldo"] for transaction in response.json["transactions"]) == [20, 30]
+    finally:
+        write_queue.stop()